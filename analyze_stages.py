@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Stage difficulty analyzer.
+
+Reads a Bounce journal file (the JSON written by BounceActivity.write_file), plays every stage in it against a set
+of scripted player models using the batch simulation, and reports the player win rate, the average rally length
+and the points scored per minute, each with a 95% confidence interval.  The work is spread over a multiprocessing
+pool, one task per stage, model and chunk of matches.
+
+Usage: analyze_stages.py [options] JOURNAL_FILE
+"""
+
+import sys, math, time, optparse, multiprocessing
+
+try:
+    import json
+    json.dumps
+except (ImportError, AttributeError):
+    import simplejson as json
+
+import numpy as np
+
+from simulation import to_fixed, EVENT_PADDLE1, EVENT_PADDLE2
+from batchsim import BatchWorld, BatchInputs
+
+# Match rules, as implemented by the ScoreSequence in bounce.py.
+WIN_SCORE = 5
+SCORE_PAUSE_FRAMES = 20
+
+# Simulation steps per second (BounceActivity.tickrate), which is what match lengths count in.  Not the drawing
+# frame rate, limitfps.
+DEFAULT_FPS = 20.0
+
+# z for a 95% confidence interval.
+CONFIDENCE_Z = 1.96
+
+# Scripted player models.  Each model fills in a BatchInputs from the current state of a BatchWorld.
+class TrackerModel:
+    """Follows the ball exactly and always pushes forward when the ball is about to reach the paddle."""
+    def __init__(self, n, rng):
+        pass
+
+    def update(self, world, inputs):
+        inputs.penx[:] = world.ball_pos.x / 256.0
+        inputs.peny[:] = world.ball_pos.y / 256.0
+        inputs.forward[:] = (world.ball_vel.z < 0) & (world.ball_pos.z < to_fixed(30))
+
+class PassiveModel:
+    """Follows the ball exactly but never pushes forward."""
+    def __init__(self, n, rng):
+        pass
+
+    def update(self, world, inputs):
+        inputs.penx[:] = world.ball_pos.x / 256.0
+        inputs.peny[:] = world.ball_pos.y / 256.0
+        inputs.forward[:] = False
+
+class CasualModel:
+    """Follows the ball with a reaction delay and some aiming error, and sometimes forgets to push forward."""
+    DELAY = 4
+    AIM_ERROR = 8.0
+    FORWARD_CHANCE = 0.5
+
+    def __init__(self, n, rng):
+        self.rng = rng
+        self.history = []
+        self.swing = rng.random_sample(n) < self.FORWARD_CHANCE
+
+    def update(self, world, inputs):
+        self.history.append((world.ball_pos.x / 256.0, world.ball_pos.y / 256.0))
+        x, y = self.history[0]
+        if len(self.history) > self.DELAY:
+            del self.history[0]
+
+        n = len(x)
+        inputs.penx[:] = x + self.rng.normal(0, self.AIM_ERROR, n)
+        inputs.peny[:] = y + self.rng.normal(0, self.AIM_ERROR, n)
+
+        # Decide whether to swing once per rally, when the ball starts heading towards the player.
+        incoming = world.ball_vel.z < 0
+        turned = incoming & (world.ball_lastvel.z >= 0)
+        self.swing[turned] = self.rng.random_sample(turned.sum()) < self.FORWARD_CHANCE
+        inputs.forward[:] = self.swing & incoming & (world.ball_pos.z < to_fixed(30))
+
+MODELS = {
+    'tracker': TrackerModel,
+    'passive': PassiveModel,
+    'casual': CasualModel,
+}
+
+def simulate(task):
+    """Plays a chunk of matches on one stage against one player model.  Returns per-match arrays of results."""
+    stage_index, desc, model_name, matches, max_frames, seed = task
+
+    rng = np.random.RandomState(seed)
+    world = BatchWorld(matches)
+    world.setup(desc)
+    model = MODELS[model_name](matches, rng)
+    inputs = BatchInputs(matches)
+
+    done = np.zeros(matches, dtype=bool)
+    frames = np.zeros(matches, dtype=np.int64)
+    hits = np.zeros(matches, dtype=np.int64)
+    score1 = np.zeros(matches, dtype=np.int64)
+    score2 = np.zeros(matches, dtype=np.int64)
+
+    for frame in range(max_frames):
+        model.update(world, inputs)
+        events = world.step(inputs)
+
+        live = ~done
+        frames[live] += 1
+        hits[live] += (events[live] & (1 << EVENT_PADDLE1)) != 0
+        hits[live] += (events[live] & (1 << EVENT_PADDLE2)) != 0
+
+        finished = live & ((world.paddle1_score >= WIN_SCORE) | (world.paddle2_score >= WIN_SCORE))
+        score1[finished] = world.paddle1_score[finished]
+        score2[finished] = world.paddle2_score[finished]
+        done |= finished
+        if done.all():
+            break
+
+    # Matches that ran out of time keep the score they reached.
+    score1[~done] = world.paddle1_score[~done]
+    score2[~done] = world.paddle2_score[~done]
+
+    return stage_index, model_name, done, frames, hits, score1, score2
+
+def mean_interval(values):
+    """Returns the mean of values and the half width of its confidence interval."""
+    n = len(values)
+    if n == 0:
+        return float('nan'), float('nan')
+    mean = values.mean()
+    if n < 2:
+        return mean, float('nan')
+    return mean, CONFIDENCE_Z * values.std(ddof=1) / math.sqrt(n)
+
+def proportion_interval(successes, n):
+    """Wilson score interval for a proportion.  Returns (low, high)."""
+    if n == 0:
+        return float('nan'), float('nan')
+    z2 = CONFIDENCE_Z * CONFIDENCE_Z
+    p = float(successes) / n
+    center = (p + z2 / (2*n)) / (1 + z2/n)
+    half = CONFIDENCE_Z * math.sqrt(p*(1-p)/n + z2/(4*n*n)) / (1 + z2/n)
+    return center - half, center + half
+
+def summarize(results, fps):
+    done, frames, hits, score1, score2 = results
+    points = score1 + score2
+    wins = (done & (score1 >= WIN_SCORE)).sum()
+    n = len(done)
+
+    scored = points > 0
+    rally = hits[scored].astype(float) / points[scored]
+
+    minutes = (frames + SCORE_PAUSE_FRAMES * points) / fps / 60.0
+    ppm = points / minutes
+
+    return {
+        'matches': n,
+        'timeouts': int(n - done.sum()),
+        'win_rate': float(wins) / n,
+        'win_rate_ci': proportion_interval(wins, n),
+        'rally': mean_interval(rally),
+        'points_per_minute': mean_interval(ppm),
+    }
+
+def load_stages(path):
+    fd = open(path, 'r')
+    try:
+        data = fd.read()
+    finally:
+        fd.close()
+    return json.loads(data)['Stages']
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] JOURNAL_FILE')
+    parser.add_option('-m', '--matches', type='int', default=200,
+                      help='matches to play per stage and model [default: %default]')
+    parser.add_option('-p', '--models', default=','.join(sorted(MODELS.keys())),
+                      help='comma separated player models [default: %default]')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+                      help='worker processes [default: %default]')
+    parser.add_option('-c', '--chunk', type='int', default=500,
+                      help='matches simulated together by a worker [default: %default]')
+    parser.add_option('-t', '--max-minutes', type='float', default=5.0,
+                      help='give up on a match after this much game time [default: %default]')
+    parser.add_option('--fps', type='float', default=DEFAULT_FPS,
+                      help='game frame rate used to convert frames to time [default: %default]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='random seed [default: %default]')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print the results as JSON')
+    options, args = parser.parse_args(argv[1:])
+
+    if len(args) != 1:
+        parser.error('expected a single journal file')
+
+    models = options.models.split(',')
+    for m in models:
+        if m not in MODELS:
+            parser.error('unknown player model: %s' % m)
+
+    stages = load_stages(args[0])
+    max_frames = int(options.max_minutes * 60 * options.fps)
+
+    # Split the work into tasks so that every core stays busy even for small stage packs.
+    tasks = []
+    for i, desc in enumerate(stages):
+        for m in models:
+            left = options.matches
+            while left > 0:
+                n = min(left, options.chunk)
+                tasks.append((i, desc, m, n, max_frames, options.seed + len(tasks)))
+                left -= n
+
+    start = time.time()
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        chunks = pool.map(simulate, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    # Merge the chunks of each stage and model.
+    merged = {}
+    for stage_index, model_name, done, frames, hits, score1, score2 in chunks:
+        key = (stage_index, model_name)
+        if key not in merged:
+            merged[key] = [[], [], [], [], []]
+        for lst, a in zip(merged[key], (done, frames, hits, score1, score2)):
+            lst.append(a)
+
+    results = []
+    for i, desc in enumerate(stages):
+        for m in models:
+            r = summarize([np.concatenate(lst) for lst in merged[(i, m)]], options.fps)
+            r['stage'] = desc['Name']
+            r['model'] = m
+            results.append(r)
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('%-16s %-8s %20s %16s %16s %s' % ('stage', 'model', 'win rate', 'rally', 'points/min', 'timeouts'))
+        for r in results:
+            print('%-16s %-8s %5.1f%% [%5.1f-%5.1f%%] %7.2f +- %-5.2f %7.2f +- %-5.2f %d' % (
+                r['stage'][:16], r['model'],
+                100*r['win_rate'], 100*r['win_rate_ci'][0], 100*r['win_rate_ci'][1],
+                r['rally'][0], r['rally'][1],
+                r['points_per_minute'][0], r['points_per_minute'][1],
+                r['timeouts']))
+        print('%d stages, %d matches in %.2fs using %d processes' % (
+            len(stages), len(stages)*len(models)*options.matches, elapsed, options.jobs))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
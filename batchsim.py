@@ -0,0 +1,393 @@
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Vectorized batch version of the Bounce simulation.
+
+BatchWorld keeps N independent matches as struct-of-arrays NumPy buffers and advances all of them at once with
+step().  The physics is a line-by-line translation of simulation.Ball.update, Paddle.update_player and
+Paddle.update_ai, using the same fixed point units, the same time_res and the same rules for ordering and ending
+the collisions within a frame, so every match evolves exactly like a simulation.World given the same inputs.
+
+Requires NumPy.  Unlike the rest of the game this module is only used by offline tools.
+"""
+
+import numpy as np
+
+from simulation import to_fixed, time_res
+from simulation import EVENT_SCORE1, EVENT_SCORE2, EVENT_PADDLE1, EVENT_PADDLE2, EVENT_WALL
+from simulation import PRIORITY_PADDLE1, PRIORITY_PADDLE2
+
+# All fixed point state is kept as 64 bit integers so that the intermediate products (velocity * time_res) can
+# never overflow.
+fixed_t = np.int64
+
+# Stage window, which is the same for every stage.
+WINDOW_RIGHT = to_fixed(99)
+WINDOW_BOTTOM = to_fixed(99)
+
+def _desc_array(descs, key, fixed=True):
+    if fixed:
+        return np.array([to_fixed(d[key]) for d in descs], dtype=fixed_t)
+    else:
+        return np.array([d[key] for d in descs], dtype=fixed_t)
+
+class BatchVector:
+    """Array of N three dimensional fixed point vectors."""
+    def __init__(self, n):
+        self.x = np.zeros(n, dtype=fixed_t)
+        self.y = np.zeros(n, dtype=fixed_t)
+        self.z = np.zeros(n, dtype=fixed_t)
+
+    def copy_from(self, v):
+        self.x[:] = v.x
+        self.y[:] = v.y
+        self.z[:] = v.z
+
+class BatchInputs:
+    """Player inputs for N matches.  Matches simulation.Inputs: penx and peny are in stage units (0-100) and forward
+    is nonzero while the paddle is pushed forward."""
+    def __init__(self, n):
+        self.penx = np.empty(n)
+        self.peny = np.empty(n)
+        self.penx.fill(50)
+        self.peny.fill(50)
+        self.forward = np.zeros(n, dtype=bool)
+
+class BatchWorld:
+    def __init__(self, n):
+        self.n = n
+
+        # Stage.
+        self.depth = np.zeros(n, dtype=fixed_t)
+        self.gravity = np.zeros(n, dtype=fixed_t)
+        self.crossgravity = np.zeros(n, dtype=fixed_t)
+
+        # Ball.
+        self.ball_pos = BatchVector(n)
+        self.ball_vel = BatchVector(n)
+        self.ball_lastpos = BatchVector(n)
+        self.ball_lastvel = BatchVector(n)
+        self.ball_size = np.zeros(n, dtype=fixed_t)
+        self.ball_speed = np.zeros(n, dtype=fixed_t)
+
+        # Player paddle.
+        self.paddle1_pos = BatchVector(n)
+        self.paddle1_delta = BatchVector(n)
+        self.paddle1_halfwidth = np.zeros(n, dtype=fixed_t)
+        self.paddle1_halfheight = np.zeros(n, dtype=fixed_t)
+        self.paddle1_defaultz = np.zeros(n, dtype=fixed_t)
+        self.paddle1_forwardz = np.zeros(n, dtype=fixed_t)
+        self.paddle1_score = np.zeros(n, dtype=np.int32)
+
+        # AI paddle.
+        self.paddle2_pos = BatchVector(n)
+        self.paddle2_vel = BatchVector(n)
+        self.paddle2_delta = BatchVector(n)
+        self.paddle2_halfwidth = np.zeros(n, dtype=fixed_t)
+        self.paddle2_halfheight = np.zeros(n, dtype=fixed_t)
+        self.paddle2_score = np.zeros(n, dtype=np.int32)
+
+        # AI.
+        self.ai_speed = np.zeros(n, dtype=fixed_t)
+        self.ai_recenter = np.zeros(n, dtype=bool)
+
+        self.frame = 0
+
+    def setup(self, descs):
+        """Sets up every match from a stage description.  descs is either a single description used for all the
+        matches, or a sequence of N descriptions."""
+        if isinstance(descs, dict):
+            descs = [descs] * self.n
+        if len(descs) != self.n:
+            raise ValueError('expected %d stage descriptions, got %d' % (self.n, len(descs)))
+
+        # Stage.setup
+        self.depth[:] = _desc_array(descs, 'StageDepth')
+        self.gravity[:] = _desc_array(descs, 'StageYGravity')
+        self.crossgravity[:] = _desc_array(descs, 'StageXGravity')
+
+        # Ball.setup
+        self.ball_size[:] = _desc_array(descs, 'BallSize')
+        self.ball_speed[:] = _desc_array(descs, 'BallSpeed')
+        self.ball_pos.x[:] = to_fixed(50)
+        self.ball_pos.y[:] = to_fixed(25)
+        self.ball_pos.z[:] = self.depth // 2
+        self.ball_vel.x[:] = to_fixed(2)
+        self.ball_vel.y[:] = to_fixed(2)
+        self.ball_vel.z[:] = self.ball_speed
+
+        # AI.setup
+        self.ai_speed[:] = _desc_array(descs, 'AISpeed')
+        self.ai_recenter[:] = _desc_array(descs, 'AIRecenter', fixed=False) != 0
+
+        # Paddle.setup_player
+        self.paddle1_halfwidth[:] = _desc_array(descs, 'PaddleWidth')
+        self.paddle1_halfheight[:] = _desc_array(descs, 'PaddleHeight')
+        self.paddle1_delta.x[:] = 0
+        self.paddle1_delta.y[:] = 0
+        self.paddle1_delta.z[:] = 0
+        self.paddle1_pos.x[:] = to_fixed(25)
+        self.paddle1_pos.y[:] = to_fixed(50)
+        self.paddle1_pos.z[:] = to_fixed(10)
+        self._clip_position(self.paddle1_pos, self.paddle1_halfwidth, self.paddle1_halfheight)
+        self.paddle1_defaultz[:] = self.paddle1_pos.z
+        self.paddle1_forwardz[:] = to_fixed(40)
+        self.paddle1_score[:] = 0
+
+        # Paddle.setup_ai
+        self.paddle2_halfwidth[:] = self.paddle1_halfwidth
+        self.paddle2_halfheight[:] = self.paddle1_halfheight
+        self.paddle2_pos.x[:] = to_fixed(75)
+        self.paddle2_pos.y[:] = to_fixed(50)
+        self.paddle2_pos.z[:] = self.depth - to_fixed(10)
+        self.paddle2_vel.x[:] = 0
+        self.paddle2_vel.y[:] = 0
+        self.paddle2_vel.z[:] = 0
+        self.paddle2_delta.x[:] = 0
+        self.paddle2_delta.y[:] = 0
+        self.paddle2_delta.z[:] = 0
+        self.paddle2_score[:] = 0
+        self._clip_position(self.paddle2_pos, self.paddle2_halfwidth, self.paddle2_halfheight)
+
+        self.frame = 0
+
+    def _clip_position(self, pos, halfwidth, halfheight):
+        np.maximum(pos.x, halfwidth, out=pos.x)
+        np.maximum(pos.y, halfheight, out=pos.y)
+        np.minimum(pos.x, WINDOW_RIGHT - halfwidth, out=pos.x)
+        np.minimum(pos.y, WINDOW_BOTTOM - halfheight, out=pos.y)
+
+    def _update_player(self, inputs):
+        pos = self.paddle1_pos
+        delta = self.paddle1_delta
+
+        lastx = pos.x.copy()
+        lasty = pos.y.copy()
+        lastz = pos.z.copy()
+
+        targetz = np.where(inputs.forward, self.paddle1_forwardz, self.paddle1_defaultz)
+
+        # Snaps forward, eases back.
+        m = pos.z < targetz
+        delta.z[m & (delta.z < to_fixed(4))] = to_fixed(6)
+        pos.z[m] += delta.z[m] + to_fixed(2)
+        pos.z[m] = np.minimum(pos.z[m], targetz[m])
+
+        m = pos.z > targetz
+        pos.z[m] += (targetz[m] - pos.z[m]) // 4
+
+        # Get the 2d position from the pen.  Truncation matches int() in to_fixed.
+        pos.x[:] = np.trunc(inputs.penx * 256)
+        pos.y[:] = np.trunc(inputs.peny * 256)
+        self._clip_position(pos, self.paddle1_halfwidth, self.paddle1_halfheight)
+
+        delta.x[:] = pos.x - lastx
+        delta.y[:] = pos.y - lasty
+        delta.z[:] = pos.z - lastz
+
+    def _update_ai(self):
+        pos = self.paddle2_pos
+        vel = self.paddle2_vel
+        bpos = self.ball_pos
+        bvel = self.ball_vel
+
+        lastx = pos.x.copy()
+        lasty = pos.y.copy()
+
+        chase = (bvel.z > 0) | ((bvel.z < 0) & (bpos.z < to_fixed(30)))
+
+        # Acceleration towards the ball.
+        far = chase & (np.abs(pos.x - bpos.x) > to_fixed(5))
+        vel.x[far] += (to_fixed(4) * np.sign(bpos.x - pos.x))[far]
+        far = chase & (np.abs(pos.y - bpos.y) > to_fixed(5))
+        vel.y[far] += (to_fixed(4) * np.sign(bpos.y - pos.y))[far]
+
+        # Speed clamping
+        vel.x[chase] = np.clip(vel.x, -self.ai_speed, self.ai_speed)[chase]
+        vel.y[chase] = np.clip(vel.y, -self.ai_speed, self.ai_speed)[chase]
+
+        # Drift towards the center.
+        idle = ~chase & (bpos.z < self.depth // 2)
+        vel.x[idle] = 0
+        vel.y[idle] = 0
+        recenter = idle & self.ai_recenter
+        pos.x[recenter] += (to_fixed(50) - pos.x[recenter]) // 4
+        pos.y[recenter] += (to_fixed(50) - pos.y[recenter]) // 4
+
+        # Friction
+        vel.x -= np.sign(vel.x)
+        vel.y -= np.sign(vel.y)
+
+        pos.x += vel.x
+        pos.y += vel.y
+        self._clip_position(pos, self.paddle2_halfwidth, self.paddle2_halfheight)
+
+        self.paddle2_delta.x[:] = pos.x - lastx
+        self.paddle2_delta.y[:] = pos.y - lasty
+
+    def _sweep(self, facing, pos, delta, halfwidth, halfheight, time_left):
+        """Swept ball against paddle test, see simulation.Paddle.sweep.  Returns the mask of matches where the ball
+        hits the paddle, the time of impact and the point hit relative to the paddle center."""
+        bpos = self.ball_pos
+        bvel = self.ball_vel
+        size = self.ball_size
+        elapsed = time_res - time_left
+
+        gap = facing * (bpos.z - (pos.z - delta.z + delta.z * elapsed // time_res))
+        rate = facing * (bvel.z - delta.z)
+        hit = (gap >= 0) & (rate < 0) & (gap + rate * time_left // time_res <= 0)
+
+        t = np.minimum(gap * time_res // -rate, time_left)
+
+        when = elapsed + t
+        x = bpos.x + bvel.x * t // time_res - (pos.x - delta.x + delta.x * when // time_res)
+        y = bpos.y + bvel.y * t // time_res - (pos.y - delta.y + delta.y * when // time_res)
+        hit &= (x <= halfwidth + size) & (x >= -halfwidth - size)
+        hit &= (y <= halfheight + size) & (y >= -halfheight - size)
+
+        return hit, t, x, y
+
+    def _update_ball(self):
+        """Returns a per-match bitmask of the collision events (1 << EVENT_*) that happened this frame."""
+        n = self.n
+        pos = self.ball_pos
+        vel = self.ball_vel
+        size = self.ball_size
+        p1 = self.paddle1_pos
+        p1d = self.paddle1_delta
+        p2 = self.paddle2_pos
+
+        self.ball_lastpos.copy_from(pos)
+        self.ball_lastvel.copy_from(vel)
+
+        events = np.zeros(n, dtype=np.int32)
+        time_left = np.empty(n, dtype=fixed_t)
+        time_left.fill(time_res)
+
+        # Matches that are still resolving collisions this frame.
+        active = np.ones(n, dtype=bool)
+
+        first_time = np.empty(n, dtype=fixed_t)
+        first_vx = np.empty(n, dtype=fixed_t)
+        first_vy = np.empty(n, dtype=fixed_t)
+        first_vz = np.empty(n, dtype=fixed_t)
+        first_type = np.empty(n, dtype=np.int32)
+        first_surface = np.empty(n, dtype=np.int32)
+
+        # Bitmask of the surfaces hit since the frame time last moved forward, see simulation.Ball.update.
+        wedged = np.zeros(n, dtype=np.int32)
+
+        def candidate(hit, t, vx, vy, vz, kind, priority):
+            # Record a collision where it happens before the current first collision.  Walls replace only strictly
+            # earlier collisions, paddles also replace simultaneous ones.  This is simulation.first_impact.
+            if priority < 0:
+                earlier = (first_time == -1) | (t <= first_time)
+            else:
+                earlier = (first_time == -1) | (t < first_time)
+            m = hit & earlier
+            first_time[m] = t[m]
+            first_vx[m] = vx[m]
+            first_vy[m] = vy[m]
+            first_vz[m] = vz[m]
+            first_type[m] = kind
+            first_surface[m] = 1 << (priority - PRIORITY_PADDLE1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            while active.any():
+
+                # Calculate new next ball position.
+                nx = pos.x + (vel.x * time_left) // time_res
+                ny = pos.y + (vel.y * time_left) // time_res
+                nz = pos.z + (vel.z * time_left) // time_res
+
+                first_time.fill(-1)
+
+                # Walls, in the order of Stage.planes.  A wall can't be hit with no velocity towards it.
+                candidate(active & (nx - size <= 0) & (vel.x != 0),
+                          (pos.x - size) * time_res // -vel.x, -vel.x, vel.y, vel.z, EVENT_WALL, 0)
+                candidate(active & (nx + size >= WINDOW_RIGHT) & (vel.x != 0),
+                          (WINDOW_RIGHT - (pos.x + size)) * time_res // vel.x, -vel.x, vel.y, vel.z, EVENT_WALL, 1)
+                candidate(active & (ny - size <= 0) & (vel.y != 0),
+                          (pos.y - size) * time_res // -vel.y, vel.x, -vel.y, vel.z, EVENT_WALL, 2)
+                candidate(active & (ny + size >= WINDOW_BOTTOM) & (vel.y != 0),
+                          (WINDOW_BOTTOM - (pos.y + size)) * time_res // vel.y, vel.x, -vel.y, vel.z, EVENT_WALL, 3)
+                candidate(active & (nz <= 0) & (vel.z != 0),
+                          pos.z * time_res // -vel.z, vel.x, vel.y, self.ball_speed, EVENT_SCORE2, 4)
+                candidate(active & (nz >= self.depth) & (vel.z != 0),
+                          (self.depth - pos.z) * time_res // vel.z, vel.x, vel.y, -self.ball_speed, EVENT_SCORE1, 5)
+
+                # Player paddle.
+                hit, t, hitx, hity = self._sweep(1, p1, p1d, self.paddle1_halfwidth, self.paddle1_halfheight,
+                                                 time_left)
+                fwd = p1d.z > 0
+                vx = vel.x + fwd * (2*256 * (hitx > 20) - 2*256 * (hitx < -20))
+                vy = vel.y + fwd * (2*256 * (hity > 15) - 2*256 * (hity < -15))
+                vz = -vel.z + fwd * (4*246)
+                candidate(active & (vel.z < 0) & hit, t, vx, vy, vz, EVENT_PADDLE1, PRIORITY_PADDLE1)
+
+                # Computer paddle.
+                hit, t, hitx, hity = self._sweep(-1, p2, self.paddle2_delta, self.paddle2_halfwidth,
+                                                 self.paddle2_halfheight, time_left)
+                vz = -vel.z + (p1d.z != 0) * 2*256
+                candidate(active & (vel.z > 0) & hit, t, vel.x, vel.y, vz, EVENT_PADDLE2, PRIORITY_PADDLE2)
+
+                # A wedged ball stops resolving collisions for the rest of the frame.
+                m = first_time != -1
+                stuck = m & ((wedged & first_surface) != 0)
+                active &= ~stuck
+                m &= ~stuck
+
+                # Advance the ball to the point of the first collision.
+                t = first_time[m]
+                pos.x[m] += vel.x[m] * t // time_res
+                pos.y[m] += vel.y[m] * t // time_res
+                pos.z[m] += vel.z[m] * t // time_res
+                vel.x[m] = first_vx[m]
+                vel.y[m] = first_vy[m]
+                vel.z[m] = first_vz[m]
+                time_left[m] -= t
+                events[m] |= 1 << first_type[m]
+                wedged[m & (first_time > 0)] = 0
+                wedged[m] |= first_surface[m]
+
+                active &= m & (time_left > 0)
+
+        # If there's time left in the frame w/o collision, finish it up.
+        m = time_left > 0
+        pos.x[m] += vel.x[m] * time_left[m] // time_res
+        pos.y[m] += vel.y[m] * time_left[m] // time_res
+        pos.z[m] += vel.z[m] * time_left[m] // time_res
+
+        # Apply gravity.
+        vel.y += self.gravity
+        vel.y[(pos.y + size + 20 > WINDOW_BOTTOM) & (vel.y == 0)] -= 6
+        vel.x += self.crossgravity
+
+        return events
+
+    def step(self, inputs):
+        """Advances every match by one animation frame.  Returns an array holding, for each match, a bitmask of the
+        collision events (1 << EVENT_*) that happened during the frame."""
+        self._update_player(inputs)
+        self._update_ai()
+        events = self._update_ball()
+
+        # Calculate scores if any collisions with the back walls happened.
+        self.paddle1_score += (events & (1 << EVENT_SCORE1)) != 0
+        self.paddle2_score += (events & (1 << EVENT_SCORE2)) != 0
+
+        self.frame += 1
+
+        return events
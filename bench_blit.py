@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Frame blit benchmark.
+
+Measures the cost of copying a whole frame from an offscreen gtk.gdk.Image to a window, the way
+BounceActivity.on_drawarea_expose does, for shared memory (MIT-SHM) images and for normal ones, at several
+resolutions.  Every blit is followed by a round trip to the X server, so the time includes the server finishing the
+copy.  When DISPLAY isn't set, a private Xvfb server is started for the run.
+
+Usage: bench_blit.py [options]
+"""
+
+import os, sys, time, optparse, subprocess
+
+DEFAULT_RESOLUTIONS = '600x412,1200x825,1200x900,1920x1200'
+
+# Display used for the private Xvfb server.
+XVFB_DISPLAY = ':97'
+
+def parse_resolutions(text):
+    resolutions = []
+    for r in text.split(','):
+        w, h = r.split('x')
+        resolutions.append((int(w), int(h)))
+    return resolutions
+
+def start_xvfb(resolutions):
+    width = max([w for w, h in resolutions])
+    height = max([h for w, h in resolutions])
+    server = subprocess.Popen(['Xvfb', XVFB_DISPLAY, '-screen', '0', '%dx%dx24' % (width, height), '-nolisten', 'tcp'])
+    os.environ['DISPLAY'] = XVFB_DISPLAY
+    # Give the server time to start accepting connections.
+    time.sleep(1.0)
+    return server
+
+def bench(gtk, image_type, width, height, frames):
+    """Returns the average seconds per frame of blitting a width x height image of the given type, or None if such
+    an image can't be created."""
+    visual = gtk.gdk.visual_get_system()
+    try:
+        image = gtk.gdk.Image(image_type, visual, width, height)
+    except RuntimeError:
+        return None
+    if image.type != image_type:
+        return None
+
+    window = gtk.Window()
+    window.set_default_size(width, height)
+    window.set_app_paintable(True)
+    window.set_double_buffered(False)
+    window.show()
+    while gtk.events_pending():
+        gtk.main_iteration()
+
+    display = gtk.gdk.display_get_default()
+    gc = window.get_style().fg_gc[gtk.STATE_NORMAL]
+    drawable = window.window
+
+    # Warm up, then time.
+    for i in range(10):
+        drawable.draw_image(gc, image, 0, 0, 0, 0, width, height)
+    display.sync()
+
+    start = time.time()
+    for i in range(frames):
+        drawable.draw_image(gc, image, 0, 0, 0, 0, width, height)
+        display.sync()
+    elapsed = time.time() - start
+
+    window.destroy()
+    while gtk.events_pending():
+        gtk.main_iteration()
+
+    return elapsed / frames
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--frames', type='int', default=500,
+                      help='frames blitted per resolution and image type [default: %default]')
+    parser.add_option('-r', '--resolutions', default=DEFAULT_RESOLUTIONS,
+                      help='comma separated WIDTHxHEIGHT list [default: %default]')
+    options, args = parser.parse_args(argv[1:])
+
+    resolutions = parse_resolutions(options.resolutions)
+
+    server = None
+    if not os.environ.get('DISPLAY'):
+        server = start_xvfb(resolutions)
+
+    try:
+        import pygtk
+        pygtk.require('2.0')
+        import gtk
+
+        print('%-10s %16s %16s %8s' % ('size', 'MIT-SHM', 'plain', 'speedup'))
+        for width, height in resolutions:
+            shared = bench(gtk, gtk.gdk.IMAGE_SHARED, width, height, options.frames)
+            normal = bench(gtk, gtk.gdk.IMAGE_NORMAL, width, height, options.frames)
+
+            columns = []
+            for t in (shared, normal):
+                if t is None:
+                    columns.append('%16s' % 'unavailable')
+                else:
+                    columns.append('%13.2f ms' % (t * 1000))
+            if shared and normal:
+                speedup = '%7.1fx' % (normal / shared)
+            else:
+                speedup = '%8s' % '-'
+            print('%-10s %s %s %s' % ('%dx%d' % (width, height), columns[0], columns[1], speedup))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
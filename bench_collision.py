@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Ball collision microbenchmark.
+
+Records the ball and paddle state of every frame of a set of scripted matches, then replays the ball update of
+each frame with both the event driven solver in simulation.Ball.update and the capped iteration loop it replaced,
+reporting frames per second for each.  The results of the two are compared, and any difference on a frame where the
+old loop did not hit its iteration cap is reported as a mismatch.  Frames where either solver hit a paddle are left
+out of the comparison, since the paddles are now swept through the frame rather than tested at their end position,
+and so are frames where the old loop left the ball outside the stage.
+
+Usage: bench_collision.py [options]
+"""
+
+import sys, math, time, random, optparse
+
+import simulation
+from simulation import *
+
+# Stages used to generate the frames, the defaults from bounce.py.
+STAGE_DESCS = [
+    { 'Name': 'practice', 'StageDepth': 160, 'StageXGravity': 0,   'StageYGravity': 0,   'BallSize': 1, 'BallSpeed':  2, 'PaddleWidth': 20, 'PaddleHeight': 20, 'AISpeed': 1, 'AIRecenter': 1, },
+    { 'Name': 'gravity',  'StageDepth': 160, 'StageXGravity': 0,   'StageYGravity': 0.5, 'BallSize': 1, 'BallSpeed':  2, 'PaddleWidth': 20, 'PaddleHeight': 20, 'AISpeed': 2, 'AIRecenter': 1, },
+    { 'Name': 'wide',     'StageDepth': 160, 'StageXGravity': 0,   'StageYGravity': 0.5, 'BallSize': 1, 'BallSpeed':  3, 'PaddleWidth': 50, 'PaddleHeight': 15, 'AISpeed': 3, 'AIRecenter': 1, },
+    { 'Name': 'deep',     'StageDepth': 500, 'StageXGravity': 0,   'StageYGravity': 0,   'BallSize': 1, 'BallSpeed': 10, 'PaddleWidth': 25, 'PaddleHeight': 25, 'AISpeed': 2.5, 'AIRecenter': 0, },
+    { 'Name': 'rotate',   'StageDepth': 160, 'StageXGravity': 0.5, 'StageYGravity': 0,   'BallSize': 1, 'BallSpeed':  5, 'PaddleWidth': 25, 'PaddleHeight': 20, 'AISpeed': 3, 'AIRecenter': 1, },
+]
+
+class IterativeBall(simulation.Ball):
+    def update (self, paddle1, paddle2, stage, events=None):
+        """The capped iteration loop that Ball.update used to run.  Sets self.capped when it gives up after 5
+        iterations."""
+        # Ball collisions are handled very accurately, as this is the basis of the game.
+        # All times are in 1sec/time_res units.
+        # 1. Loop through all the surfaces and finds the first one the ball will collide with
+        # in this animation frame (if any).
+        # 2. Update the Ball velocity based on the collision, and advance the current time to
+        # the exact time of the collision.
+        # 3. Goto step 1, until no collisions remain in the current animation frame.
+
+        time_left = time_res                  # Time remaining in this animation frame.
+        first_collision_time = 0              # -1 means no collision found.
+        first_collision_vel = Vector()    # New ball velocity from first collision.
+        first_collision_type = 0              # 0 for normal collision (wall), otherwise the scorezone number hit.
+
+        self.lastpos.x = self.pos.x
+        self.lastpos.y = self.pos.y
+        self.lastpos.z = self.pos.z
+        self.lastvel.x = self.vel.x
+        self.lastvel.y = self.vel.y
+        self.lastvel.z = self.vel.z
+
+        next_ball_pos = Vector()          # Hypothetical ball position assuming no collision.
+        cur_time = 0                            # cur_time of current collision.
+
+        collision_type = EVENT_NONE          # Stored return value.
+
+        iterations = 0
+        self.capped = False
+
+        while True:
+            iterations = iterations+1
+            if ( iterations > 5 ):
+                self.capped = True
+                break
+
+            # Calculate new next ball position.
+            next_ball_pos.x = self.pos.x + (self.vel.x * time_left) / time_res
+            next_ball_pos.y = self.pos.y + (self.vel.y * time_left) / time_res
+            next_ball_pos.z = self.pos.z + (self.vel.z * time_left) / time_res
+
+            # Reset first_collision_cur_time.
+            first_collision_cur_time = -1
+
+            # Check stage walls.  First checks to see if the boundary was crossed, if so then calculates cur_time, etc.
+            if ( next_ball_pos.x - self.size <= 0 ): # Left wall
+                cur_time = ( self.pos.x - self.size ) * time_res / -self.vel.x # negative Vx is to account for left wall facing.
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = -self.vel.x
+                    first_collision_vel.y = self.vel.y
+                    first_collision_vel.z = self.vel.z
+                    first_collision_type = EVENT_WALL
+            if ( next_ball_pos.x + self.size >= stage.window.right ): # Right wall
+                cur_time = ( stage.window.right - ( self.pos.x + self.size ) ) * time_res / self.vel.x
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = -self.vel.x
+                    first_collision_vel.y = self.vel.y
+                    first_collision_vel.z = self.vel.z
+                    first_collision_type = EVENT_WALL
+            if ( next_ball_pos.y - self.size <= 0 and self.vel.y != 0): # Top wall
+                cur_time = ( self.pos.y - self.size ) * time_res / -self.vel.y
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x
+                    first_collision_vel.y = -self.vel.y
+                    first_collision_vel.z = self.vel.z
+                    first_collision_type = EVENT_WALL
+            if ( next_ball_pos.y + self.size >= stage.window.bottom  and self.vel.y != 0): # Bottom wall
+                cur_time = ( stage.window.bottom - ( self.pos.y + self.size ) ) * time_res / self.vel.y
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x
+                    first_collision_vel.y = -self.vel.y
+                    first_collision_vel.z = self.vel.z
+                    first_collision_type = EVENT_WALL
+            if ( next_ball_pos.z <= 0 ): # Front wall
+                cur_time = self.pos.z * time_res / -self.vel.z
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x #(random.randint(0, 3))-1 * self.speed
+                    first_collision_vel.y = self.vel.y #(random.randint(0, 3))-1 * self.speed
+                    first_collision_vel.z = self.speed
+                    first_collision_type = EVENT_SCORE2
+            if ( next_ball_pos.z >= stage.depth ): # Back wall
+                cur_time = ( stage.depth - self.pos.z ) * time_res / self.vel.z
+                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x #(random.randint(0, 3))-1 * self.speed
+                    first_collision_vel.y = self.vel.y #(random.randint(0, 3))-1 * self.speed
+                    first_collision_vel.z = -self.speed
+                    first_collision_type = EVENT_SCORE1
+            # Paddle collision.  Paddle collisions are inaccurate, in that it doesn't take into account the velocity of
+            # the ball in its 2D check, it uses the original 2D position.
+            if (        self.vel.z < 0
+                    and ( self.pos.z >= paddle1.pos.z or self.pos.z >= paddle1.pos.z - math.fabs(paddle1.delta.z) )
+                    and ( next_ball_pos.z <= paddle1.pos.z or next_ball_pos.z <= paddle1.pos.z + math.fabs(paddle1.delta.z) )
+                    and self.pos.x >= paddle1.pos.x - paddle1.halfwidth
+                    and self.pos.x <= paddle1.pos.x + paddle1.halfwidth
+                    and self.pos.y >= paddle1.pos.y - paddle1.halfheight
+                    and self.pos.y <= paddle1.pos.y + paddle1.halfheight ):
+                cur_time = ( self.pos.z - paddle1.pos.z ) * time_res / -self.vel.z
+                if ( first_collision_cur_time == -1 or cur_time <= first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x
+                    first_collision_vel.y = self.vel.y
+                    first_collision_vel.z = -self.vel.z
+
+                    # If paddle is moving forward, bounce the ball off.
+                    if ( paddle1.delta.z > 0 ):
+                        first_collision_vel.z += 4*246
+
+                        # Apply some pong like angling based on where it hits the paddle.
+                        if ( next_ball_pos.x - paddle1.pos.x > 20 ):
+                            first_collision_vel.x += 2*256
+                        if ( next_ball_pos.x - paddle1.pos.x < -20 ):
+                            first_collision_vel.x -= 2*256
+
+                        if ( next_ball_pos.y - paddle1.pos.y > 15 ):
+                            first_collision_vel.y += 2*256
+                        if ( next_ball_pos.y - paddle1.pos.y < -15 ):
+                            first_collision_vel.y -= 2*256
+                    # Likewise if paddle is moving backwards, cushion it.
+                    #if ( paddle1.delta.z < 0 ):
+                    #    first_collision_vel.z -= 2*256
+
+                    first_collision_type = EVENT_PADDLE1
+            # Computer paddle.
+            if (        self.vel.z > 0
+                    and ( self.pos.z <= paddle2.pos.z )
+                    and ( next_ball_pos.z >= paddle2.pos.z )
+                    and self.pos.x >= paddle2.pos.x - paddle2.halfwidth
+                    and self.pos.x <= paddle2.pos.x + paddle2.halfwidth
+                    and self.pos.y >= paddle2.pos.y - paddle2.halfheight
+                    and self.pos.y <= paddle2.pos.y + paddle2.halfheight ): # Paddle 2
+                cur_time = ( paddle2.pos.z - self.pos.z ) * time_res / self.vel.z
+                if ( first_collision_cur_time == -1 or cur_time <= first_collision_cur_time ):
+                    # Set new first collision.
+                    first_collision_cur_time = cur_time
+                    first_collision_vel.x = self.vel.x
+                    first_collision_vel.y = self.vel.y
+                    first_collision_vel.z = -self.vel.z + ( paddle1.delta.z > 0 ) * 2*256 + ( paddle1.delta.z < 0 ) * 2*256
+                    first_collision_type = EVENT_PADDLE2
+
+            # Advance the ball to the point of the first collision.
+            if ( first_collision_cur_time != -1 ):
+                self.pos.x += self.vel.x * first_collision_cur_time / time_res
+                self.pos.y += self.vel.y * first_collision_cur_time / time_res
+                self.pos.z += self.vel.z * first_collision_cur_time / time_res
+                self.vel.x = first_collision_vel.x
+                self.vel.y = first_collision_vel.y
+                self.vel.z = first_collision_vel.z
+
+                time_left -= first_collision_cur_time
+                collision_type = first_collision_type
+                if events is not None:
+                    events.append(first_collision_type)
+            if ( not (first_collision_cur_time != -1 and time_left > 0) ):
+                break
+
+        # If there's time left in the frame w/o collision, finish it up.
+        if time_left > 0:
+            self.pos.x += self.vel.x * time_left / time_res
+            self.pos.y += self.vel.y * time_left / time_res
+            self.pos.z += self.vel.z * time_left / time_res
+
+        # Apply gravity.
+        self.vel.y += stage.gravity
+        if ( self.pos.y + self.size + 20 > stage.window.bottom and math.fabs(self.vel.y) == 0 ):
+            self.vel.y -= 6
+        self.vel.x += stage.crossgravity
+
+        return collision_type
+
+
+def copy_vector(v):
+    return Vector(v.x, v.y, v.z)
+
+def record_frames(frames_per_stage, seed, endless=False):
+    """Plays scripted matches on every stage and returns a list of (stage, ball, paddle1, paddle2) snapshots, taken
+    just before each ball update.  Unless endless is set, a new match is started whenever somebody wins."""
+    rnd = random.Random(seed)
+    frames = []
+    for desc in STAGE_DESCS:
+        world = World()
+        world.setup(desc)
+        error = 0
+        for i in range(frames_per_stage):
+            if i % 500 == 0:
+                error = rnd.choice([0, 5, 15])
+            ball = world.ball
+            inputs = Inputs(ball.pos.x/256.0 + rnd.uniform(-error, error),
+                            ball.pos.y/256.0 + rnd.uniform(-error, error),
+                            ball.pos.z < to_fixed(30) and rnd.random() < 0.7)
+            world.paddle1.update_player(inputs, world.stage)
+            world.paddle2.update_ai(world.ball, world.stage, world.ai)
+            frames.append((world.stage, (copy_vector(ball.pos), copy_vector(ball.vel), ball.size, ball.speed),
+                           (copy_vector(world.paddle1.pos), copy_vector(world.paddle1.delta),
+                            world.paddle1.halfwidth, world.paddle1.halfheight),
+                           (copy_vector(world.paddle2.pos), copy_vector(world.paddle2.delta),
+                            world.paddle2.halfwidth, world.paddle2.halfheight)))
+            events = []
+            world.ball.update(world.paddle1, world.paddle2, world.stage, events)
+
+            # Start a new match once somebody has won, like the game does.
+            if EVENT_SCORE1 in events:
+                world.paddle1.score += 1
+            if EVENT_SCORE2 in events:
+                world.paddle2.score += 1
+            if not endless and (world.paddle1.score >= 5 or world.paddle2.score >= 5):
+                world.setup(desc)
+    return frames
+
+def restore(ball, paddle1, paddle2, frame):
+    stage, b, p1, p2 = frame
+    ball.pos.x, ball.pos.y, ball.pos.z = b[0].x, b[0].y, b[0].z
+    ball.vel.x, ball.vel.y, ball.vel.z = b[1].x, b[1].y, b[1].z
+    ball.size, ball.speed = b[2], b[3]
+    for paddle, p in ((paddle1, p1), (paddle2, p2)):
+        paddle.pos, paddle.delta, paddle.halfwidth, paddle.halfheight = p
+    return stage
+
+def replay(ball, frames, update):
+    """Runs update on every frame.  Returns the elapsed time and the resulting ball states."""
+    paddle1 = Paddle()
+    paddle2 = Paddle()
+    results = []
+    start = time.time()
+    for frame in frames:
+        stage = restore(ball, paddle1, paddle2, frame)
+        events = []
+        try:
+            update(ball, paddle1, paddle2, stage, events)
+        except ZeroDivisionError:
+            results.append(None)
+            continue
+        results.append((ball.pos.x, ball.pos.y, ball.pos.z, ball.vel.x, ball.vel.y, ball.vel.z,
+                        getattr(ball, 'capped', False),
+                        EVENT_PADDLE1 in events or EVENT_PADDLE2 in events,
+                        not (0 <= ball.pos.x <= stage.window.right and 0 <= ball.pos.y <= stage.window.bottom
+                             and 0 <= ball.pos.z <= stage.depth)))
+    return time.time() - start, results
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-f', '--frames', type='int', default=20000,
+                      help='frames recorded per stage [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='timing runs, the best one is reported [default: %default]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='random seed [default: %default]')
+    parser.add_option('-e', '--endless', action='store_true', default=False,
+                      help='never end a match, which lets the ball speed build up far beyond normal play')
+    options, args = parser.parse_args(argv[1:])
+
+    frames = record_frames(options.frames, options.seed, options.endless)
+
+    def noop(ball, paddle1, paddle2, stage, events):
+        pass
+
+    timings = {}
+    for name, ball, update in (('overhead', Ball(), noop),
+                               ('iterative', IterativeBall(), IterativeBall.update),
+                               ('event', Ball(), Ball.update)):
+        best = None
+        for i in range(options.repeat):
+            elapsed, results = replay(ball, frames, update)
+            if best is None or elapsed < best:
+                best = elapsed
+        timings[name] = (best, results)
+
+    overhead = timings['overhead'][0]
+    for name in ('iterative', 'event'):
+        elapsed = max(timings[name][0] - overhead, 1e-9)
+        print('%-10s %10.0f frames/s' % (name, len(frames) / elapsed))
+
+    capped = crashed = paddled = escaped = mismatched = 0
+    for old, new in zip(timings['iterative'][1], timings['event'][1]):
+        if old is None:
+            crashed += 1
+        elif old[6]:
+            capped += 1
+        elif old[7] or new[7]:
+            paddled += 1
+        elif old[8]:
+            escaped += 1
+        elif old[:6] != new[:6]:
+            mismatched += 1
+    print('%d frames, %d hit the iteration cap, %d divided by zero, %d hit a paddle, %d escaped, %d mismatched' % (
+        len(frames), capped, crashed, paddled, escaped, mismatched))
+
+    return mismatched != 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Rasterizer benchmark.
+
+Times the pongc drawing primitives on render targets, so no display is needed.  Each primitive is run over a
+randomized workload at 16 and 32 bits per pixel and at several screen sizes, and reported in primitives per second
+and in megapixels per second, the pixels of a primitive being counted once by drawing it alone into a cleared
+target.  A full frame benchmark then replays the draw calls PlaySequence makes in bounce.py for the frames of a
+scripted match, starting each frame from the cached stage background the way Game.begin_draw does, and reports
+the hit rate of the ellipse shape cache over those frames.
+
+render_list draws on as many threads as set with --threads, which only affects the full frame benchmark since the
+primitives are called one at a time.  The results can be written as JSON with --output, to compare builds of the
+native library.
+
+Usage: bench_pongc.py [options]
+"""
+
+import sys, time, random, array, platform, optparse
+
+try:
+    import json
+    json.dumps
+except (ImportError, AttributeError):
+    import simplejson as json
+
+import numpy as np
+
+from pongc import *
+
+import simulation
+from simulation import World, Inputs
+
+DEFAULT_RESOLUTIONS = '1200x825,1920x1200,2560x1600'
+
+# Bits per pixel to benchmark, and the depth of a render target with pixels of that size.
+DEFAULT_BPP = '16,32'
+BPP_DEPTHS = { 16: 16, 32: 24 }
+
+# Viewport used by the game, see bounce.py.
+VIEWPORT_SCALE = simulation.to_fixed(100)
+
+# Stage played by the full frame benchmark, the first one in bounce.py.
+STAGE_DESC = { 'Name': 'practice', 'StageDepth': 160, 'StageXGravity': 0, 'StageYGravity': 0, 'BallSize': 1,
+               'BallSpeed': 2, 'PaddleWidth': 20, 'PaddleHeight': 20, 'AISpeed': 1, 'AIRecenter': 1, }
+
+# Primitives from the workload of a single call that are drawn alone to count their pixels.
+COVERAGE_SAMPLES = 200
+
+def parse_resolutions(text):
+    resolutions = []
+    for r in text.split(','):
+        w, h = r.split('x')
+        resolutions.append((int(w), int(h)))
+    return resolutions
+
+# Workloads.  Each returns a list of argument tuples for a primitive, following the image argument.  2x coordinates
+# cover the screen plus a margin around it, so that clipping gets exercised, and 3D ones cover the stage.
+def line_2x_args(rnd, width, height, n):
+    w, h = width/2, height/2
+    return [(rnd.randint(-w/8, w*9/8), rnd.randint(-h/8, h*9/8), rnd.randint(-w/8, w*9/8), rnd.randint(-h/8, h*9/8),
+             rnd.randint(1, 255)) for i in range(n)]
+
+def ellipse_2x_args(rnd, width, height, n):
+    w, h = width/2, height/2
+    r = min(w, h)/8
+    return [(rnd.randint(-w/8, w*9/8), rnd.randint(-h/8, h*9/8), rnd.randint(1, r), rnd.randint(1, r),
+             rnd.randint(1, 255)) for i in range(n)]
+
+def fill_ellipse_2x_args(rnd, width, height, n):
+    w, h = width/2, height/2
+    r = min(w, h)/16
+    return [(rnd.randint(-w/8, w*9/8), rnd.randint(-h/8, h*9/8), rnd.randint(1, r), rnd.randint(1, r),
+             rnd.randint(1, 255)) for i in range(n)]
+
+def clear_args(rnd, width, height, n):
+    return [() for i in range(n)]
+
+def stage_point(rnd):
+    return (simulation.to_fixed(rnd.uniform(0, 99)), simulation.to_fixed(rnd.uniform(0, 99)),
+            simulation.to_fixed(rnd.uniform(0, 160)))
+
+def line_3d_args(rnd, width, height, n):
+    args = []
+    for i in range(n):
+        args.append(stage_point(rnd) + stage_point(rnd) + (rnd.random(),))
+    return args
+
+def rect_3d_args(rnd, width, height, n):
+    args = []
+    for i in range(n):
+        x0, y0, z = stage_point(rnd)
+        x1, y1, z1 = stage_point(rnd)
+        args.append((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), z, rnd.random()))
+    return args
+
+def circle_3d_args(rnd, width, height, n):
+    return [stage_point(rnd) + (simulation.to_fixed(rnd.uniform(1, 10)), rnd.random()) for i in range(n)]
+
+def ellipse_3d_args(rnd, width, height, n):
+    return [stage_point(rnd) + (simulation.to_fixed(rnd.uniform(1, 10)), simulation.to_fixed(rnd.uniform(1, 10)),
+            rnd.random()) for i in range(n)]
+
+# Benchmarked primitives as (name, function, workload, index of the color argument).
+PRIMITIVES = [
+    ('draw_line_2x', draw_line_2x, line_2x_args, 4),
+    ('draw_ellipse_2x', draw_ellipse_2x, ellipse_2x_args, 4),
+    ('fill_ellipse_2x', fill_ellipse_2x, fill_ellipse_2x_args, 4),
+    ('clear_image', clear_image, clear_args, None),
+    ('draw_line_3d', draw_line_3d, line_3d_args, 6),
+    ('draw_rect_3d', draw_rect_3d, rect_3d_args, 5),
+    ('draw_circle_3d', draw_circle_3d, circle_3d_args, 4),
+    ('fill_circle_3d', fill_circle_3d, circle_3d_args, 4),
+    ('draw_ellipse_3d', draw_ellipse_3d, ellipse_3d_args, 5),
+]
+
+def count_pixels(target):
+    """Returns the number of pixels of target that aren't black."""
+    dtype = target.bpp == 2 and np.uint16 or np.uint32
+    return int(np.count_nonzero(np.frombuffer(image_view(target), dtype=dtype)))
+
+def coverage(target, func, args, color_index):
+    """Returns the average number of pixels drawn by a call of func, measured on a sample of args drawn at full
+    brightness.  clear_image counts as writing the whole image."""
+    if color_index is None:
+        return target.width * target.height
+    total = 0
+    sample = args[:COVERAGE_SAMPLES]
+    for a in sample:
+        a = list(a)
+        a[color_index] = isinstance(a[color_index], float) and 1.0 or 255
+        clear_image(target)
+        func(target, *a)
+        total += count_pixels(target)
+    return float(total) / len(sample)
+
+def bench_primitive(target, func, args, repeat):
+    """Returns the best seconds taken by drawing all of args, out of repeat runs."""
+    best = None
+    for r in range(repeat):
+        clear_image(target)
+        start = time.time()
+        for a in args:
+            func(target, *a)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# Full frame benchmark.  The draw list methods and the draw_3d functions below make the same calls, in the same
+# order, as DrawList, Stage.draw_3d and Game.draw_3d in bounce.py, which can't be imported without the Sugar
+# environment.  They must be kept in sync.
+class DrawList:
+    def __init__(self):
+        self.buf = array.array('i')
+
+    def draw_line_2x(self, x0, y0, x1, y1, color):
+        self.buf.extend((DRAW_LINE_2X, x0, y0, x1, y1, color))
+
+    def draw_ellipse_2x(self, x, y, rx, ry, color):
+        self.buf.extend((DRAW_ELLIPSE_2X, x, y, rx, ry, color))
+
+    def fill_ellipse_2x(self, x, y, rx, ry, color):
+        self.buf.extend((DRAW_FILL_ELLIPSE_2X, x, y, rx, ry, color))
+
+    def draw_line_3d(self, x0, y0, z0, x1, y1, z1, c):
+        self.buf.extend((DRAW_LINE_3D, x0, y0, z0, x1, y1, z1, int(c*255.0)))
+
+    def draw_rect_3d(self, x0, y0, x1, y1, depth, c):
+        self.buf.extend((DRAW_RECT_3D, x0, y0, x1, y1, depth, int(c*255.0)))
+
+    def fill_circle_3d(self, x, y, z, radius, c):
+        self.buf.extend((DRAW_FILL_CIRCLE_3D, x, y, z, radius, int(c*255.0)))
+
+    def draw_ellipse_3d(self, x, y, z, rx, ry, c):
+        self.buf.extend((DRAW_ELLIPSE_3D, x, y, z, rx, ry, int(c*255.0)))
+
+    def draw_text_2x(self, text, x, y, size, color):
+        self.buf.extend((DRAW_TEXT_2X, x, y, size, color, len(text)))
+        self.buf.extend(map(ord, text))
+
+def draw_stage(dl, stage, brightness):
+    window = stage.window
+
+    v = brightness/4/100.0
+    for i in range(1, 5):
+        x = i*(window.right-window.left)/5
+        dl.draw_line_3d(x, window.top, 1, x, window.top, stage.depth, v)
+        dl.draw_line_3d(x, window.bottom, 1, x, window.bottom, stage.depth, v)
+    for i in range(1, 5):
+        y = i*(window.bottom-window.top)/5
+        dl.draw_line_3d(window.left, y, 1, window.left, y, stage.depth, v)
+        dl.draw_line_3d(window.right, y, 1, window.right, y, stage.depth, v)
+    for i in range(1, 5):
+        z = i*(stage.depth)/5
+        dl.draw_line_3d(window.left, window.top, z, window.right, window.top, z, v)
+        dl.draw_line_3d(window.left, window.bottom, z, window.right, window.bottom, z, v)
+        dl.draw_line_3d(window.left, window.top, z, window.left, window.bottom, z, v)
+        dl.draw_line_3d(window.right, window.top, z, window.right, window.bottom, z, v)
+
+    v = brightness/100.0
+    dl.draw_rect_3d(window.left, window.top, window.right, window.bottom, 0, v)
+    dl.draw_rect_3d(window.left, window.top, window.right, window.bottom, stage.depth, v)
+    dl.draw_line_3d(window.left, window.top, 1, window.left, window.top, stage.depth, v)
+    dl.draw_line_3d(window.left, window.bottom, 1, window.left, window.bottom, stage.depth, v)
+    dl.draw_line_3d(window.right, window.top, 1, window.right, window.top, stage.depth, v)
+    dl.draw_line_3d(window.right, window.bottom, 1, window.right, window.bottom, stage.depth, v)
+
+def draw_play(dl, world, width, fps):
+    """Draws a frame of PlaySequence at full brightness, with the objects at their end of frame positions."""
+    stage = world.stage
+    v = 1.0
+
+    for paddle in (world.paddle1, world.paddle2):
+        pos = paddle.pos
+        left = pos.x - paddle.halfwidth
+        right = pos.x + paddle.halfwidth
+        top = pos.y - paddle.halfheight
+        bottom = pos.y + paddle.halfheight
+        dl.draw_rect_3d(left, top, right, bottom, pos.z, v)
+        x = left + ((right - left) / 2)
+        dl.draw_line_3d(x, bottom, pos.z, x, stage.window.bottom, pos.z, v)
+
+    ball = world.ball
+    pos = ball.pos
+    dl.fill_circle_3d(pos.x, pos.y, pos.z, ball.size, v)
+    dl.draw_ellipse_3d(pos.x, stage.window.bottom, pos.z, ball.size*2, ball.size, v/2)
+    dl.draw_ellipse_3d(pos.x, stage.window.top, pos.z, ball.size*2, ball.size, v/2)
+    dl.draw_ellipse_3d(stage.window.left, pos.y, pos.z, ball.size, ball.size*2, v/2)
+    dl.draw_ellipse_3d(stage.window.right, pos.y, pos.z, ball.size, ball.size*2, v/2)
+
+    for x, score in ((width*1/4-75, world.paddle1.score), (width*3/4-75, world.paddle2.score)):
+        for j in range(0, 5):
+            if j < score:
+                dl.fill_ellipse_2x((x + j*30)/2, 30/2, 6, 6, int(v*255.0))
+            else:
+                dl.draw_ellipse_2x((x + j*30)/2, 30/2, 6, 6, int(v*255.0))
+
+    dl.draw_text_2x("%.2f fps" % fps, 50/2, 30/2, 12, 255)
+
+def play_frames(seed, frames, width):
+    """Plays a match with a player that follows the ball, and returns the draw list of every frame as drawn by
+    PlaySequence."""
+    rnd = random.Random(seed)
+    world = World()
+    world.setup(STAGE_DESC)
+
+    lists = []
+    for i in range(frames):
+        ball = world.ball.pos
+        inputs = Inputs(ball.x/256.0 + rnd.uniform(-5, 5), ball.y/256.0 + rnd.uniform(-5, 5),
+                        world.ball.vel.z < 0 and ball.z < simulation.to_fixed(30))
+        simulation.step(world, inputs)
+        dl = DrawList()
+        draw_play(dl, world, width, 20.0)
+        lists.append(dl.buf)
+    return world, lists
+
+def bench_frames(target, world, lists, repeat):
+    """Returns the best seconds taken by rendering all of lists, out of repeat runs, and the average area damaged
+    per frame."""
+    best = None
+    damaged = 0
+    for r in range(repeat):
+        # Cache the stage background the way Game.begin_draw does, then start from a full redraw.
+        if not use_background(target, world.stage.depth, 100):
+            dl = DrawList()
+            draw_stage(dl, world.stage, 100)
+            clear_image(target)
+            set_damage_tracking(0)
+            render_list(target, dl.buf)
+            set_damage_tracking(1)
+            store_background(target)
+        begin_frame(target, True)
+
+        damaged = 0
+        start = time.time()
+        for buf in lists:
+            use_background(target, world.stage.depth, 100)
+            begin_frame(target, False)
+            render_list(target, buf)
+            for x, y, w, h in get_damage():
+                damaged += w*h
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, float(damaged) / len(lists)
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--count', type='int', default=2000,
+                      help='primitives drawn per workload [default: %default]')
+    parser.add_option('-f', '--frames', type='int', default=500,
+                      help='frames rendered by the full frame benchmark [default: %default]')
+    parser.add_option('-r', '--resolutions', default=DEFAULT_RESOLUTIONS,
+                      help='comma separated WIDTHxHEIGHT list [default: %default]')
+    parser.add_option('-b', '--bpp', default=DEFAULT_BPP,
+                      help='comma separated bits per pixel, 16 or 32 [default: %default]')
+    parser.add_option('-p', '--primitives', default=','.join([p[0] for p in PRIMITIVES]),
+                      help='comma separated primitives [default: all]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs of each workload, the best one is reported [default: %default]')
+    parser.add_option('-t', '--threads', type='int', default=0,
+                      help='threads drawing each frame, 0 for one per processor [default: %default]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='random seed [default: %default]')
+    parser.add_option('-o', '--output', default=None,
+                      help='write the results as JSON to this file, - for standard output')
+    options, args = parser.parse_args(argv[1:])
+
+    resolutions = parse_resolutions(options.resolutions)
+    bpps = [int(b) for b in options.bpp.split(',')]
+    for b in bpps:
+        if b not in BPP_DEPTHS:
+            parser.error('unsupported bits per pixel: %d' % b)
+    names = options.primitives.split(',')
+    primitives = [p for p in PRIMITIVES if p[0] in names]
+    for n in names:
+        if n not in [p[0] for p in PRIMITIVES]:
+            parser.error('unknown primitive: %s' % n)
+
+    set_render_threads(options.threads)
+
+    # Damage tracking is only wanted by the full frame benchmark, where it's part of the cost of a frame.
+    set_damage_tracking(0)
+
+    # The table goes to stderr when the JSON goes to stdout.
+    out = options.output == '-' and sys.stderr or sys.stdout
+
+    results = []
+    frames = []
+    out.write('%-16s %-10s %4s %14s %12s %12s\n' % ('primitive', 'size', 'bpp', 'prims/s', 'pixels', 'Mpixels/s'))
+    for width, height in resolutions:
+        set_3d_params(width, height, VIEWPORT_SCALE)
+        for bpp in bpps:
+            target = create_render_target(width, height, BPP_DEPTHS[bpp])
+            if not set_pixel_format(target):
+                parser.error('unsupported render target format: %d bpp' % bpp)
+
+            for name, func, workload, color_index in primitives:
+                calls = workload(random.Random(options.seed), width, height, options.count)
+                pixels = coverage(target, func, calls, color_index)
+                seconds = bench_primitive(target, func, calls, options.repeat)
+                r = {
+                    'primitive': name,
+                    'width': width,
+                    'height': height,
+                    'bpp': bpp,
+                    'calls': len(calls),
+                    'seconds': seconds,
+                    'primitives_per_sec': len(calls) / seconds,
+                    'pixels_per_call': pixels,
+                    'megapixels_per_sec': pixels * len(calls) / seconds / 1e6,
+                }
+                results.append(r)
+                out.write('%-16s %-10s %4d %14.0f %12.1f %12.1f\n' % (
+                    name, '%dx%d' % (width, height), bpp, r['primitives_per_sec'], pixels, r['megapixels_per_sec']))
+
+            if options.frames > 0:
+                world, lists = play_frames(options.seed, options.frames, width)
+                set_damage_tracking(1)
+                reset_ellipse_cache_stats()
+                seconds, damaged = bench_frames(target, world, lists, options.repeat)
+                set_damage_tracking(0)
+                cache = get_ellipse_cache_stats()
+                r = {
+                    'width': width,
+                    'height': height,
+                    'bpp': bpp,
+                    'frames': len(lists),
+                    'seconds': seconds,
+                    'frames_per_sec': len(lists) / seconds,
+                    'ms_per_frame': seconds * 1000 / len(lists),
+                    'damaged_pixels_per_frame': damaged,
+                    'ellipse_cache': cache,
+                }
+                frames.append(r)
+                out.write('%-16s %-10s %4d %14.0f %12.1f %12s\n' % (
+                    'play frame', '%dx%d' % (width, height), bpp, r['frames_per_sec'], damaged, '-'))
+                out.write('  ellipse cache: %.1f%% hits, %d shapes in %d bytes\n' % (
+                    cache['hit_rate'] * 100, cache['entries'], cache['bytes']))
+            del target
+
+    if options.output:
+        report = {
+            'kernels': get_pixel_kernels(),
+            'render_threads': get_render_threads(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'options': {
+                'count': options.count,
+                'frames': options.frames,
+                'repeat': options.repeat,
+                'seed': options.seed,
+            },
+            'primitives': results,
+            'frames': frames,
+        }
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options.output == '-':
+            print(text)
+        else:
+            fd = open(options.output, 'w')
+            try:
+                fd.write(text + '\n')
+            finally:
+                fd.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
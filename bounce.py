@@ -16,7 +16,7 @@
 #!/usr/bin/env python
 """Bounce - 3D action game by Wade Brainerd <wadetb@gmail.com>."""
 
-import logging, os, time, math, threading, random, time
+import logging, os, time, math, threading, random, time, array, copy, Queue
 from gettext import gettext as _
 
 try:
@@ -27,8 +27,12 @@ except (ImportError, AttributeError):
 
 from pongc import *
 
+# Import the game physics.
+import simulation
+from simulation import *
+
 # Import GTK.
-import gobject, pygtk, gtk, pango, cairo
+import gobject, pygtk, gtk, pango
 gobject.threads_init()  
 
 # Import the PyGame mixer for sound output.
@@ -58,31 +62,50 @@ DEFAULT_STAGE_DESCS = [
     { 'Name': _('rotate'),   'StageDepth': 160, 'StageXGravity': 0.5, 'StageYGravity': 0,   'BallSize': 1, 'BallSpeed':  5, 'PaddleWidth': 25, 'PaddleHeight': 20, 'AISpeed': 3, 'AIRecenter': 1, },
 ]
 
+# Number of brightness levels the stage goes through during fades, see Game.begin_draw.
+BACKGROUND_LEVELS = 8
+
 # These are the settings that will be applied when a new stage is created using the editor.
 NEW_STAGE = { 'Name': _('new stage'), 'StageDepth': 160, 'StageXGravity': 0, 'StageYGravity': 0, 'BallSize': 1, 'BallSpeed':  3, 'PaddleWidth': 20, 'PaddleHeight': 20, 'AISpeed': 1, 'AIRecenter': 1, }
 
-def clamp(a, b, c):
-    if (a<b): return b
-    elif (a>c): return c
-    else: return a
+# List of primitives to be drawn by pongc.render_list, which draws the whole list in a single call.  The methods
+# match the pongc functions of the same name, without the image argument.
+class DrawList:
+    def __init__(self):
+        self.buf = array.array('i')
+
+    def clear(self):
+        del self.buf[:]
+
+    def draw_line_2x(self, x0, y0, x1, y1, color):
+        self.buf.extend((DRAW_LINE_2X, x0, y0, x1, y1, color))
 
-def to_fixed(a):
-    return int(a * 256)
+    def draw_ellipse_2x(self, x, y, rx, ry, color):
+        self.buf.extend((DRAW_ELLIPSE_2X, x, y, rx, ry, color))
 
-def from_fixed(a):
-    return a >> 8
+    def fill_ellipse_2x(self, x, y, rx, ry, color):
+        self.buf.extend((DRAW_FILL_ELLIPSE_2X, x, y, rx, ry, color))
 
-def fixed_mul(a, b):
-    return (a * b) >> 8
+    def draw_line_3d(self, x0, y0, z0, x1, y1, z1, c):
+        self.buf.extend((DRAW_LINE_3D, x0, y0, z0, x1, y1, z1, int(c*255.0)))
 
-# Three dimensional vector class.
-class Vector:
-    def __init__(self, x=0, y=0, z=0):
-        self.x = x
-        self.y = y
-        self.z = z
+    def draw_rect_3d(self, x0, y0, x1, y1, depth, c):
+        self.buf.extend((DRAW_RECT_3D, x0, y0, x1, y1, depth, int(c*255.0)))
 
-zerovec = Vector(0, 0, 0)
+    def draw_circle_3d(self, x, y, z, radius, c):
+        self.buf.extend((DRAW_CIRCLE_3D, x, y, z, radius, int(c*255.0)))
+
+    def fill_circle_3d(self, x, y, z, radius, c):
+        self.buf.extend((DRAW_FILL_CIRCLE_3D, x, y, z, radius, int(c*255.0)))
+
+    def draw_ellipse_3d(self, x, y, z, rx, ry, c):
+        self.buf.extend((DRAW_ELLIPSE_3D, x, y, z, rx, ry, int(c*255.0)))
+
+    def draw_text_2x(self, text, x, y, size, color):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.buf.extend((DRAW_TEXT_2X, x, y, size, color, len(text)))
+        self.buf.extend(map(ord, text))
 
 # RGB color class.
 class Color:
@@ -91,480 +114,134 @@ class Color:
         self.g = g
         self.b = b
 
-# Two dimensional rectangle class.
-class Rect:
-    def __init__(self):
-        self.top = 0
-        self.left = 0
-        self.right = 0
-        self.bottom = 0
-
 # Virtual screen dimensions
 screen_width = 1200
 screen_height = 825
 viewport_scale = to_fixed(100)
 
-# Game constants
-time_res = 32
+# Size of the pixels frames are drawn with, in screen pixels, see QualityGovernor.  The 2x primitives take
+# coordinates in drawn pixels, so screen positions are divided by it.
+render_scale = 2
+MAX_RENDER_SCALE = 4
+
+# Quality tiers, from the cheapest to the full effects.  A tier sets how many parts the grid divides the stage walls
+# into (no grid below 2), whether the ball casts shadows on the walls, how many rings the scoring effect has and
+# whether the fps counter is shown.  Text that the player needs is drawn in every tier.
+QUALITY_TIERS = [
+    { 'Name': _('low'),    'GridDivisions': 0, 'Shadows': False, 'ScoreRings': 3,  'FpsCounter': False, },
+    { 'Name': _('medium'), 'GridDivisions': 3, 'Shadows': True,  'ScoreRings': 6,  'FpsCounter': True,  },
+    { 'Name': _('high'),   'GridDivisions': 5, 'Shadows': True,  'ScoreRings': 10, 'FpsCounter': True,  },
+]
 
-def text_cairo (text, x, y, size, c):
-    game.cairo.set_source_rgb(c, c, c)
+# Tier that frames are drawn with, see QualityGovernor.
+quality = QUALITY_TIERS[-1]
 
-    game.cairo.set_font_size(size)
-    x_bearing, y_bearing, width, height = game.cairo.text_extents(text)[:4]
-    
+# Draws text centered on (x, y), or on the middle of the screen for -1.  The size is in screen pixels.
+def text_2x (text, x, y, size, c):
     if x == -1: x = screen_width/2
     if y == -1: y = screen_height/2
 
-    game.cairo.move_to(x - width/2 - x_bearing, y - height/2 - y_bearing)
-    game.cairo.show_text(text)
-
-class Ball:
-    def __init__(self):
-        self.lastpos = Vector()
-        self.lastvel = Vector()
-        self.pos = Vector()
-        self.vel = Vector()
-        self.size = 1
-        self.speed = 1
-    
-    def setup (self, desc):
-        self.size = to_fixed(desc['BallSize'])
-        self.speed = to_fixed(desc['BallSpeed'])
-
-        self.pos = Vector(to_fixed(50), to_fixed(25), to_fixed(desc['StageDepth'])/2)
-        self.vel = Vector(to_fixed(2), to_fixed(2), self.speed)
+    game.drawlist.draw_text_2x(text, x/render_scale, y/render_scale, size, int(c*255.0))
+
+# Returns the rows of a polygon given in the unit square and scaled to size 2x pixels, as (y, x0, x1) spans relative
+# to its center.
+def polygon_spans (points, size):
+    spans = []
+    for row in range(0, size):
+        y = (row + 0.5) / size
+        xs = []
+        for i in range(0, len(points)):
+            x0, y0 = points[i]
+            x1, y1 = points[(i+1) % len(points)]
+            if (y0 <= y) != (y1 <= y):
+                xs.append((x0 + (y - y0) * (x1 - x0) / (y1 - y0)) * size)
+        xs.sort()
+        for i in range(0, len(xs) - 1, 2):
+            x0 = int(math.ceil(xs[i] - 0.5))
+            x1 = int(math.floor(xs[i+1] - 0.5))
+            if x0 <= x1:
+                spans.append((row - size/2, x0 - size/2, x1 - size/2))
+    return spans
+
+class Ball(simulation.Ball):
+    def draw_3d (self, frame):
+        pos = frame.interpolate(self.lastpos, self.pos)
+        stage = frame.stage
 
-    def draw_3d (self, stage):
         # Draw the ball.
-        fill_circle_3d(game.drawimage, self.pos.x, self.pos.y, self.pos.z, self.size, game.brightness/100.0)
+        game.drawlist.fill_circle_3d(pos.x, pos.y, pos.z, self.size, frame.brightness/100.0)
 
         # Draw the shadows.
-        draw_ellipse_3d(game.drawimage, self.pos.x, stage.window.bottom, self.pos.z, self.size*2, self.size, game.brightness/2/100.0)
-        draw_ellipse_3d(game.drawimage, self.pos.x, stage.window.top, self.pos.z, self.size*2, self.size, game.brightness/2/100.0)
-        draw_ellipse_3d(game.drawimage, stage.window.left, self.pos.y, self.pos.z, self.size, self.size*2, game.brightness/2/100.0)
-        draw_ellipse_3d(game.drawimage, stage.window.right, self.pos.y, self.pos.z, self.size, self.size*2, game.brightness/2/100.0)
-
-    # 0 if nobody scored, 1 if Paddle1 scored, 2 if Paddle2 scored.
-    def update (self, paddle1, paddle2, stage):
-        # Ball collisions are handled very accurately, as this is the basis of the game.
-        # All times are in 1sec/time_res units.
-        # 1. Loop through all the surfaces and finds the first one the ball will collide with
-        # in this animation frame (if any). 
-        # 2. Update the Ball velocity based on the collision, and advance the current time to 
-        # the exact time of the collision.
-        # 3. Goto step 1, until no collisions remain in the current animation frame.
-    
-        time_left = time_res                  # Time remaining in this animation frame.
-        first_collision_time = 0              # -1 means no collision found.
-        first_collision_vel = Vector()    # New ball velocity from first collision.
-        first_collision_type = 0              # 0 for normal collision (wall), otherwise the scorezone number hit. 
-    
-        self.lastpos.x = self.pos.x
-        self.lastpos.y = self.pos.y
-        self.lastpos.z = self.pos.z
-        self.lastvel.x = self.vel.x
-        self.lastvel.y = self.vel.y
-        self.lastvel.z = self.vel.z
-    
-        next_ball_pos = Vector()          # Hypothetical ball position assuming no collision.
-        cur_time = 0                            # cur_time of current collision.
-        
-        collision_type = 0                   # Stored return value.
-    
-        iterations = 0
-    
-        while True:
-            iterations = iterations+1
-            if ( iterations > 5 ):
-                break
-    
-            # Calculate new next ball position.
-            next_ball_pos.x = self.pos.x + (self.vel.x * time_left) / time_res
-            next_ball_pos.y = self.pos.y + (self.vel.y * time_left) / time_res
-            next_ball_pos.z = self.pos.z + (self.vel.z * time_left) / time_res
-    
-            # Reset first_collision_cur_time.     
-            first_collision_cur_time = -1
-    
-            # Check stage walls.  First checks to see if the boundary was crossed, if so then calculates cur_time, etc.
-            if ( next_ball_pos.x - self.size <= 0 ): # Left wall
-                cur_time = ( self.pos.x - self.size ) * time_res / -self.vel.x # negative Vx is to account for left wall facing.
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = -self.vel.x
-                    first_collision_vel.y = self.vel.y
-                    first_collision_vel.z = self.vel.z
-                    first_collision_type = 5
-            if ( next_ball_pos.x + self.size >= stage.window.right ): # Right wall
-                cur_time = ( stage.window.right - ( self.pos.x + self.size ) ) * time_res / self.vel.x
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = -self.vel.x
-                    first_collision_vel.y = self.vel.y
-                    first_collision_vel.z = self.vel.z
-                    first_collision_type = 5
-            if ( next_ball_pos.y - self.size <= 0 and self.vel.y != 0): # Top wall
-                cur_time = ( self.pos.y - self.size ) * time_res / -self.vel.y
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x
-                    first_collision_vel.y = -self.vel.y
-                    first_collision_vel.z = self.vel.z
-                    first_collision_type = 5
-            if ( next_ball_pos.y + self.size >= stage.window.bottom  and self.vel.y != 0): # Bottom wall
-                cur_time = ( stage.window.bottom - ( self.pos.y + self.size ) ) * time_res / self.vel.y
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x
-                    first_collision_vel.y = -self.vel.y
-                    first_collision_vel.z = self.vel.z
-                    first_collision_type = 5
-            if ( next_ball_pos.z <= 0 ): # Front wall
-                cur_time = self.pos.z * time_res / -self.vel.z
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x #(random.randint(0, 3))-1 * self.speed
-                    first_collision_vel.y = self.vel.y #(random.randint(0, 3))-1 * self.speed
-                    first_collision_vel.z = self.speed
-                    first_collision_type = 2
-            if ( next_ball_pos.z >= stage.depth ): # Back wall
-                cur_time = ( stage.depth - self.pos.z ) * time_res / self.vel.z
-                if ( first_collision_cur_time == -1 or cur_time < first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x #(random.randint(0, 3))-1 * self.speed
-                    first_collision_vel.y = self.vel.y #(random.randint(0, 3))-1 * self.speed
-                    first_collision_vel.z = -self.speed
-                    first_collision_type = 1
-            # Paddle collision.  Paddle collisions are inaccurate, in that it doesn't take into account the velocity of 
-            # the ball in its 2D check, it uses the original 2D position.
-            if (        self.vel.z < 0 
-                    and ( self.pos.z >= paddle1.pos.z or self.pos.z >= paddle1.pos.z - math.fabs(paddle1.delta.z) ) 
-                    and ( next_ball_pos.z <= paddle1.pos.z or next_ball_pos.z <= paddle1.pos.z + math.fabs(paddle1.delta.z) )
-                    and self.pos.x >= paddle1.pos.x - paddle1.halfwidth
-                    and self.pos.x <= paddle1.pos.x + paddle1.halfwidth 
-                    and self.pos.y >= paddle1.pos.y - paddle1.halfheight
-                    and self.pos.y <= paddle1.pos.y + paddle1.halfheight ):
-                cur_time = ( self.pos.z - paddle1.pos.z ) * time_res / -self.vel.z
-                if ( first_collision_cur_time == -1 or cur_time <= first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x
-                    first_collision_vel.y = self.vel.y
-                    first_collision_vel.z = -self.vel.z
-    
-                    # If paddle is moving forward, bounce the ball off.
-                    if ( paddle1.delta.z > 0 ):
-                        first_collision_vel.z += 4*246
-    
-                        # Apply some pong like angling based on where it hits the paddle.
-                        if ( next_ball_pos.x - paddle1.pos.x > 20 ):
-                            first_collision_vel.x += 2*256
-                        if ( next_ball_pos.x - paddle1.pos.x < -20 ):
-                            first_collision_vel.x -= 2*256
-    
-                        if ( next_ball_pos.y - paddle1.pos.y > 15 ):
-                            first_collision_vel.y += 2*256
-                        if ( next_ball_pos.y - paddle1.pos.y < -15 ):
-                            first_collision_vel.y -= 2*256
-                    # Likewise if paddle is moving backwards, cushion it.
-                    #if ( paddle1.delta.z < 0 ):
-                    #    first_collision_vel.z -= 2*256
-                    
-                    first_collision_type = 3
-            # Computer paddle.
-            if (        self.vel.z > 0 
-                    and ( self.pos.z <= paddle2.pos.z ) 
-                    and ( next_ball_pos.z >= paddle2.pos.z )
-                    and self.pos.x >= paddle2.pos.x - paddle2.halfwidth
-                    and self.pos.x <= paddle2.pos.x + paddle2.halfwidth 
-                    and self.pos.y >= paddle2.pos.y - paddle2.halfheight
-                    and self.pos.y <= paddle2.pos.y + paddle2.halfheight ): # Paddle 2
-                cur_time = ( paddle2.pos.z - self.pos.z ) * time_res / self.vel.z
-                if ( first_collision_cur_time == -1 or cur_time <= first_collision_cur_time ):
-                    # Set new first collision.
-                    first_collision_cur_time = cur_time
-                    first_collision_vel.x = self.vel.x
-                    first_collision_vel.y = self.vel.y
-                    first_collision_vel.z = -self.vel.z + ( paddle1.delta.z > 0 ) * 2*256 + ( paddle1.delta.z < 0 ) * 2*256
-                    first_collision_type = 4
-    
-            # Advance the ball to the point of the first collision.
-            if ( first_collision_cur_time != -1 ):
-                self.pos.x += self.vel.x * first_collision_cur_time / time_res
-                self.pos.y += self.vel.y * first_collision_cur_time / time_res
-                self.pos.z += self.vel.z * first_collision_cur_time / time_res
-                self.vel.x = first_collision_vel.x
-                self.vel.y = first_collision_vel.y
-                self.vel.z = first_collision_vel.z
-                
-                time_left -= first_collision_cur_time
-                collision_type = first_collision_type
-            if ( not (first_collision_cur_time != -1 and time_left > 0) ):
-                break
-    
-        # If there's time left in the frame w/o collision, finish it up.    
-        if time_left > 0:
-            self.pos.x += self.vel.x * time_left / time_res
-            self.pos.y += self.vel.y * time_left / time_res
-            self.pos.z += self.vel.z * time_left / time_res
-    
-        # Apply gravity.
-        self.vel.y += game.stage.gravity
-        if ( self.pos.y + self.size + 20 > stage.window.bottom and math.fabs(self.vel.y) == 0 ):
-            self.vel.y -= 6
-        self.vel.x += game.stage.crossgravity
-    
-        # Calculate scores if any collisions with the back wall happened.
-        if collision_type == 1:
-            paddle1.score += 1
-            game.scoresnd.play()
-        elif collision_type == 2:
-            paddle2.score += 1  
-            game.scoresnd.play()
-        elif collision_type == 3:
-            game.paddle1snd.play()
-        elif collision_type == 4:
-            game.paddle2snd.play()
-        elif collision_type == 5:
-            game.wallsnd.play()
-
-        return collision_type
-
-class Paddle:
-    def __init__(self):
-        # Center of the paddle
-        self.pos = Vector()
-        
-        # Physics stuff
-        self.delta = Vector() # Amount moved since last update for spin calc.
-        self.halfwidth = 0
-        self.halfheight = 0
-
-        # Stuff for moving the paddle forward.
-        self.targetz = 0
-        self.defaultz = 0
-        self.forwardz = 0
-
-        # AI stuff
-        self.vel = Vector()
-        self.speed = 0
+        if not quality['Shadows']:
+            return
+        game.drawlist.draw_ellipse_3d(pos.x, stage.window.bottom, pos.z, self.size*2, self.size, frame.brightness/2/100.0)
+        game.drawlist.draw_ellipse_3d(pos.x, stage.window.top, pos.z, self.size*2, self.size, frame.brightness/2/100.0)
+        game.drawlist.draw_ellipse_3d(stage.window.left, pos.y, pos.z, self.size, self.size*2, frame.brightness/2/100.0)
+        game.drawlist.draw_ellipse_3d(stage.window.right, pos.y, pos.z, self.size, self.size*2, frame.brightness/2/100.0)
 
-        # Game stuff
-        self.score = 0
+class Paddle(simulation.Paddle):
+    def draw_3d (self, frame):
+        v = frame.brightness/100.0
+        stage = frame.stage
 
-    def draw_3d (self, stage):
-        v = game.brightness/100.0
+        lastpos = Vector(self.pos.x - self.delta.x, self.pos.y - self.delta.y, self.pos.z - self.delta.z)
+        pos = frame.interpolate(lastpos, self.pos)
 
         r = Rect()
-        r.left = self.pos.x - self.halfwidth 
-        r.right = self.pos.x + self.halfwidth    
-        r.top = self.pos.y - self.halfheight 
-        r.bottom = self.pos.y + self.halfheight  
+        r.left = pos.x - self.halfwidth 
+        r.right = pos.x + self.halfwidth    
+        r.top = pos.y - self.halfheight 
+        r.bottom = pos.y + self.halfheight  
         
-        draw_rect_3d( game.drawimage, r.left, r.top, r.right, r.bottom, self.pos.z, v )
+        game.drawlist.draw_rect_3d( r.left, r.top, r.right, r.bottom, pos.z, v )
     
         x = r.left + ( ( r.right - r.left ) / 2 )
-        draw_line_3d( game.drawimage, x, r.bottom, self.pos.z, x, stage.window.bottom, self.pos.z, v )
-
-    def clip_position (self):
-        self.pos.x = max(self.pos.x, self.halfwidth)
-        self.pos.y = max(self.pos.y, self.halfheight)
-        self.pos.x = min(self.pos.x, game.stage.window.right - self.halfwidth)
-        self.pos.y = min(self.pos.y, game.stage.window.bottom - self.halfheight)
-
-    def setup_player(self, desc):
-        w = to_fixed(desc['PaddleWidth'])
-        h = to_fixed(desc['PaddleHeight'])
-
-        self.halfwidth = w
-        self.halfheight = h
-
-        self.delta = zerovec
-        self.pos = Vector(to_fixed(25), to_fixed(50), to_fixed(10))
-        self.clip_position()
-
-        self.defaultz = self.pos.z
-        self.targetz = self.pos.z
-        self.forwardz = to_fixed(40)
-
-        self.score = 0
-
-    def update_player (self, stage):
-        """Check paddle inputs and apply to paddle."""
-        lastpos = Vector()
-        lastpos.x = self.pos.x
-        lastpos.y = self.pos.y
-        lastpos.z = self.pos.z
-
-        penx = game.mousex*100/screen_width
-        peny = game.mousey*100/screen_height
-        pendown = 1
-
-        if ( game.mousedown ):
-            self.targetz = self.forwardz
-        else:
-            self.targetz = self.defaultz
-
-        # Snaps forward, eases back.
-        if ( self.pos.z < self.targetz ):
-            if ( self.delta.z < to_fixed(4) ):
-                self.delta.z = to_fixed(6)
-            self.pos.z += self.delta.z + to_fixed(2)
-            if ( self.pos.z > self.targetz ):
-                self.pos.z = self.targetz
-
-        if ( self.pos.z > self.targetz ):
-            self.pos.z += ( self.targetz - self.pos.z ) / 4
-
-        # Get the 2d position from the pen.
-        if ( pendown ): 
-            self.pos.x = to_fixed(penx)
-            self.pos.y = to_fixed(peny)
-            self.clip_position()
-    
-        self.delta.x = self.pos.x - lastpos.x
-        self.delta.y = self.pos.y - lastpos.y
-        self.delta.z = self.pos.z - lastpos.z
-
-    def setup_ai(self, desc):
-        w = to_fixed(desc['PaddleWidth'])
-        h = to_fixed(desc['PaddleHeight'])
-
-        self.score = 0
-
-        self.halfwidth = w
-        self.halfheight = h
+        game.drawlist.draw_line_3d( x, r.bottom, pos.z, x, stage.window.bottom, pos.z, v )
 
-        self.pos = Vector(to_fixed(75), to_fixed(50), game.stage.depth - to_fixed(10))
-
-        self.defaultz = self.pos.z
-        self.targetz = self.pos.z
-        self.forwardz = game.stage.depth - 40*256
-
-        self.delta = zerovec
-        self.vel = zerovec
-
-        self.clip_position()
-    
-    def update_ai (self, ball, stage):
-        """Compute AI and move paddle."""
-        # Only move when the ball is coming back, that way it appears to react to the players hit.
-        # Actually, start moving just before the player hits it.
-        if ( ball.vel.z > 0 or ball.vel.z < 0 and ball.pos.z < to_fixed(30)) :
-            # Acceleration towards the ball.
-            if ( math.fabs( ( self.pos.x - ball.pos.x ) ) > to_fixed(5) ):
-                if ( self.pos.x < ball.pos.x ):
-                    self.vel.x += to_fixed(4)
-                if ( self.pos.x > ball.pos.x ):
-                    self.vel.x -= to_fixed(4)
-                
-            if ( math.fabs( ( self.pos.y - ball.pos.y ) ) > to_fixed(5) ):
-                if ( self.pos.y < ball.pos.y ):
-                    self.vel.y += to_fixed(4)
-                if ( self.pos.y > ball.pos.y ): 
-                    self.vel.y -= to_fixed(4)
-            
-            # Speed clamping
-            self.vel.x = clamp( self.vel.x, -game.ai.speed, game.ai.speed )
-            self.vel.y = clamp( self.vel.y, -game.ai.speed, game.ai.speed )
-        elif ( ball.pos.z < game.stage.depth/2 ):
-            self.vel.x = 0
-            self.vel.y = 0
-            # Drift towards the center.
-            if ( game.ai.recenter ):
-                self.pos.x += ( to_fixed(50) - self.pos.x ) / 4
-                self.pos.y += ( to_fixed(50) - self.pos.y ) / 4
-                
-        # Friction
-        if ( self.vel.x > 0 ):
-            self.vel.x -= 1
-        if ( self.vel.x < 0 ):
-            self.vel.x += 1
-            
-        if ( self.vel.y > 0 ):
-            self.vel.y -= 1
-        if ( self.vel.y < 0 ):
-            self.vel.y += 1
-            
-        self.pos.x += self.vel.x
-        self.pos.y += self.vel.y
-        self.clip_position()
-
-class Stage:
-    def __init__(self):
-        self.depth = 0
-        self.gravity = 0
-        self.crossgravity = 0
-        self.window = Rect()
-
-    def setup(self, desc):
-        self.name = desc['Name']
-        self.depth = to_fixed(desc['StageDepth'])
-        self.gravity = to_fixed(desc['StageYGravity'])
-        self.crossgravity = to_fixed(desc['StageXGravity'])
-
-        self.window.left = 0
-        self.window.right = to_fixed(99)
-        self.window.top = 0
-        self.window.bottom = to_fixed(99)
-
-    def draw_3d (self):
+class Stage(simulation.Stage):
+    def draw_3d (self, brightness):
+        """Draws the stage, which is cached as the background of every frame, see Frame.begin_draw."""
         window = self.window
 
         # Wall grids.
-        v = game.brightness/4/100.0
+        v = brightness/4/100.0
+        n = quality['GridDivisions']
         
         i = 1
-        while i < 5:
-            x = i*(window.right-window.left)/5
+        while i < n:
+            x = i*(window.right-window.left)/n
             i += 1
-            draw_line_3d(game.drawimage, x, window.top, 1, x, window.top, self.depth, v)
-            draw_line_3d(game.drawimage, x, window.bottom, 1, x, window.bottom, self.depth, v)
+            game.drawlist.draw_line_3d(x, window.top, 1, x, window.top, self.depth, v)
+            game.drawlist.draw_line_3d(x, window.bottom, 1, x, window.bottom, self.depth, v)
         
         i = 1
-        while i < 5:
-            x = i*(window.bottom-window.top)/5
+        while i < n:
+            x = i*(window.bottom-window.top)/n
             i += 1
-            draw_line_3d(game.drawimage, window.left, x, 1, window.left, x, self.depth, v)
-            draw_line_3d(game.drawimage, window.right, x, 1, window.right, x, self.depth, v)
+            game.drawlist.draw_line_3d(window.left, x, 1, window.left, x, self.depth, v)
+            game.drawlist.draw_line_3d(window.right, x, 1, window.right, x, self.depth, v)
             
         i = 1
-        while i < 5:
-            x = i*(self.depth)/5
+        while i < n:
+            x = i*(self.depth)/n
             i += 1
-            draw_line_3d(game.drawimage, window.left, window.top, x, window.right, window.top, x, v)
-            draw_line_3d(game.drawimage, window.left, window.bottom, x, window.right, window.bottom, x, v)
-            draw_line_3d(game.drawimage, window.left, window.top, x, window.left, window.bottom, x, v)
-            draw_line_3d(game.drawimage, window.right, window.top, x, window.right, window.bottom, x, v)
+            game.drawlist.draw_line_3d(window.left, window.top, x, window.right, window.top, x, v)
+            game.drawlist.draw_line_3d(window.left, window.bottom, x, window.right, window.bottom, x, v)
+            game.drawlist.draw_line_3d(window.left, window.top, x, window.left, window.bottom, x, v)
+            game.drawlist.draw_line_3d(window.right, window.top, x, window.right, window.bottom, x, v)
 
         # The actual stage.
-        v = game.brightness/100.0
+        v = brightness/100.0
     
         # Near and far rectangles   
-        draw_rect_3d( game.drawimage, window.left, window.top, window.right, window.bottom, 0, v )
-        draw_rect_3d( game.drawimage, window.left, window.top, window.right, window.bottom, self.depth, v )
+        game.drawlist.draw_rect_3d( window.left, window.top, window.right, window.bottom, 0, v )
+        game.drawlist.draw_rect_3d( window.left, window.top, window.right, window.bottom, self.depth, v )
     
         # Diagonals
-        draw_line_3d( game.drawimage, window.left, window.top, 1, window.left, window.top, self.depth, v )
-        draw_line_3d( game.drawimage, window.left, window.bottom, 1, window.left, window.bottom, self.depth, v )
-        draw_line_3d( game.drawimage, window.right, window.top, 1, window.right, window.top, self.depth, v )
-        draw_line_3d( game.drawimage, window.right, window.bottom, 1, window.right, window.bottom, self.depth, v )
-
-class AI:
-    def __init__(self):
-        self.speed = 0
-        self.recenter = False
-
-    def setup (self, desc):
-        self.speed = to_fixed(desc['AISpeed'])
-        self.recenter = desc['AIRecenter']
+        game.drawlist.draw_line_3d( window.left, window.top, 1, window.left, window.top, self.depth, v )
+        game.drawlist.draw_line_3d( window.left, window.bottom, 1, window.left, window.bottom, self.depth, v )
+        game.drawlist.draw_line_3d( window.right, window.top, 1, window.right, window.top, self.depth, v )
+        game.drawlist.draw_line_3d( window.right, window.bottom, 1, window.right, window.bottom, self.depth, v )
 
 class IntroSequence:
     def enter (self):
@@ -574,14 +251,14 @@ class IntroSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
+    def draw_3d (self, frame):
         if (self.timer1 == 1):
-            game.draw_3d()
+            frame.draw_3d()
+        if frame.overlay:
+            text_2x(_("b o u n c e"), -1, -1, 100, self.timer0/100.0)
 
-    def draw_cairo (self):
-        if (self.timer1 == 1):
-            game.draw_cairo()
-        text_cairo(_("b o u n c e"), -1, -1, 100, self.timer0/100.0)
+    def has_overlay (self):
+        return self.timer0 > 0
 
     def update (self):
         if (self.timer1 == 0):
@@ -609,12 +286,13 @@ class NewStageSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
+        if frame.overlay:
+            text_2x(frame.stage_descs[self.nextlevel]['Name'], -1, -1, 100, (100-frame.brightness)/100.0)
 
-    def draw_cairo (self):
-        game.draw_cairo()
-        text_cairo(game.stage_descs[self.nextlevel]['Name'], -1, -1, 100, (100-game.brightness)/100.0)
+    def has_overlay (self):
+        return game.brightness < 100
 
     def update (self):
         if (self.timer1 == 0):
@@ -644,12 +322,13 @@ class BallReleaseSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
+        if frame.overlay:
+            text_2x(str(3-self.timer1), -1, -1, 20, math.sin(math.pi*self.timer0/35))
 
-    def draw_cairo (self):
-        game.draw_cairo()
-        text_cairo(str(3-self.timer1), -1, -1, 20, math.sin(math.pi*self.timer0/35))
+    def has_overlay (self):
+        return self.timer0 > 0
 
     def update (self):
         if (game.brightness < 100): game.brightness += 1
@@ -670,23 +349,19 @@ class PlaySequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
 
-    def draw_cairo (self):
-        game.draw_cairo()
+    def has_overlay (self):
+        return False
 
     def update (self):
-        # Process player input and AI.
-        game.paddle1.update_player(game.stage)
-        game.paddle2.update_ai(game.ball, game.stage)
-
-        # Run the ball simulation.
-        score = game.ball.update(game.paddle1, game.paddle2, game.stage)
+        # Run the simulation.
+        events = game.step()
         #if game.mousedown:
-        #    score = 1
+        #    events = [EVENT_SCORE1]
         #    game.paddle1.score += 1
-        if score == 1 or score == 2:
+        if EVENT_SCORE1 in events or EVENT_SCORE2 in events:
             game.set_sequence(ScoreSequence())
 
 class ScoreSequence:
@@ -699,23 +374,23 @@ class ScoreSequence:
         #game.ball.vel = Vector(to_fixed(2), to_fixed(2), game.ball.vel.z)
         pass
 
-    def draw_3d (self):
+    def draw_3d (self, frame):
         ring_spacing = to_fixed(1)
         ring_speed = to_fixed(1)
-        num_rings = 10
+        num_rings = quality['ScoreRings']
 
         v = (1.0-float(self.step)/self.num_steps)
 
-        fill_circle_3d(game.drawimage, game.ball.lastpos.x+game.ball.lastvel.x*self.step/2, game.ball.lastpos.y+game.ball.lastvel.y*self.step/2, game.ball.lastpos.z+game.ball.lastvel.z*self.step/2, game.ball.size, v)
-        random.seed(12345678)
+        ball = frame.ball
+        game.drawlist.fill_circle_3d(ball.lastpos.x+ball.lastvel.x*self.step/2, ball.lastpos.y+ball.lastvel.y*self.step/2, ball.lastpos.z+ball.lastvel.z*self.step/2, ball.size, v)
         for ring in range(0, num_rings):
             b = (1.0-float(self.step)/self.num_steps)*(0.5+0.5*math.cos(math.pi*float(ring)/num_rings))
-            draw_circle_3d(game.drawimage, game.ball.lastpos.x+game.ball.lastvel.x*ring, game.ball.lastpos.y+game.ball.lastvel.y*ring, game.ball.lastpos.z+game.ball.lastvel.z*ring, (-ring+1)*ring_spacing + ring_speed*self.step, b)
+            game.drawlist.draw_circle_3d(ball.lastpos.x+ball.lastvel.x*ring, ball.lastpos.y+ball.lastvel.y*ring, ball.lastpos.z+ball.lastvel.z*ring, (-ring+1)*ring_spacing + ring_speed*self.step, b)
 
-        game.draw_3d()
+        frame.draw_3d()
 
-    def draw_cairo (self):
-        game.draw_cairo()
+    def has_overlay (self):
+        return False
 
     def update (self):
         self.step += 1
@@ -742,12 +417,13 @@ class LoseSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
+        if frame.overlay:
+            text_2x("; - {", -1, -1, 24, self.timer0/100.0)
 
-    def draw_cairo (self):
-        game.draw_cairo()
-        text_cairo("; - {", -1, -1, 24, self.timer0/100.0)
+    def has_overlay (self):
+        return self.timer0 > 0
 
     def update (self):
         if (self.timer1 == 0):
@@ -781,6 +457,9 @@ class WinSequence:
     def leave (self):
         pass
 
+    def has_overlay (self):
+        return True
+
     def update (self):
         if (self.timer1 == 0):
             if (game.brightness > 0): game.brightness -= 5
@@ -800,62 +479,51 @@ class WinSequence:
                 self.timer0 = 0
                 self.timer1 = 0
 
-    def draw_3d (self):
-        game.draw_3d()
-
-    def draw_cairo (self):
-        game.draw_cairo()
+    def draw_3d (self, frame):
+        frame.draw_3d()
 
+        stage_descs = frame.stage_descs
         starty = 250
         total_score = 0
-        for i in range(0, len(game.stage_descs)):
+        for i in range(0, len(stage_descs)):
             v = clamp(255*self.timer0/60.0 - i*60, 0, 255)/255.0
 
-            player_score = game.stage_descs[i].get('Paddle1Score', 0)
-            ai_score = game.stage_descs[i].get('Paddle2Score', 0)
+            player_score = stage_descs[i].get('Paddle1Score', 0)
+            ai_score = stage_descs[i].get('Paddle2Score', 0)
             diff_score = player_score - ai_score
 
-            game.draw_score_cairo(250, starty + i*50, player_score, 1, v)
-            text_cairo('-', 475, starty + i*50, 20, v)
-            game.draw_score_cairo(550, starty + i*50, ai_score, 2, v)
-            text_cairo('=', 775, starty + i*50, 20, v)
-            game.draw_score_cairo(850, starty + i*50, diff_score, 1, v)
+            frame.draw_score_3d(250, starty + i*50, player_score, 1, v)
+            text_2x('-', 475, starty + i*50, 20, v)
+            frame.draw_score_3d(550, starty + i*50, ai_score, 2, v)
+            text_2x('=', 775, starty + i*50, 20, v)
+            frame.draw_score_3d(850, starty + i*50, diff_score, 1, v)
 
-            text_cairo(game.stage_descs[i]['Name'], 125, starty + i*50, 24, v)
+            text_2x(stage_descs[i]['Name'], 125, starty + i*50, 24, v)
 
             total_score += diff_score
     
         v = self.timer0/60.0
-        game.cairo.set_source_rgb(v, v, v)
-        game.cairo.move_to(250, starty + len(game.stage_descs)*50)
-        game.cairo.line_to(950, starty + len(game.stage_descs)*50)
-        game.cairo.stroke()
+        liney = (starty + len(stage_descs)*50)/render_scale
+        game.drawlist.draw_line_2x(250/render_scale, liney, 950/render_scale, liney, int(v*255.0))
         x = 250
-        y = starty + (len(game.stage_descs)+1)*50
-        for j in range(0, 5*len(game.stage_descs)):
-            game.cairo.move_to(game.xpoints[0][0]*20-10+x, game.xpoints[0][1]*20-10+y)
-            for p in game.xpoints:
-                game.cairo.line_to(p[0]*20-10+x, p[1]*20-10+y)
-            game.cairo.line_to(game.xpoints[0][0]*20-10+x, game.xpoints[0][1]*20-10+y)
-            if j >= total_score:
-                game.cairo.stroke()
-            else:
-                game.cairo.fill()
+        y = starty + (len(stage_descs)+1)*50
+        for j in range(0, 5*len(stage_descs)):
+            frame.draw_x_2x(x, y, j < total_score, v)
             x += 30
             if (x > 980):
                 x = 250
                 y += 50
     
         text = "; - |"
-        if (total_score >= 5*len(game.stage_descs)):
+        if (total_score >= 5*len(stage_descs)):
             text = "; - D"
-        elif (total_score >= 4*len(game.stage_descs)):
+        elif (total_score >= 4*len(stage_descs)):
             text = "; - >"
-        elif (total_score >= 3*len(game.stage_descs)):
+        elif (total_score >= 3*len(stage_descs)):
             text = "; - )"
-        elif (total_score >= 2*len(game.stage_descs)):
+        elif (total_score >= 2*len(stage_descs)):
             text = "; - }"
-        text_cairo(text, -1, 150, 24, v)
+        text_2x(text, -1, 150, 24, v)
 
 class EditSequence:
     def enter (self):
@@ -864,11 +532,11 @@ class EditSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
 
-    def draw_cairo (self):
-        game.draw_cairo()
+    def has_overlay (self):
+        return False
 
     def update (self):
         pass
@@ -880,30 +548,28 @@ class TestSequence:
     def leave (self):
         pass
 
-    def draw_3d (self):
-        game.draw_3d()
+    def draw_3d (self, frame):
+        frame.draw_3d()
 
-    def draw_cairo (self):
-        pass
+    def has_overlay (self):
+        return False
 
     def update (self):
-        # Process player input and AI.
-        game.paddle1.update_player(game.stage)
-        game.paddle2.update_ai(game.ball, game.stage)
-
-        # Run the ball simulation.
-        game.ball.update(game.paddle1, game.paddle2, game.stage)
+        # Run the simulation.
+        game.step()
 
 class Game:
     def __init__(self):
         self.endtimeout = 0
 
-        self.ai = AI()
+        # Simulation state.  The objects are shared with the world, so they can be drawn directly.
+        self.world = World(stage=Stage(), ball=Ball(), paddle1=Paddle(), paddle2=Paddle())
 
-        self.stage = Stage()
-        self.ball = Ball()
-        self.paddle1 = Paddle()
-        self.paddle2 = Paddle()
+        self.ai = self.world.ai
+        self.stage = self.world.stage
+        self.ball = self.world.ball
+        self.paddle1 = self.world.paddle1
+        self.paddle2 = self.world.paddle2
         
         # Current stage.
         self.curlevel = 0
@@ -913,6 +579,17 @@ class Game:
         self.sequence.enter()
         self.brightness = 100
 
+        # Set when everything needs redrawing on the next frame, rather than just the objects that moved.
+        self.redraw_all = True
+
+        # Primitives drawn in the current frame.
+        self.drawlist = DrawList()
+
+        # Interpolation between the last two simulated frames, see BounceActivity.tick.  stepped is set when the
+        # last sequence update ran the simulation, otherwise the objects are drawn where they are.
+        self.alpha = 1.0
+        self.stepped = False
+
         # Current mouse state.
         self.mousex = 0
         self.mousey = 0
@@ -924,8 +601,9 @@ class Game:
         # Scores.
         self.scores = []
 
-        # The 'X' shape used as an icon.
+        # The 'X' shape used as an icon, and its rows when drawn 20 screen pixels wide at each render scale.
         self.xpoints = [ (0,0), (0.3,0), (0.5,0.3), (0.7,0), (1,0), (0.7,0.5), (1,1), (0.7,1), (0.5,0.6), (0.3,1), (0,1), (0.3,0.5) ]
+        self.xspans = [None] + [polygon_spans(self.xpoints, 20/s) for s in range(1, MAX_RENDER_SCALE+1)]
 
         # Create sounds.
         self.scoresnd = pygame.mixer.Sound(activity.get_bundle_path()+'/sound/score.wav')
@@ -938,6 +616,7 @@ class Game:
         self.sequence.leave()
         self.sequence = seq
         self.sequence.enter()
+        self.redraw_all = True
 
     def set_level(self, level):
         if level < 0 or level > len(self.stage_descs)-1:
@@ -946,62 +625,140 @@ class Game:
         self.curlevel = level
         desc = self.stage_descs[self.curlevel]
 
-        self.stage.setup(desc)
-        self.ball.setup(desc)
-        self.ai.setup(desc)
+        self.world.setup(desc)
+        self.redraw_all = True
 
-        self.paddle1.setup_player(desc)
-        self.paddle2.setup_ai(desc)
+        # The objects start over, so don't draw them part way from where they were in the last stage.
+        self.stepped = False
 
     def new_game(self):
         self.set_level(0)
 
-    def draw_score_3d(self, x, y, score, player, v):
-        for j in range(0, 5):
-            px = x + j*30
-            py = y
-            if j < score:
-                fill_ellipse_2x(game.drawimage, px/2, py/2, 6, 6, int(v*255.0))
-            else:
-                draw_ellipse_2x(game.drawimage, px/2, py/2, 6, 6, int(v*255.0))
+    def step(self):
+        """Advances the simulation by one frame using the current mouse state, and plays the sounds for any
+        collisions that happened."""
+        inputs = Inputs(self.mousex*100/screen_width, self.mousey*100/screen_height, self.mousedown)
+        events = simulation.step(self.world, inputs)
+        self.stepped = True
+
+        for e in events:
+            if e == EVENT_SCORE1 or e == EVENT_SCORE2:
+                self.scoresnd.play()
+            elif e == EVENT_PADDLE1:
+                self.paddle1snd.play()
+            elif e == EVENT_PADDLE2:
+                self.paddle2snd.play()
+            elif e == EVENT_WALL:
+                self.wallsnd.play()
+
+        return events
+
+    def snapshot(self, deadline):
+        """Returns a Frame holding the current state, to be drawn while the simulation goes on.  deadline is the time
+        the frame should be shown by, see FrameScheduler.  A pending full redraw is handed over to the frame."""
+        frame = Frame(self, deadline)
+        self.redraw_all = False
+        return frame
+
+# Everything needed to draw one frame, copied from the game by Game.snapshot.  Frames are drawn on the render thread
+# while the game simulates the next one, see RenderPipeline, so a frame shares nothing with the game that the
+# simulation changes.  The sequence is copied too, for its timers.
+class Frame:
+    def __init__(self, game, deadline):
+        self.deadline = deadline
+
+        self.stage, self.ball, self.paddle1, self.paddle2 = copy.deepcopy((game.stage, game.ball, game.paddle1, game.paddle2))
+        self.sequence = copy.copy(game.sequence)
+        self.overlay = game.sequence.has_overlay()
+        self.stage_descs = [dict(desc) for desc in game.stage_descs]
+
+        self.brightness = game.brightness
+        self.alpha = game.alpha
+        self.stepped = game.stepped
+        self.fps = game.fps
+        self.redraw_all = game.redraw_all
+
+        # Constant, so shared.
+        self.xpoints = game.xpoints
+        self.xspans = game.xspans[render_scale]
+
+    def interpolate(self, lastpos, pos):
+        """Returns the position to draw an object at, given where it was at the start and at the end of the last
+        simulated frame."""
+        if not self.stepped:
+            return pos
+        return Vector(lastpos.x + int((pos.x - lastpos.x) * self.alpha),
+                      lastpos.y + int((pos.y - lastpos.y) * self.alpha),
+                      lastpos.z + int((pos.z - lastpos.z) * self.alpha))
+
+    def begin_draw(self, image):
+        """Starts drawing a frame to image.  The frame starts from a cached image of the stage, which is only redrawn
+        when the stage depth, the brightness or the screen changes.  Only the areas drawn in the last frame are
+        restored, unless something changed that affects the whole screen.  Returns True if the whole image was
+        redrawn."""
+        # Fades step the stage through a few brightness levels, so that they come from the cache after the first time.
+        brightness = self.brightness
+        if brightness < 100:
+            brightness = int(math.ceil(brightness * BACKGROUND_LEVELS / 100.0)) * 100 / BACKGROUND_LEVELS
+
+        if not use_background(image, self.stage.depth, brightness):
+            game.drawlist.clear()
+            self.stage.draw_3d(brightness)
+
+            # The background isn't part of the frame's damage.
+            clear_image(image)
+            set_damage_tracking(0)
+            render_list(image, game.drawlist.buf)
+            set_damage_tracking(1)
+            store_background(image)
+
+        # Text is drawn into the image and tracked like everything else, so it only costs its own area.
+        full = begin_frame(image, self.redraw_all)
+        game.drawlist.clear()
+        return full
+
+    def end_draw(self, image):
+        """Draws everything added to the draw list since begin_draw."""
+        render_list(image, game.drawlist.buf)
 
-    def draw_score_cairo(self, x, y, score, player, c):
-        game.cairo.set_source_rgb(c,c,c)
+    def draw_score_3d(self, x, y, score, player, v):
         for j in range(0, 5):
             px = x + j*30
             py = y
-
-            #if player == 1:
-            #    game.cairo.move_to(game.xpoints[0][0]*20-10+px, game.xpoints[0][1]*20-10+py)
-            #    for p in game.xpoints:
-            #        game.cairo.line_to(p[0]*20-10+px, p[1]*20-10+py)
-            #    game.cairo.line_to(game.xpoints[0][0]*20-10+px, game.xpoints[0][1]*20-10+py)
-            #elif player == 2:
-            
-            game.cairo.move_to(px + 10, py)
-            game.cairo.arc(px, py, 10, 0, 2*math.pi)
-
+            r = 12/render_scale
             if j < score:
-                game.cairo.fill()
+                game.drawlist.fill_ellipse_2x(px/render_scale, py/render_scale, r, r, int(v*255.0))
             else:
-                game.cairo.stroke()
-
+                game.drawlist.draw_ellipse_2x(px/render_scale, py/render_scale, r, r, int(v*255.0))
+
+    def draw_x_2x(self, x, y, filled, v):
+        """Draws the 'X' icon centered on the screen pixel (x, y), either filled or as an outline."""
+        x /= render_scale
+        y /= render_scale
+        color = int(v*255.0)
+        if filled:
+            for row, x0, x1 in self.xspans:
+                game.drawlist.draw_line_2x(x + x0, y + row, x + x1, y + row, color)
+        else:
+            size = 20/render_scale
+            points = [(int(px*size)-size/2+x, int(py*size)-size/2+y) for px, py in self.xpoints]
+            for i in range(0, len(points)):
+                x0, y0 = points[i-1]
+                x1, y1 = points[i]
+                game.drawlist.draw_line_2x(x0, y0, x1, y1, color)
 
     def draw_3d(self):
-        self.stage.draw_3d()
-        self.paddle1.draw_3d(self.stage)
-        self.paddle2.draw_3d(self.stage)
-        self.ball.draw_3d(self.stage)
+        self.paddle1.draw_3d(self)
+        self.paddle2.draw_3d(self)
+        self.ball.draw_3d(self)
 
         v = self.brightness/100.0
         self.draw_score_3d(screen_width*1/4-75, 30, self.paddle1.score, 1, v)
         self.draw_score_3d(screen_width*3/4-75, 30, self.paddle2.score, 2, v)
 
-    def draw_cairo (self):
-        #game.cairo.set_source_rgb(color[0]/255.0, color[1]/255.0, color[2]/255.0)
-        #text_cairo(game.stage_descs[game.curlevel]['Name'], -1, 30, 24, v)
-
-        text_cairo("%.2f fps" % self.fps, 50, 30, 12, 1.0)
+        #text_2x(game.stage_descs[game.curlevel]['Name'], -1, 30, 24, v)
+        if quality['FpsCounter']:
+            text_2x("%.2f fps" % self.fps, 50, 30, 12, 1.0)
 
 # Global game instance.
 game = Game()
@@ -1279,6 +1036,283 @@ class ComputerBuddy:
     def __init__ (self):
         self.props = ComputerBuddyProps()
 
+# Runs the game loop from the GLib main loop.  Every frame has a deadline, and the timer for the next frame is set to
+# fire at that deadline, so the time between frames is spent asleep in the main loop instead of pumping events.
+# Frames that are late by a whole period or more are dropped rather than run back to back, and a frame that is still
+# being drawn at its deadline delays the next one.  In on demand mode the timer is stopped altogether, and a frame
+# only runs when wake is called.  BounceActivity uses it while paused, when a frame draws the current state without
+# simulating anything, to show the changes made by input and the editor.
+class FrameScheduler:
+    # Seconds between reports of the frame statistics.
+    REPORT_INTERVAL = 10.0
+
+    def __init__ (self, fps, callback):
+        self.callback = callback
+        self.period = 1.0 / fps
+        self.timer = None
+        self.on_demand = False
+
+        # Deadline of the next frame, and of the frame being run by the callback.
+        self.deadline = time.time()
+        self.frame_deadline = None
+
+        self.reset_stats()
+
+    def reset_stats (self):
+        self.lastreport = time.time()
+        self.frames = 0
+        self.dropped = 0
+        self.overruns = 0
+        self.budget = 0.0
+        self.paths = {}
+
+    def set_fps (self, fps):
+        self.period = 1.0 / fps
+
+    def start (self):
+        if self.timer is None and not self.on_demand:
+            self.deadline = time.time()
+            self.schedule()
+
+    def stop (self):
+        if self.timer is not None:
+            gobject.source_remove(self.timer)
+            self.timer = None
+
+    def set_on_demand (self, on_demand):
+        self.on_demand = on_demand
+        if on_demand:
+            self.stop()
+        else:
+            self.start()
+
+    def wake (self):
+        """Runs a frame as soon as the main loop is idle.  Does nothing unless in on demand mode."""
+        if self.on_demand and self.timer is None:
+            self.deadline = time.time()
+            self.timer = gobject.idle_add(self.on_timer)
+
+    def schedule (self):
+        delay = max(0.0, self.deadline - time.time())
+        self.timer = gobject.timeout_add(int(delay * 1000), self.on_timer)
+
+    def on_timer (self):
+        self.timer = None
+
+        now = time.time()
+        late = now - self.deadline
+        if late >= self.period:
+            # Skip the frames that were missed entirely.
+            missed = int(late / self.period)
+            self.dropped += missed
+            self.deadline += missed * self.period
+
+        self.frames += 1
+        self.frame_deadline = self.deadline + self.period
+        self.callback()
+
+        self.deadline += self.period
+        if not self.on_demand:
+            self.schedule()
+
+        if now - self.lastreport >= self.REPORT_INTERVAL:
+            self.report(now - self.lastreport)
+            self.reset_stats()
+
+        return False
+
+    def frame_done (self, deadline):
+        """Called once a frame has been shown, records how much of the frame's time budget was left.  deadline is
+        the frame_deadline the frame was run with, or None for frames drawn outside of the schedule."""
+        if deadline is None:
+            return
+        left = (deadline - time.time()) / self.period
+        self.budget += left
+        if left < 0:
+            self.overruns += 1
+
+    def count_path (self, path):
+        """Counts a frame drawn by the given path, see BounceActivity.render."""
+        self.paths[path] = self.paths.get(path, 0) + 1
+
+    def report (self, elapsed):
+        if self.frames == 0:
+            return
+        if self.dropped or self.overruns:
+            report = log.info
+        else:
+            report = log.debug
+        paths = ', '.join(['%d %s' % (self.paths[p], p) for p in sorted(self.paths.keys())])
+        report("%d frames in %.1fs, %d dropped, %d over budget, %.0f%% of the budget left on average (%s)",
+               self.frames, elapsed, self.dropped, self.overruns, 100.0 * self.budget / self.frames, paths)
+
+# Picks the render scale, the size in screen pixels of the pixels frames are drawn with, and the quality tier, by
+# comparing the time frames take to draw and copy to the screen with the frame budget.  The settings go from the
+# richest to the cheapest along LADDER: coarser pixels first, which is what makes big windows cheap to draw, then fewer
+# effects, which is what helps slow processors.  Every WINDOW frames the average is checked: above RAISE_LOAD of the
+# budget the governor moves one step cheaper.  It only moves back if the richer step, at its expected cost, would stay
+# under LOWER_LOAD, so that it doesn't flap between two steps.  While a tier is picked by hand, only the scale changes.
+class QualityGovernor:
+    # (render scale, quality tier) from the richest to the cheapest.
+    LADDER = [ (1, 2), (2, 2), (3, 2), (3, 1), (3, 0), (4, 0) ]
+
+    # Frames averaged for each decision.
+    WINDOW = 30
+
+    # Fractions of the frame budget.
+    RAISE_LOAD = 0.8
+    LOWER_LOAD = 0.6
+
+    # Expected cost of drawing a frame at one tier relative to the tier below it.
+    TIER_COST = 1.3
+
+    def __init__ (self, fps):
+        self.period = 1.0 / fps
+        self.step = 1
+        self.override = None
+        self.update()
+        self.reset()
+
+    def reset (self):
+        self.frames = 0
+        self.elapsed = 0.0
+
+    def set_fps (self, fps):
+        self.period = 1.0 / fps
+        self.reset()
+
+    def set_tier (self, tier):
+        """Keeps to the given quality tier, or picks one again if tier is None."""
+        self.override = tier
+        self.update()
+
+    def settings (self, step):
+        scale, tier = self.LADDER[step]
+        if self.override is not None:
+            tier = self.override
+        return scale, tier
+
+    def update (self):
+        self.scale, self.tier = self.settings(self.step)
+
+    def cost (self, step):
+        """Expected cost of drawing a frame at the given step, relative to 1x scale and the lowest tier."""
+        scale, tier = self.settings(step)
+        return self.TIER_COST**tier / scale**2
+
+    def next_step (self, direction):
+        """Returns the nearest step in the given direction, 1 for cheaper or -1 for richer, that changes something,
+        or None if there isn't one."""
+        step = self.step + direction
+        while 0 <= step < len(self.LADDER):
+            if self.settings(step) != self.settings(self.step):
+                return step
+            step += direction
+        return None
+
+    def frame_done (self, elapsed):
+        """Records the seconds a frame took.  Returns True if the settings changed."""
+        self.frames += 1
+        self.elapsed += elapsed
+        if self.frames < self.WINDOW:
+            return False
+
+        load = self.elapsed / self.frames / self.period
+        self.reset()
+        cheaper = self.next_step(1)
+        richer = self.next_step(-1)
+        if load > self.RAISE_LOAD and cheaper is not None:
+            self.step = cheaper
+        elif richer is not None and load * self.cost(richer) / self.cost(self.step) < self.LOWER_LOAD:
+            self.step = richer
+        else:
+            return False
+        self.update()
+        log.info("frames take %.0f%% of the budget, switching to %dx scale and %s quality", 100 * load, self.scale,
+                 QUALITY_TIERS[self.tier]['Name'])
+        return True
+
+# Renders frames on a thread of its own, so that a frame is drawn while the next one is simulated.  Frames come in as
+# Frame snapshots and their results are handed to present on the main thread.  At most one frame is in flight:
+# submitting a frame first waits for the one before and presents it, which holds the simulation back when drawing
+# can't keep up, and keeps the added latency to one frame.  The drawing itself happens in pongc.render_list with the
+# GIL released, so it runs alongside the simulation for real.
+class RenderPipeline:
+    def __init__ (self, render, present):
+        self.render = render
+        self.present = present
+
+        # Frames handed to the render thread, None to stop it.
+        self.frames = Queue.Queue(1)
+
+        # Set while a frame is in flight, and the result of the last frame until it is presented.
+        self.cond = threading.Condition()
+        self.busy = False
+        self.result = None
+
+        self.thread = threading.Thread(target=self.run, name='render')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def submit (self, frame):
+        """Starts rendering frame, once the frame in flight has been presented."""
+        self.finish()
+        self.cond.acquire()
+        self.busy = True
+        self.cond.release()
+        self.frames.put(frame)
+
+    def wait (self):
+        """Waits until no frame is being rendered.  Nothing touches the image until the next submit."""
+        self.cond.acquire()
+        try:
+            while self.busy:
+                self.cond.wait()
+        finally:
+            self.cond.release()
+
+    def finish (self):
+        """Waits for the frame in flight and presents it, unless that has been done already."""
+        self.wait()
+        result, self.result = self.result, None
+        if result is not None:
+            self.present(result)
+
+    def stop (self):
+        self.wait()
+        self.frames.put(None)
+        self.thread.join()
+
+    def run (self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+
+            result = None
+            try:
+                result = self.render(frame)
+            except Exception:
+                log.exception("error rendering frame")
+
+            self.cond.acquire()
+            self.result = result
+            self.busy = False
+            self.cond.notifyAll()
+            self.cond.release()
+
+            # Present the frame as soon as the main loop gets to it, rather than at the next submit.
+            gobject.idle_add(self.on_rendered)
+
+    def on_rendered (self):
+        self.cond.acquire()
+        busy = self.busy
+        self.cond.release()
+        # A busy pipeline means the next frame was submitted, which presented this one.
+        if not busy:
+            self.finish()
+        return False
+
 # Activity class for the game.  Defines the game user interface (toolbar, etc), controls loading & saving, interacts
 # with the Sugar environment.
 class BounceActivity(activity.Activity):
@@ -1291,6 +1325,12 @@ class BounceActivity(activity.Activity):
         activity.Activity.__init__(self, handle)
         self.set_title(_("Bounce"))
 
+        # Create the game loop, it is started once everything is set up.
+        self.limitfps = 30.0 # The governor picks a render scale and quality that keep up, see QualityGovernor.
+        self.scheduler = FrameScheduler(self.limitfps, self.tick)
+        self.governor = QualityGovernor(self.limitfps)
+        self.pipeline = RenderPipeline(self.render, self.present)
+
         # Build the toolbars.
         self.build_toolbox()
 
@@ -1303,9 +1343,9 @@ class BounceActivity(activity.Activity):
         # Build the score panel.
         self.build_scorepanel()
 
-        # Turn off double buffering except for the drawarea, which mixes cairo and custom drawing.
+        # Turn off double buffering.  Everything is drawn into drawimage, which is copied to the window in one go.
         self.set_double_buffered(False)
-        self.drawarea.set_double_buffered(True)
+        self.drawarea.set_double_buffered(False)
 
         # Initialize the game.
         game.new_game()
@@ -1316,7 +1356,13 @@ class BounceActivity(activity.Activity):
         # Initialize the FPS counter & limiter.
         self.lastclock = time.time()
         game.fps = 0.0
-        self.limitfps = 20.0 # 20fps is what the XO can currently handle.
+
+        # The simulation runs at a fixed rate regardless of the framerate.  When drawing falls behind, up to maxticks
+        # simulation frames are run per drawn frame to catch up, beyond that the game slows down.
+        self.tickrate = 20.0
+        self.maxticks = 4
+        self.lasttick = time.time()
+        self.tickaccum = 0.0
 
         # Get current player info for the scores table.
         self.pservice = presenceservice.get_instance()
@@ -1330,8 +1376,8 @@ class BounceActivity(activity.Activity):
         self.set_canvas(self.drawarea)
         self.show_interface()
         
-        # Get the mainloop ready to run (this should come last).
-        gobject.timeout_add(50, self.mainloop)
+        # Start the game loop (this should come last).
+        self.scheduler.start()
 
     #-----------------------------------------------------------------------------------------------------------------
     # User interface building.
@@ -1354,7 +1400,11 @@ class BounceActivity(activity.Activity):
         self.drawarea.connect('button-release-event', self.on_mouse)
 
         self.drawimage = None
-        game.drawimage = None
+        self.renderimage = None
+
+        # Whether to try shared memory images, and the kind of image last created, see create_drawimage.
+        self.use_shm = True
+        self.blit_path = None
 
     def build_gamebox (self):
         self.pausebtn = toolbutton.ToolButton('media-playback-pause')
@@ -1372,6 +1422,21 @@ class BounceActivity(activity.Activity):
         sep.set_expand(True)
         sep.set_draw(False)
 
+        # Quality tier, picked automatically unless chosen here.  The toolbar is rebuilt whenever the game mode is
+        # entered, so the combo starts out showing the governor's current choice.
+        self.qualitycombo = gtk.combo_box_new_text()
+        self.qualitycombo.append_text(_("Automatic"))
+        for tier in QUALITY_TIERS:
+            self.qualitycombo.append_text(tier['Name'])
+        if self.governor.override is None:
+            self.qualitycombo.set_active(0)
+        else:
+            self.qualitycombo.set_active(self.governor.override + 1)
+        self.qualitycombo.connect('changed', self.on_game_quality)
+        self.qualityitem = gtk.ToolItem()
+        self.qualityitem.add(self.qualitycombo)
+        self.qualityitem.set_tooltip_text(_("Quality"))
+
         self.editbtn = toolbutton.ToolButton('dialog-ok')
         self.editbtn.set_tooltip(_("Edit"))
         self.editbtn.connect('clicked', self.on_edit)
@@ -1380,6 +1445,8 @@ class BounceActivity(activity.Activity):
         self.gamebox.insert(self.pausebtn, -1)
         self.gamebox.insert(self.showscoresbtn, -1)
         self.gamebox.insert(self.clearscoresbtn, -1)
+        self.gamebox.insert(gtk.SeparatorToolItem(), -1)
+        self.gamebox.insert(self.qualityitem, -1)
         self.gamebox.insert(sep, -1)
         self.gamebox.insert(self.editbtn, -1)
 
@@ -1469,6 +1536,16 @@ class BounceActivity(activity.Activity):
         else:
             self.scorepanel.hide_all()
 
+    def on_game_quality (self, combo):
+        active = combo.get_active()
+        if active == 0:
+            self.governor.set_tier(None)
+        else:
+            self.governor.set_tier(active - 1)
+
+        # Show the change right away, even while paused.
+        self.scheduler.wake()
+
     def on_game_clearscores (self, button):
         msg = alert.ConfirmationAlert()
         msg.props.title = _('Reset History?')
@@ -1546,30 +1623,134 @@ class BounceActivity(activity.Activity):
         screen_height = rect[3]
         set_3d_params(screen_width, screen_height, viewport_scale)
 
-        # Rebuild drawimage.
-        self.drawimage = gtk.gdk.Image(gtk.gdk.IMAGE_FASTEST, gtk.gdk.visual_get_system(), rect[2], rect[3])
-        game.drawimage = self.drawimage
+        # Rebuild drawimage.  Whatever the scaled frames don't cover at the edges stays black.
+        self.drawimage = self.create_drawimage(rect[2], rect[3])
+        if not set_pixel_format(self.drawimage):
+            visual = self.drawimage.get_visual()
+            log.warning("unsupported visual: depth %d, %d bytes per pixel", visual.depth, self.drawimage.bpp)
+        clear_image(self.drawimage)
+        self.set_render_scale(self.governor.scale)
 
         return True
 
+    def set_render_scale (self, scale):
+        """Sets the size of the pixels frames are drawn with.  Above a scale of 1, frames are drawn into renderimage,
+        a reduced image of 1/scale of the window size, and enlarged into drawimage by render."""
+        global render_scale
+        render_scale = scale
+        set_pixel_scale(scale, 1)
+        if scale == 1:
+            self.renderimage = self.drawimage
+        else:
+            depth = self.drawimage.get_visual().depth
+            self.renderimage = create_render_target(screen_width/scale, screen_height/scale, depth)
+        game.redraw_all = True
+
+    def create_drawimage (self, width, height):
+        """Creates the offscreen image.  When the X server supports the MIT-SHM extension the image is kept in shared
+        memory, so that blits don't have to copy every frame through the X connection.  Otherwise, or if the shared
+        image can't be created, a normal image is used from then on."""
+        visual = gtk.gdk.visual_get_system()
+
+        image = None
+        if self.use_shm:
+            try:
+                image = gtk.gdk.Image(gtk.gdk.IMAGE_SHARED, visual, width, height)
+            except RuntimeError:
+                self.use_shm = False
+        if image is None:
+            image = gtk.gdk.Image(gtk.gdk.IMAGE_NORMAL, visual, width, height)
+
+        if image.type == gtk.gdk.IMAGE_SHARED:
+            path = 'MIT-SHM'
+        else:
+            path = 'plain'
+        if path != self.blit_path:
+            log.info("blitting %dx%d frames through %s images", width, height, path)
+            self.blit_path = path
+
+        return image
+
+    def update_drawimage (self):
+        """Recreates the offscreen images if the window was resized or the governor changed the render scale, and
+        switches to the governor's quality tier.  Must not be called while a frame is being rendered."""
+        rect = self.drawarea.get_allocation()
+        if self.drawimage is None or (rect[2] != screen_width or rect[3] != screen_height):
+            self.on_drawarea_resize()
+        elif self.governor.scale != render_scale:
+            self.set_render_scale(self.governor.scale)
+
+        global quality
+        if QUALITY_TIERS[self.governor.tier] is not quality:
+            quality = QUALITY_TIERS[self.governor.tier]
+            # The grid is part of the cached backgrounds.
+            drop_backgrounds()
+            game.redraw_all = True
+
+    def render (self, frame):
+        """Performs 3D rendering of frame to the offscreen image.  Returns a list of (x, y, width, height) rectangles
+        covering what changed since the last frame, the path the frame took, its deadline and the seconds it took.
+        Called on the render thread, see RenderPipeline, or on the main thread while the pipeline is idle.
+
+        Frames are counted by the path they took: 'full' when the whole window is redrawn, otherwise 'overlay' when
+        the sequence has text on screen and 'plain' when it doesn't."""
+        start = time.time()
+        full = frame.begin_draw(self.renderimage)
+        frame.sequence.draw_3d(frame)
+        frame.end_draw(self.renderimage)
+
+        rects = get_damage()
+        if self.renderimage is not self.drawimage:
+            rects = upscale_image(self.renderimage, self.drawimage, render_scale, rects)
+
+        if full:
+            path = 'full'
+        elif frame.overlay:
+            path = 'overlay'
+        else:
+            path = 'plain'
+        return rects, path, frame.deadline, time.time() - start
+
+    def present (self, result):
+        """Shows a frame rendered by render.  Only the parts of the window that changed are exposed, and they are
+        copied right away.  The time spent drawing and copying the frame goes to the governor."""
+        rects, path, deadline, elapsed = result
+        self.scheduler.count_path(path)
+        start = time.time()
+        if self.drawarea.bin_window:
+            for x, y, w, h in rects:
+                self.drawarea.bin_window.invalidate_rect(gtk.gdk.Rectangle(x, y, w, h), False)
+            self.drawarea.bin_window.process_updates(False)
+        self.scheduler.frame_done(deadline)
+        self.governor.frame_done(elapsed + time.time() - start)
+
     def on_drawarea_expose (self, widget, event):
         if not self.drawarea.bin_window:
             return True
 
+        # Nothing may draw to the image while it is copied.  A frame that finishes meanwhile is presented later.
+        self.pipeline.wait()
+
+        # The image is rendered by tick, and only rendered here when there is no valid image to copy, before the
+        # first frame or after a resize.  Other changes are left to the next frame, which is woken up in case the
+        # game is paused.
         rect = self.drawarea.get_allocation()
         if self.drawimage is None or (rect[2] != screen_width or rect[3] != screen_height):
-            self.on_drawarea_resize()
+            self.update_drawimage()
+            rects, path, deadline, elapsed = self.render(game.snapshot(None))
+            self.scheduler.count_path(path)
+        elif game.redraw_all:
+            self.scheduler.wake()
 
-        # Perform 3D rendering to the offscreen image and draw it to the screen.
-        clear_image(self.drawimage)
-        game.sequence.draw_3d()
+        # Copy the exposed parts of the offscreen image to the screen.
         gc = self.drawarea.get_style().fg_gc[gtk.STATE_NORMAL]
-        self.drawarea.bin_window.draw_image(gc, self.drawimage, 0, 0, 0, 0, -1, -1)
+        for r in event.region.get_rectangles():
+            self.drawarea.bin_window.draw_image(gc, self.drawimage, r.x, r.y, r.x, r.y, r.width, r.height)
 
-        # Perform Cairo rendering over the top.
-        game.cairo = self.drawarea.bin_window.cairo_create()
-        game.sequence.draw_cairo()
-        game.cairo = None
+        # The X server reads shared memory images after draw_image returns, so let it finish before the next frame
+        # is drawn into the image.
+        if self.drawimage.type == gtk.gdk.IMAGE_SHARED:
+            gtk.gdk.flush()
 
         # Hack to fix toolbox refresh.
         #self.tbox.queue_draw()
@@ -1631,6 +1812,9 @@ class BounceActivity(activity.Activity):
 
     def pause_game (self, p):
         self.paused = p
+
+        # Nothing is simulated while paused, so frames are only drawn when woken.
+        self.scheduler.set_on_demand(p)
         if self.paused:
             self.pausebtn.set_icon('media-playback-start')
         else:
@@ -1646,20 +1830,51 @@ class BounceActivity(activity.Activity):
             game.mousedown = 1
         if event.type == gtk.gdk.BUTTON_RELEASE:
             game.mousedown = 0
+        self.scheduler.wake()
 
     #-----------------------------------------------------------------------------------------------------------------
     # Main loop
 
     def on_destroy (self, widget):
-        self.running = False
+        self.scheduler.stop()
+        self.pipeline.stop()
+
+    def submit_frame (self):
+        """Starts drawing the current state of the game.  The frame is drawn on the render thread while the next one
+        is simulated, and the image can only be replaced while the previous frame isn't being drawn."""
+        if self.drawarea.bin_window:
+            self.pipeline.finish()
+            self.update_drawimage()
+            self.pipeline.submit(game.snapshot(self.scheduler.frame_deadline))
 
     def tick (self):
         if self.paused:
+            # Nothing is simulated while paused, but the frames woken by input still show the current state, with any
+            # changes made in the editor.
+            self.lasttick = time.time()
+            self.submit_frame()
             return True
 
-        # Update current game sequence and animate.
-        game.sequence.update()
-        self.drawarea.queue_draw()
+        # Update current game sequence once for every simulation frame that has elapsed since the last tick.
+        now = time.time()
+        self.tickaccum += now - self.lasttick
+        self.lasttick = now
+
+        period = 1.0 / self.tickrate
+        ticks = 0
+        while self.tickaccum >= period:
+            if ticks == self.maxticks:
+                # Too far behind, drop the time that couldn't be caught up.
+                self.tickaccum %= period
+                break
+            game.stepped = False
+            game.sequence.update()
+            self.tickaccum -= period
+            ticks += 1
+
+        # Draw the objects part way between their last two simulated positions, by the time left over.
+        game.alpha = self.tickaccum / period
+        self.submit_frame()
 
         # Compute framerate.
         diff = float(time.time() - self.lastclock)
@@ -1669,17 +1884,6 @@ class BounceActivity(activity.Activity):
 
         return True
 
-    def mainloop (self):
-        """Runs the game loop.  Note that this doesn't actually return until the activity ends."""
-        self.running = True
-        clock = pygame.time.Clock()
-        while self.running:
-            clock.tick(self.limitfps)
-            self.tick()
-            while gtk.events_pending():
-                gtk.main_iteration(False)
-        return False
-
     #-----------------------------------------------------------------------------------------------------------------
     # Journal integration
 
@@ -16,216 +16,1293 @@
     along with 3D Pong.  If not, see <http://www.gnu.org/licenses/>.
 */
 #include "pongc.h"
+#include "font.h"
 
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include <structmember.h>
+#include <zlib.h>
+
+// Pixel storage: 2 bytes for 15 and 16 bit visuals, 4 bytes for 24 and 32 bit ones.
 typedef guint16 depth16_t;
 typedef guint32 depth24_t;
 
-template <typename pixel_t> inline
-void _clear_image(GdkImage* img)
+// Pixel kernels.  Clears, span fills and row copies go through these, and the fastest version the CPU supports is
+// picked when the module loads.  fill writes a 32 bit pattern over a run of bytes; for 16 bit images the pattern
+// holds the pixel twice, so any run that starts and ends on a pixel boundary can be filled with it.
+typedef void (*fill_bytes_t)(void* dst, guint32 pattern, size_t bytes);
+typedef void (*copy_bytes_t)(void* dst, const void* src, size_t bytes);
+
+struct pixel_kernels_t
 {
-	pixel_t* pixels = (pixel_t*)img->mem;
-	int pitch = img->bpl/sizeof(pixel_t);
-	for (int y = 0; y < img->height; y++)
-		memset(pixels + pitch*y, 0, img->bpl);
-}
+	const char* name;
+	fill_bytes_t fill;
+	copy_bytes_t copy;
+};
 
-void clear_image(GdkImage* img)
+static void fill_bytes_scalar(void* dst, guint32 pattern, size_t bytes)
 {
-    if (img->depth == 16)
-        _clear_image<depth16_t>(img);
-    else
-        _clear_image<depth24_t>(img);
+	if (pattern == 0)
+	{
+		memset(dst, 0, bytes);
+		return;
+	}
+	guint8* p = (guint8*)dst;
+	if (((size_t)p & 2) && bytes >= 2)
+	{
+		*(guint16*)p = (guint16)pattern;
+		p += 2;
+		bytes -= 2;
+	}
+	guint32* p32 = (guint32*)p;
+	for (; bytes >= 4; bytes -= 4)
+		*p32++ = pattern;
+	if (bytes >= 2)
+		*(guint16*)p32 = (guint16)pattern;
 }
 
-inline
-void to_pixel(depth16_t *pixel, uint16_t c)
+static void copy_bytes_scalar(void* dst, const void* src, size_t bytes)
 {
-	*pixel = (c>>3) | (c>>2)<<5 | (c>>3)<<11;
+	memcpy(dst, src, bytes);
 }
 
-inline
-void to_pixel(depth24_t *pixel, uint16_t c)
+#if defined(__GNUC__) && (defined(__i386__) || defined(__x86_64__))
+#include <immintrin.h>
+
+// The SIMD kernels write the head and tail of a run with unaligned stores that may overlap the aligned body.  As runs
+// start on a pixel boundary, the pattern lines up with the pixels wherever it is stored.
+__attribute__((target("sse2")))
+static void fill_bytes_sse2(void* dst, guint32 pattern, size_t bytes)
 {
-    depth24_t p = 0xff & c;
-	*pixel = p | p<<8 | p<<16;
+	guint8* p = (guint8*)dst;
+	if (bytes < 16)
+	{
+		fill_bytes_scalar(p, pattern, bytes);
+		return;
+	}
+	__m128i v = _mm_set1_epi32(pattern);
+	guint8* end = p + bytes;
+	_mm_storeu_si128((__m128i*)p, v);
+	p = (guint8*)(((size_t)p + 16) & ~(size_t)15);
+	for (; p + 64 <= end; p += 64)
+	{
+		_mm_store_si128((__m128i*)p, v);
+		_mm_store_si128((__m128i*)(p + 16), v);
+		_mm_store_si128((__m128i*)(p + 32), v);
+		_mm_store_si128((__m128i*)(p + 48), v);
+	}
+	for (; p + 16 <= end; p += 16)
+		_mm_store_si128((__m128i*)p, v);
+	if (p < end)
+		_mm_storeu_si128((__m128i*)(end - 16), v);
 }
 
-template <typename pixel_t> inline
-void _draw_point_2x(GdkImage* img, int x, int y, uint16_t c)
+__attribute__((target("sse2")))
+static void copy_bytes_sse2(void* dst, const void* src, size_t bytes)
 {
-	if (x < 0 || y < 0 || x >= img->width/2-1 || y >= img->height/2-1)
+	if (bytes < 16)
+	{
+		memcpy(dst, src, bytes);
 		return;
+	}
+	guint8* d = (guint8*)dst;
+	const guint8* s = (const guint8*)src;
+	__m128i tail = _mm_loadu_si128((const __m128i*)(s + bytes - 16));
+	for (size_t i = 0; i + 16 <= bytes; i += 16)
+		_mm_storeu_si128((__m128i*)(d + i), _mm_loadu_si128((const __m128i*)(s + i)));
+	_mm_storeu_si128((__m128i*)(d + bytes - 16), tail);
+}
 
-	pixel_t* pixels = (pixel_t*)img->mem;
-	int pitch = img->bpl/sizeof(pixel_t);
-	int ofs = pitch*y*2+x*2;
+__attribute__((target("avx2")))
+static void fill_bytes_avx2(void* dst, guint32 pattern, size_t bytes)
+{
+	guint8* p = (guint8*)dst;
+	if (bytes < 32)
+	{
+		fill_bytes_sse2(p, pattern, bytes);
+		return;
+	}
+	__m256i v = _mm256_set1_epi32(pattern);
+	guint8* end = p + bytes;
+	_mm256_storeu_si256((__m256i*)p, v);
+	p = (guint8*)(((size_t)p + 32) & ~(size_t)31);
+	for (; p + 128 <= end; p += 128)
+	{
+		_mm256_store_si256((__m256i*)p, v);
+		_mm256_store_si256((__m256i*)(p + 32), v);
+		_mm256_store_si256((__m256i*)(p + 64), v);
+		_mm256_store_si256((__m256i*)(p + 96), v);
+	}
+	for (; p + 32 <= end; p += 32)
+		_mm256_store_si256((__m256i*)p, v);
+	if (p < end)
+		_mm256_storeu_si256((__m256i*)(end - 32), v);
+}
 
-	pixel_t pix;
-    to_pixel(&pix, c);
+__attribute__((target("avx2")))
+static void copy_bytes_avx2(void* dst, const void* src, size_t bytes)
+{
+	if (bytes < 32)
+	{
+		copy_bytes_sse2(dst, src, bytes);
+		return;
+	}
+	guint8* d = (guint8*)dst;
+	const guint8* s = (const guint8*)src;
+	__m256i tail = _mm256_loadu_si256((const __m256i*)(s + bytes - 32));
+	for (size_t i = 0; i + 32 <= bytes; i += 32)
+		_mm256_storeu_si256((__m256i*)(d + i), _mm256_loadu_si256((const __m256i*)(s + i)));
+	_mm256_storeu_si256((__m256i*)(d + bytes - 32), tail);
+	_mm256_zeroupper();
+}
 
-	pixels[ofs] = pix;
-	pixels[ofs+1] = pix;
-	pixels[ofs+pitch] = pix;
-	pixels[ofs+pitch+1] = pix;
+static bool cpu_supports(const char* name)
+{
+	__builtin_cpu_init();
+	if (strcmp(name, "avx2") == 0)
+		return __builtin_cpu_supports("avx2");
+	if (strcmp(name, "sse2") == 0)
+		return __builtin_cpu_supports("sse2");
+	return true;
 }
 
-void draw_point_2x(GdkImage* img, int x, int y, uint16_t c)
+// Best first.
+static const pixel_kernels_t kernel_table[] =
 {
-    if (img->depth == 16)
-        _draw_point_2x<depth16_t>(img, x, y, c);
-    else
-        _draw_point_2x<depth24_t>(img, x, y, c);
+	{ "avx2", fill_bytes_avx2, copy_bytes_avx2 },
+	{ "sse2", fill_bytes_sse2, copy_bytes_sse2 },
+	{ "scalar", fill_bytes_scalar, copy_bytes_scalar },
+};
+#else
+static bool cpu_supports(const char* name)
+{
+	return true;
 }
 
-void draw_line_2x(GdkImage* img, int x0, int y0, int x1, int y1, int color)
+static const pixel_kernels_t kernel_table[] =
 {
-	// Make sure the line runs top to bottom.
-	if (y0 > y1) 
+	{ "scalar", fill_bytes_scalar, copy_bytes_scalar },
+};
+#endif
+
+static const int KERNEL_COUNT = sizeof(kernel_table)/sizeof(kernel_table[0]);
+
+static const pixel_kernels_t* kernels = &kernel_table[KERNEL_COUNT-1];
+
+// Picks the pixel kernels by name, or the best ones the CPU supports for "auto".  Returns 0 if the named kernels
+// don't exist or aren't supported, leaving the current ones in place.
+int set_pixel_kernels(const char* name)
+{
+	bool any = strcmp(name, "auto") == 0;
+	for (int i = 0; i < KERNEL_COUNT; i++)
 	{
-		int ty = y0; y0 = y1; y1 = ty;
-		int tx = x0; x0 = x1; x1 = tx;
+		if ((any || strcmp(name, kernel_table[i].name) == 0) && cpu_supports(kernel_table[i].name))
+		{
+			kernels = &kernel_table[i];
+			return 1;
+		}
 	}
+	return 0;
+}
 
-	// Draw the initial pixel, which is always exactly intersected by the line and so needs no weighting.
-	draw_point_2x(img, x0, y0, color);
-	
-	int dx = x1 - x0;
-	int xdir;
-	if (dx >= 0)
-		xdir = 1;
-	else 
+const char* get_pixel_kernels()
+{
+	return kernels->name;
+}
+
+static struct pixel_kernels_init_t
+{
+	pixel_kernels_init_t()
 	{
-		xdir = -1;
-		dx = -dx; // make dx positive.
+		set_pixel_kernels("auto");
 	}
-	
-	int dy = y1 - y0;
-	if (dy == 0) // Horizontal line
+} pixel_kernels_init;
+
+inline
+guint32 to_pattern(depth16_t pix)
+{
+	return pix | (pix << 16);
+}
+
+inline
+guint32 to_pattern(depth24_t pix)
+{
+	return pix;
+}
+
+void clear_image(GdkImage* img)
+{
+	kernels->fill(img->mem, 0, img->bpl*img->height);
+}
+
+// Damage tracking.  Every primitive drawn while tracking is enabled records the rectangle it touched, in image
+// pixels.  begin_frame clears only what the previous frame drew, and get_damage returns the rectangles of the window
+// that need updating, which are those of the previous frame and of the current one.  Drawing into a background (see
+// use_background) is done with tracking disabled.
+struct damage_rect_t
+{
+	int x0, y0, x1, y1; // x1 and y1 are exclusive.
+};
+
+// Beyond this many rectangles, new ones are merged into the existing rectangle that grows the least.
+const int MAX_DAMAGE_RECTS = 64;
+
+static damage_rect_t damage_cur[MAX_DAMAGE_RECTS];
+static damage_rect_t damage_prev[MAX_DAMAGE_RECTS];
+static int damage_cur_count = 0;
+static int damage_prev_count = 0;
+
+static bool damage_tracking = true;
+static bool damage_full = true;
+static int damage_width = 0;
+static int damage_height = 0;
+
+static inline int rect_area(const damage_rect_t& r)
+{
+	return (r.x1 - r.x0) * (r.y1 - r.y0);
+}
+
+static inline damage_rect_t rect_union(const damage_rect_t& a, const damage_rect_t& b)
+{
+	damage_rect_t r;
+	r.x0 = a.x0 < b.x0 ? a.x0 : b.x0;
+	r.y0 = a.y0 < b.y0 ? a.y0 : b.y0;
+	r.x1 = a.x1 > b.x1 ? a.x1 : b.x1;
+	r.y1 = a.y1 > b.y1 ? a.y1 : b.y1;
+	return r;
+}
+
+static inline bool rect_overlaps(const damage_rect_t& a, const damage_rect_t& b)
+{
+	return a.x0 <= b.x1 && b.x0 <= a.x1 && a.y0 <= b.y1 && b.y0 <= a.y1;
+}
+
+static void add_rect(damage_rect_t* rects, int* count, damage_rect_t r)
+{
+	// Merge with a rectangle that overlaps or touches this one.
+	for (int i = 0; i < *count; i++)
 	{
-		while (dx-- != 0) 
+		if (rect_overlaps(rects[i], r))
 		{
-			x0 += xdir;
-			draw_point_2x(img, x0, y0, color);
+			r = rect_union(rects[i], r);
+			rects[i] = rects[--*count];
+			i = -1; // The grown rectangle may now overlap rectangles that were already checked.
 		}
 	}
-	else if (dx == 0) // Vertical line
+
+	if (*count < MAX_DAMAGE_RECTS)
 	{
-		do 
-		{
-			y0++;
-			draw_point_2x(img, x0, y0, color);
-		} while (--dy != 0);
+		rects[(*count)++] = r;
+		return;
 	}
-	else if (dx == dy) // Diagonal line
+
+	int best = 0;
+	int best_growth = 0;
+	for (int i = 0; i < *count; i++)
 	{
-		do 
+		int growth = rect_area(rect_union(rects[i], r)) - rect_area(rects[i]);
+		if (i == 0 || growth < best_growth)
 		{
-			x0 += xdir;
-			y0++;
-			draw_point_2x(img, x0, y0, color);
-		} while (--dy != 0);
+			best = i;
+			best_growth = growth;
+		}
 	}
-	else // Line is not horizontal, diagonal, or vertical.
+	rects[best] = rect_union(rects[best], r);
+}
+
+// Set on the worker threads of render_list, which leave recording the damage of a frame to the calling thread.
+static __thread bool render_worker = false;
+
+// Rows of the band of the image being drawn by the current thread, in 2x pixels, see render_list.
+static __thread int band_ymin = 0;
+static __thread int band_ymax = G_MAXINT;
+
+// Size of the pixels drawn by the 2x primitives, in screen pixels and in image pixels, see set_pixel_scale.  Despite
+// the name, 2x pixels are pixel_scale screen pixels on a side.
+const int MAX_PIXEL_SCALE = 4;
+
+static int pixel_scale = 2;
+static int pixel_block = 2;
+
+// Records the damage of a primitive covering the 2x pixels from (x0, y0) to (x1, y1) inclusive.
+static void damage_2x(int x0, int y0, int x1, int y1)
+{
+	if (!damage_tracking || render_worker)
+		return;
+
+	int s = pixel_block;
+	damage_rect_t r;
+	r.x0 = x0*s < 0 ? 0 : x0*s;
+	r.y0 = y0*s < 0 ? 0 : y0*s;
+	r.x1 = (x1+1)*s > damage_width ? damage_width : (x1+1)*s;
+	r.y1 = (y1+1)*s > damage_height ? damage_height : (y1+1)*s;
+	if (r.x0 >= r.x1 || r.y0 >= r.y1)
+		return;
+
+	add_rect(damage_cur, &damage_cur_count, r);
+}
+
+// Background layer cache.  Things that only change now and then, like the stage, are drawn once into a background
+// buffer, and each frame starts from a copy of it instead of a cleared image.  A few backgrounds are kept so that
+// fades can cycle through a handful of brightness levels without redrawing.
+struct background_t
+{
+	// Cache key.
+	int stage_depth;
+	int brightness;
+	int width, height, depth, bpl;
+
+	unsigned int last_used;
+	char* mem;
+};
+
+const int MAX_BACKGROUNDS = 10;
+
+static background_t backgrounds[MAX_BACKGROUNDS];
+static unsigned int background_clock = 0;
+
+// Background selected by use_background, and the one the previous frame was drawn over.
+static background_t* background = NULL;
+static background_t* drawn_background = NULL;
+static bool background_changed = false;
+
+static inline bool background_fits(const background_t& b, GdkImage* img)
+{
+	return b.width == img->width && b.height == img->height && b.depth == img->depth && b.bpl == img->bpl;
+}
+
+// Whether background a should be replaced before b: empty slots go first, then those for another image size, then
+// the least recently used.
+static inline bool replace_first(const background_t& a, const background_t& b, GdkImage* img)
+{
+	if (!a.mem || !b.mem)
+		return !a.mem && b.mem;
+	if (background_fits(a, img) != background_fits(b, img))
+		return !background_fits(a, img);
+	return a.last_used < b.last_used;
+}
+
+// Selects the background for the given stage depth and brightness, to be used by the next begin_frame.  Returns 1 if
+// it is cached, or 0 if it must be drawn into img and saved with store_background first.
+int use_background(GdkImage* img, int stage_depth, int brightness)
+{
+	background_clock++;
+
+	background_t* slot = NULL;
+	for (int i = 0; i < MAX_BACKGROUNDS; i++)
 	{
-		// Initialize the line error accumulator to 0 
-		uint16_t ErrorAcc = 0;  
-		
-		// # of bits by which to shift ErrorAcc to get intensity level 
-		uint16_t IntensityShift = 16 - 8;
-		
-		// Mask used to flip all bits in an intensity weighting, producing the result (1 - intensity weighting) 
-		uint16_t WeightingComplementMask = 256 - 1;
-		
-		// Is this an X-major or Y-major line?
-		if (dy > dx) 
+		background_t& b = backgrounds[i];
+		if (b.mem && background_fits(b, img) && b.stage_depth == stage_depth && b.brightness == brightness)
 		{
-			// Y-major line; calculate 16-bit fixed-point fractional part of a pixel that X advances each time Y advances 
-			// 1 pixel, truncating the result so that we won't overrun the endpoint along the X axis
-			uint16_t ErrorAdj = ((unsigned long) dx << 16) / (unsigned long) dy;
-			// Draw all pixels other than the first and last
-			while (--dy) 
-			{
-				uint16_t ErrorAccTemp = ErrorAcc;   /* remember currrent accumulated error */
-				ErrorAcc += ErrorAdj;      /* calculate error for next pixel */
-				if (ErrorAcc <= ErrorAccTemp) 
-				{
-					// The error accumulator turned over, so advance the X coord
-					x0 += xdir;
-				}
-				y0++; // Y-major, so always advance Y
-				// The IntensityBits most significant bits of ErrorAcc give us the intensity weighting for this pixel, and the 
-				// complement of the weighting for the paired pixel
-				uint16_t Weighting = ErrorAcc >> IntensityShift;
-				//draw_point_2x(img, x0, y0, (color * Weighting) >> 8);
-				//draw_point_2x(img, x0 + xdir, y0, (color * (Weighting ^ WeightingComplementMask)) >> 8);
-				draw_point_2x(img, x0, y0, color);
-			}
-			// Draw the final pixel, which is always exactly intersected by the line and so needs no weighting
-			draw_point_2x(img, x1, y1, color);
+			b.last_used = background_clock;
+			background = &b;
+			return 1;
 		}
+
+		if (!slot || replace_first(b, *slot, img))
+			slot = &b;
+	}
+
+	if (!slot->mem || !background_fits(*slot, img))
+	{
+		delete[] slot->mem;
+		slot->mem = new char[img->bpl*img->height];
+	}
+	slot->stage_depth = stage_depth;
+	slot->brightness = brightness;
+	slot->width = img->width;
+	slot->height = img->height;
+	slot->depth = img->depth;
+	slot->bpl = img->bpl;
+	slot->last_used = background_clock;
+
+	background = slot;
+	background_changed = true;
+	return 0;
+}
+
+// Forgets every cached background, for when the way they are drawn changes.
+void drop_backgrounds()
+{
+	for (int i = 0; i < MAX_BACKGROUNDS; i++)
+	{
+		delete[] backgrounds[i].mem;
+		backgrounds[i].mem = NULL;
+	}
+	background = NULL;
+	drawn_background = NULL;
+	background_changed = true;
+}
+
+void store_background(GdkImage* img)
+{
+	if (background)
+		memcpy(background->mem, img->mem, img->bpl*img->height);
+}
+
+template <typename pixel_t> inline
+void _restore_rect(GdkImage* img, const damage_rect_t& r)
+{
+	pixel_t* pixels = (pixel_t*)img->mem;
+	int pitch = img->bpl/sizeof(pixel_t);
+	if (background)
+	{
+		pixel_t* src = (pixel_t*)background->mem;
+		for (int y = r.y0; y < r.y1; y++)
+			kernels->copy(pixels + pitch*y + r.x0, src + pitch*y + r.x0, (r.x1 - r.x0)*sizeof(pixel_t));
+	}
+	else
+	{
+		for (int y = r.y0; y < r.y1; y++)
+			kernels->fill(pixels + pitch*y + r.x0, 0, (r.x1 - r.x0)*sizeof(pixel_t));
+	}
+}
+
+// Starts a frame.  Returns 1 if the whole image was redrawn, or 0 if only what the previous frame drew was restored.
+int begin_frame(GdkImage* img, int full)
+{
+	memcpy(damage_prev, damage_cur, damage_cur_count*sizeof(damage_rect_t));
+	damage_prev_count = damage_cur_count;
+	damage_cur_count = 0;
+
+	// Start from the selected background, if any, otherwise from a cleared image.
+	if (background && !background_fits(*background, img))
+		background = NULL;
+
+	damage_full = full || img->width != damage_width || img->height != damage_height;
+	damage_full = damage_full || background != drawn_background || background_changed;
+	damage_width = img->width;
+	damage_height = img->height;
+	drawn_background = background;
+	background_changed = false;
+
+	if (damage_full)
+	{
+		if (background)
+			memcpy(img->mem, background->mem, img->bpl*img->height);
 		else
-		{
-			// It's an X-major line; calculate 16-bit fixed-point fractional part of a pixel that Y advances each time X 
-			// advances 1 pixel, truncating the result to avoid overrunning the endpoint along the X axis
-			uint16_t ErrorAdj = ((unsigned long) dy << 16) / (unsigned long) dx;
-			// Draw all pixels other than the first and last
-			while (--dx) 
-			{
-				uint16_t ErrorAccTemp = ErrorAcc;   // remember currrent accumulated error
-				ErrorAcc += ErrorAdj;      // calculate error for next pixel
-				if (ErrorAcc <= ErrorAccTemp) 
-				{
-					// The error accumulator turned over, so advance the Y coord
-					y0++;
-				}
-				x0 += xdir; // X-major, so always advance X 
-				// The IntensityBits most significant bits of ErrorAcc give us the intensity weighting for this pixel, and the 
-				// complement of the weighting for the paired pixel
-				uint16_t Weighting = ErrorAcc >> IntensityShift;
-				//draw_point_2x(img, x0, y0, (color * Weighting) >> 8);
-				//draw_point_2x(img, x0, y0 + 1, (color * (Weighting ^ WeightingComplementMask)) >> 8);
-				draw_point_2x(img, x0, y0, color);
-			}
-			// Draw the final pixel, which is always exactly intersected by the line and so needs no weighting
-			draw_point_2x(img, x1, y1, color);
-		}
+			clear_image(img);
+		return 1;
+	}
+
+	for (int i = 0; i < damage_prev_count; i++)
+	{
+		if (img->bpp == 2)
+			_restore_rect<depth16_t>(img, damage_prev[i]);
+		else
+			_restore_rect<depth24_t>(img, damage_prev[i]);
 	}
+	return 0;
 }
 
-void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+void set_damage_tracking(int enabled)
 {
-	if (rx==0 && ry==0) // Special case - draw a single pixel 
-	{  
-		draw_point_2x(img, x, y, color);
-		return;
+	damage_tracking = enabled != 0;
+}
+
+PyObject* get_damage()
+{
+	damage_rect_t rects[MAX_DAMAGE_RECTS];
+	int count = 0;
+
+	if (damage_full)
+	{
+		rects[0].x0 = 0;
+		rects[0].y0 = 0;
+		rects[0].x1 = damage_width;
+		rects[0].y1 = damage_height;
+		count = 1;
 	}
-	if (rx==0)  // Special case for rx=0 - draw a vline
-	{ 
-		draw_line_2x(img, x, y-ry, x, y+ry, color);
-		return;
+	else
+	{
+		for (int i = 0; i < damage_prev_count; i++)
+			add_rect(rects, &count, damage_prev[i]);
+		for (int i = 0; i < damage_cur_count; i++)
+			add_rect(rects, &count, damage_cur[i]);
 	}
-	if (ry==0) // Special case for ry=0 - draw a hline
-	{ 
-		draw_line_2x(img, x-rx, y, x+rx, y, color);
-		return;
+
+	PyObject* list = PyList_New(count);
+	for (int i = 0; i < count; i++)
+	{
+		const damage_rect_t& r = rects[i];
+		PyList_SET_ITEM(list, i, Py_BuildValue("(iiii)", r.x0, r.y0, r.x1 - r.x0, r.y1 - r.y0));
 	}
+	return list;
+}
 
-	// Draw
-	int oh = 0xffff;
-	int oi = 0xffff;
-	int oj = 0xffff;
-	int ok = 0xffff;
+// Pixel views.  image_view wraps the memory of an image in an object that supports the buffer protocol, so that
+// Python can read and write the pixels in place, for instance with memoryview or numpy.asarray.  The view is two
+// dimensional, height by width, with the row stride of the image and an item of 2 or 4 bytes.  It keeps a reference
+// to the image so that the memory stays alive.
+struct pixel_view_t
+{
+	PyObject_HEAD
+	PyObject* owner;
+	void* mem;
+	Py_ssize_t len;
+	Py_ssize_t shape[2];
+	Py_ssize_t strides[2];
+	int itemsize;
+};
 
-	if (rx >= ry) 
+static void pixel_view_dealloc(PyObject* self)
+{
+	Py_XDECREF(((pixel_view_t*)self)->owner);
+	PyObject_Del(self);
+}
+
+static int pixel_view_getbuffer(PyObject* self, Py_buffer* view, int flags)
+{
+	pixel_view_t* v = (pixel_view_t*)self;
+	bool contiguous = v->strides[0] == v->shape[1]*v->itemsize;
+
+	view->buf = v->mem;
+	view->len = v->len;
+	view->readonly = 0;
+	view->suboffsets = NULL;
+	view->internal = NULL;
+	if ((flags & PyBUF_STRIDES) == PyBUF_STRIDES || ((flags & PyBUF_ND) && contiguous))
 	{
-		int ix = 0;
-		int iy = rx * 64;
-		int i, h;
-		do 
+		view->itemsize = v->itemsize;
+		view->format = (flags & PyBUF_FORMAT) ? (char*)(v->itemsize == 2 ? "H" : "I") : NULL;
+		view->ndim = 2;
+		view->shape = v->shape;
+		view->strides = (flags & PyBUF_STRIDES) == PyBUF_STRIDES ? v->strides : NULL;
+	}
+	else if (!(flags & PyBUF_ND))
+	{
+		// Plain bytes, including the padding at the end of the rows.
+		view->itemsize = 1;
+		view->format = (flags & PyBUF_FORMAT) ? (char*)"B" : NULL;
+		view->ndim = 1;
+		view->shape = NULL;
+		view->strides = NULL;
+	}
+	else
+	{
+		PyErr_SetString(PyExc_BufferError, "image rows are padded, the view needs strides");
+		return -1;
+	}
+
+	view->obj = self;
+	Py_INCREF(self);
+	return 0;
+}
+
+static Py_ssize_t pixel_view_getsegcount(PyObject* self, Py_ssize_t* len)
+{
+	if (len)
+		*len = ((pixel_view_t*)self)->len;
+	return 1;
+}
+
+static Py_ssize_t pixel_view_getreadbuffer(PyObject* self, Py_ssize_t segment, void** ptr)
+{
+	if (segment != 0)
+	{
+		PyErr_SetString(PyExc_SystemError, "accessing non-existent pixel view segment");
+		return -1;
+	}
+	*ptr = ((pixel_view_t*)self)->mem;
+	return ((pixel_view_t*)self)->len;
+}
+
+static PyBufferProcs pixel_view_as_buffer;
+static PyTypeObject pixel_view_type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"pongclib.PixelView",
+	sizeof(pixel_view_t),
+};
+
+PyObject* image_view(GdkImage* img, PyObject* owner)
+{
+	if (!pixel_view_type.tp_dealloc)
+	{
+		pixel_view_as_buffer.bf_getreadbuffer = pixel_view_getreadbuffer;
+		pixel_view_as_buffer.bf_getwritebuffer = pixel_view_getreadbuffer;
+		pixel_view_as_buffer.bf_getsegcount = pixel_view_getsegcount;
+		pixel_view_as_buffer.bf_getbuffer = pixel_view_getbuffer;
+		pixel_view_type.tp_dealloc = pixel_view_dealloc;
+		pixel_view_type.tp_as_buffer = &pixel_view_as_buffer;
+		pixel_view_type.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER;
+		pixel_view_type.tp_doc = "Pixels of an image, see pongc.image_view.";
+		if (PyType_Ready(&pixel_view_type) < 0)
+			return NULL;
+	}
+
+	if (img->bpp != 2 && img->bpp != 4)
+	{
+		PyErr_SetString(PyExc_ValueError, "unsupported pixel format");
+		return NULL;
+	}
+
+	pixel_view_t* v = PyObject_New(pixel_view_t, &pixel_view_type);
+	if (!v)
+		return NULL;
+	Py_XINCREF(owner);
+	v->owner = owner;
+	v->mem = img->mem;
+	v->len = img->bpl*img->height;
+	v->itemsize = img->bpp;
+	v->shape[0] = img->height;
+	v->shape[1] = img->width;
+	v->strides[0] = img->bpl;
+	v->strides[1] = img->bpp;
+	return (PyObject*)v;
+}
+
+// Pixel formats.  Everything is drawn in shades of grey, so colors are intensities from 0 to 255, and each primitive
+// looks its pixel up in a table for the pixel size of the image.  set_pixel_format rebuilds the table from the visual
+// of an image, for any channel layout and byte order.  Until then the tables hold 565 and x888 pixels.
+static depth16_t intensity16[256];
+static depth24_t intensity24[256];
+
+static inline guint32 channel_bits(int intensity, int shift, int prec)
+{
+	if (prec <= 0)
+		return 0;
+	guint32 v;
+	if (prec <= 8)
+		v = intensity >> (8 - prec);
+	else
+		v = (intensity*((1 << prec) - 1) + 127)/255;
+	return v << shift;
+}
+
+static void build_intensity_table(int bpp, int red_shift, int red_prec, int green_shift, int green_prec,
+                                  int blue_shift, int blue_prec, bool swap)
+{
+	for (int i = 0; i < 256; i++)
+	{
+		guint32 p = channel_bits(i, red_shift, red_prec) | channel_bits(i, green_shift, green_prec) |
+		            channel_bits(i, blue_shift, blue_prec);
+		if (bpp == 2)
 		{
-			h = (ix + 8) >> 6;
-			i = (iy + 8) >> 6;
-			int j = (h * ry) / rx;
+			if (swap)
+				p = ((p & 0xff) << 8) | ((p >> 8) & 0xff);
+			intensity16[i] = p;
+		}
+		else
+		{
+			if (swap)
+				p = (p << 24) | ((p & 0xff00) << 8) | ((p >> 8) & 0xff00) | (p >> 24);
+			intensity24[i] = p;
+		}
+	}
+}
+
+static struct intensity_init_t
+{
+	intensity_init_t()
+	{
+		build_intensity_table(2, 11, 5, 5, 6, 0, 5, false);
+		build_intensity_table(4, 16, 8, 8, 8, 0, 8, false);
+	}
+} intensity_init;
+
+// Gets the shift and precision of the red, green and blue channels of img.  Images without a visual, like render
+// targets, are 555 for depth 15, 565 for depth 16 and x888 otherwise.  Returns false if a channel is missing.
+static bool get_channels(GdkImage* img, int shift[3], int prec[3])
+{
+	GdkVisual* v = img->visual;
+	if (v)
+	{
+		shift[0] = v->red_shift; prec[0] = v->red_prec;
+		shift[1] = v->green_shift; prec[1] = v->green_prec;
+		shift[2] = v->blue_shift; prec[2] = v->blue_prec;
+	}
+	else if (img->depth == 15)
+	{
+		shift[0] = 10; prec[0] = 5;
+		shift[1] = 5; prec[1] = 5;
+		shift[2] = 0; prec[2] = 5;
+	}
+	else if (img->depth == 16)
+	{
+		shift[0] = 11; prec[0] = 5;
+		shift[1] = 5; prec[1] = 6;
+		shift[2] = 0; prec[2] = 5;
+	}
+	else
+	{
+		shift[0] = 16; prec[0] = 8;
+		shift[1] = 8; prec[1] = 8;
+		shift[2] = 0; prec[2] = 8;
+	}
+	return prec[0] > 0 && prec[1] > 0 && prec[2] > 0;
+}
+
+// Whether the pixels of img are stored in the opposite byte order to the host's.
+static inline bool swapped_bytes(GdkImage* img)
+{
+	return (img->byte_order == GDK_MSB_FIRST) != (G_BYTE_ORDER == G_BIG_ENDIAN);
+}
+
+// Sets up drawing for the pixel format of img, which should be called whenever a new image is created.  Returns 0 if
+// the format isn't supported, which is anything other than 2 or 4 byte pixels of a true or direct color visual.
+int set_pixel_format(GdkImage* img)
+{
+	int shift[3], prec[3];
+	if ((img->bpp != 2 && img->bpp != 4) || !get_channels(img, shift, prec))
+		return 0;
+
+	depth16_t old16[256];
+	depth24_t old24[256];
+	memcpy(old16, intensity16, sizeof(old16));
+	memcpy(old24, intensity24, sizeof(old24));
+
+	build_intensity_table(img->bpp, shift[0], prec[0], shift[1], prec[1], shift[2], prec[2], swapped_bytes(img));
+
+	// Backgrounds drawn with the previous table are no good any more.
+	if (memcmp(old16, intensity16, sizeof(old16)) || memcmp(old24, intensity24, sizeof(old24)))
+		drop_backgrounds();
+	return 1;
+}
+
+inline
+void to_pixel(depth16_t *pixel, int c)
+{
+	*pixel = intensity16[c < 0 ? 0 : c > 255 ? 255 : c];
+}
+
+inline
+void to_pixel(depth24_t *pixel, int c)
+{
+	*pixel = intensity24[c < 0 ? 0 : c > 255 ? 255 : c];
+}
+
+// Render targets.  A render target is an image in memory that doesn't need a display.  It holds a GdkImage structure
+// with the same fields as one from GDK, that every function here accepts in place of a real one, but that is not a
+// GObject and must never be passed to GDK.  Its pixels are in host byte order and formatted as described by
+// get_channels, with rows aligned to 16 bytes.
+struct render_target_t
+{
+	PyObject_HEAD
+	GdkImage image;
+};
+
+const int RENDER_TARGET_ALIGN = 64;
+const int RENDER_TARGET_ROW_ALIGN = 16;
+
+static void render_target_dealloc(PyObject* self)
+{
+	free(((render_target_t*)self)->image.mem);
+	PyObject_Del(self);
+}
+
+static PyMemberDef render_target_members[] = {
+	{ (char*)"width", T_INT, offsetof(render_target_t, image.width), READONLY, NULL },
+	{ (char*)"height", T_INT, offsetof(render_target_t, image.height), READONLY, NULL },
+	{ (char*)"depth", T_USHORT, offsetof(render_target_t, image.depth), READONLY, NULL },
+	{ (char*)"bpp", T_USHORT, offsetof(render_target_t, image.bpp), READONLY, NULL },
+	{ (char*)"bpl", T_USHORT, offsetof(render_target_t, image.bpl), READONLY, NULL },
+	{ NULL }
+};
+
+static PyTypeObject render_target_type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"pongclib.RenderTarget",
+	sizeof(render_target_t),
+};
+
+static bool render_target_ready()
+{
+	if (!render_target_type.tp_dealloc)
+	{
+		render_target_type.tp_dealloc = render_target_dealloc;
+		render_target_type.tp_members = render_target_members;
+		render_target_type.tp_flags = Py_TPFLAGS_DEFAULT;
+		render_target_type.tp_doc = "Image in memory that pongc can draw to, see pongc.create_render_target.";
+		if (PyType_Ready(&render_target_type) < 0)
+		{
+			render_target_type.tp_dealloc = NULL;
+			return false;
+		}
+	}
+	return true;
+}
+
+// Creates a cleared render target.  Depth is 15 or 16 for 2 byte pixels, 24 or 32 for 4 byte ones.
+PyObject* create_render_target(int width, int height, int depth)
+{
+	if (!render_target_ready())
+		return NULL;
+	if (width <= 0 || height <= 0 || (depth != 15 && depth != 16 && depth != 24 && depth != 32))
+	{
+		PyErr_SetString(PyExc_ValueError, "bad render target size or depth");
+		return NULL;
+	}
+
+	int bpp = depth <= 16 ? 2 : 4;
+	int bpl = (width*bpp + RENDER_TARGET_ROW_ALIGN - 1) & ~(RENDER_TARGET_ROW_ALIGN - 1);
+	if (bpl > 0xffff)
+	{
+		PyErr_SetString(PyExc_ValueError, "render target too wide");
+		return NULL;
+	}
+
+	void* mem = NULL;
+	if (posix_memalign(&mem, RENDER_TARGET_ALIGN, size_t(bpl)*height) != 0)
+		return PyErr_NoMemory();
+	memset(mem, 0, size_t(bpl)*height);
+
+	render_target_t* t = PyObject_New(render_target_t, &render_target_type);
+	if (!t)
+	{
+		free(mem);
+		return NULL;
+	}
+	memset(&t->image, 0, sizeof(t->image));
+	t->image.type = GDK_IMAGE_NORMAL;
+	t->image.visual = NULL;
+	t->image.byte_order = G_BYTE_ORDER == G_BIG_ENDIAN ? GDK_MSB_FIRST : GDK_LSB_FIRST;
+	t->image.width = width;
+	t->image.height = height;
+	t->image.depth = depth;
+	t->image.bpp = bpp;
+	t->image.bpl = bpl;
+	t->image.bits_per_pixel = bpp*8;
+	t->image.mem = mem;
+	return (PyObject*)t;
+}
+
+GdkImage* render_target_image(PyObject* obj)
+{
+	if (!render_target_type.tp_dealloc || !PyObject_TypeCheck(obj, &render_target_type))
+		return NULL;
+	return &((render_target_t*)obj)->image;
+}
+
+// Converts a row of pixels of img to 8 bit RGB.
+static void row_to_rgb(GdkImage* img, int y, const int shift[3], const int prec[3], guint8* rgb)
+{
+	const guint8* row = (const guint8*)img->mem + img->bpl*y;
+	bool swap = swapped_bytes(img);
+	for (int x = 0; x < img->width; x++)
+	{
+		guint32 p;
+		if (img->bpp == 2)
+		{
+			p = ((const guint16*)row)[x];
+			if (swap)
+				p = ((p & 0xff) << 8) | (p >> 8);
+		}
+		else
+		{
+			p = ((const guint32*)row)[x];
+			if (swap)
+				p = (p << 24) | ((p & 0xff00) << 8) | ((p >> 8) & 0xff00) | (p >> 24);
+		}
+		for (int c = 0; c < 3; c++)
+		{
+			guint32 max = (1u << prec[c]) - 1;
+			guint32 v = (p >> shift[c]) & max;
+			*rgb++ = prec[c] >= 8 ? v >> (prec[c] - 8) : (v*255 + max/2)/max;
+		}
+	}
+}
+
+static void put_be32(guint8* p, guint32 v)
+{
+	p[0] = v >> 24;
+	p[1] = v >> 16;
+	p[2] = v >> 8;
+	p[3] = v;
+}
+
+static bool write_png_chunk(FILE* f, const char* type, const guint8* data, guint32 len)
+{
+	guint8 header[8];
+	put_be32(header, len);
+	memcpy(header + 4, type, 4);
+	// crc32 resets to its initial value when given no data, so the type is the whole of an empty chunk's sum.
+	uLong sum = crc32(crc32(0, NULL, 0), header + 4, 4);
+	if (len)
+		sum = crc32(sum, data, len);
+	guint8 crc[4];
+	put_be32(crc, sum);
+	return fwrite(header, 8, 1, f) == 1 && (len == 0 || fwrite(data, len, 1, f) == 1) && fwrite(crc, 4, 1, f) == 1;
+}
+
+// Writes the RGB rows of an image as a PNG file.
+static bool write_png(FILE* f, int width, int height, const guint8* rgb)
+{
+	// Each row starts with its filter type, which is always none.
+	size_t rowbytes = size_t(width)*3;
+	size_t rawsize = (rowbytes + 1)*height;
+	guint8* raw = new guint8[rawsize];
+	for (int y = 0; y < height; y++)
+	{
+		raw[(rowbytes + 1)*y] = 0;
+		memcpy(raw + (rowbytes + 1)*y + 1, rgb + rowbytes*y, rowbytes);
+	}
+
+	uLongf zsize = compressBound(rawsize);
+	guint8* z = new guint8[zsize];
+	bool ok = compress2(z, &zsize, raw, rawsize, Z_DEFAULT_COMPRESSION) == Z_OK;
+	delete[] raw;
+
+	static const guint8 signature[8] = { 0x89, 'P', 'N', 'G', '\r', '\n', 0x1a, '\n' };
+	guint8 ihdr[13];
+	put_be32(ihdr, width);
+	put_be32(ihdr + 4, height);
+	ihdr[8] = 8;  // Bit depth
+	ihdr[9] = 2;  // Color type, RGB
+	ihdr[10] = 0; // Compression
+	ihdr[11] = 0; // Filter
+	ihdr[12] = 0; // Interlace
+
+	ok = ok && fwrite(signature, 8, 1, f) == 1;
+	ok = ok && write_png_chunk(f, "IHDR", ihdr, 13);
+	ok = ok && write_png_chunk(f, "IDAT", z, zsize);
+	ok = ok && write_png_chunk(f, "IEND", NULL, 0);
+	delete[] z;
+	return ok;
+}
+
+// Writes an image, or a render target, to a file.  The file is a PNG if the name ends in .png, and a binary PPM
+// otherwise.
+PyObject* write_image(GdkImage* img, const char* filename)
+{
+	int shift[3], prec[3];
+	if ((img->bpp != 2 && img->bpp != 4) || !get_channels(img, shift, prec))
+	{
+		PyErr_SetString(PyExc_ValueError, "unsupported pixel format");
+		return NULL;
+	}
+
+	FILE* f = fopen(filename, "wb");
+	if (!f)
+		return PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)filename);
+
+	guint8* rgb = new guint8[size_t(img->width)*img->height*3];
+	for (int y = 0; y < img->height; y++)
+		row_to_rgb(img, y, shift, prec, rgb + size_t(img->width)*y*3);
+
+	size_t len = strlen(filename);
+	bool ok;
+	if (len >= 4 && strcasecmp(filename + len - 4, ".png") == 0)
+		ok = write_png(f, img->width, img->height, rgb);
+	else
+		ok = fprintf(f, "P6\n%d %d\n255\n", img->width, img->height) > 0 &&
+		     fwrite(rgb, size_t(img->width)*img->height*3, 1, f) == 1;
+	delete[] rgb;
+
+	if (fclose(f) != 0)
+		ok = false;
+	if (!ok)
+		return PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)filename);
+	Py_RETURN_NONE;
+}
+
+// Rasterizer core.  Each primitive is clipped against the image once, up front, and then written with unchecked
+// spans and points.  Points are enlarged to blocks of pixel_block by pixel_block pixels, and the last logical row and
+// column of the image are never drawn to.  The rows are narrowed further to the band of the current thread, which is
+// exact: a primitive sets the same pixels within a band as it does there when drawn into the whole image.
+template <typename pixel_t>
+struct target_2x
+{
+	pixel_t* pixels;
+	int pitch;
+	int scale;
+	int xmax, ymin, ymax; // Inclusive, in 2x pixels.
+
+	target_2x(GdkImage* img)
+		: pixels((pixel_t*)img->mem), pitch(img->bpl/sizeof(pixel_t)), scale(pixel_block),
+		  xmax(img->width/pixel_block-2), ymin(band_ymin),
+		  ymax(img->height/pixel_block-2 < band_ymax ? img->height/pixel_block-2 : band_ymax)
+	{
+	}
+
+	bool inside(int x, int y) const
+	{
+		return x >= 0 && y >= ymin && x <= xmax && y <= ymax;
+	}
+
+	// Unchecked point.
+	void point(int x, int y, pixel_t pix) const
+	{
+		pixel_t* p = pixels + (pitch*y + x)*scale;
+		switch (scale)
+		{
+		case 1:
+			p[0] = pix;
+			break;
+		case 2:
+			p[0] = pix;
+			p[1] = pix;
+			p[pitch] = pix;
+			p[pitch+1] = pix;
+			break;
+		default:
+			for (int i = 0; i < scale; i++, p += pitch)
+				for (int j = 0; j < scale; j++)
+					p[j] = pix;
+			break;
+		}
+	}
+
+	// Unchecked horizontal span from xa to xb inclusive, xa <= xb.  The upper row is filled and then copied to the ones
+	// below it.
+	void span(int xa, int xb, int y, pixel_t pix) const
+	{
+		pixel_t* row = pixels + (pitch*y + xa)*scale;
+		size_t bytes = (xb - xa + 1)*scale*sizeof(pixel_t);
+		kernels->fill(row, to_pattern(pix), bytes);
+		for (int i = 1; i < scale; i++)
+			kernels->copy(row + pitch*i, row, bytes);
+	}
+
+	// Horizontal span between xa and xb inclusive, in either order, clipped to the image.
+	void clipped_span(int xa, int xb, int y, pixel_t pix) const
+	{
+		if (y < ymin || y > ymax)
+			return;
+		if (xa > xb)
+		{
+			int t = xa; xa = xb; xb = t;
+		}
+		if (xa < 0)
+			xa = 0;
+		if (xb > xmax)
+			xb = xmax;
+		if (xa <= xb)
+			span(xa, xb, y, pix);
+	}
+};
+
+template <typename pixel_t> inline
+void _draw_point_2x(GdkImage* img, int x, int y, uint16_t c)
+{
+	target_2x<pixel_t> t(img);
+	if (!t.inside(x, y))
+		return;
+
+	pixel_t pix;
+	to_pixel(&pix, c);
+	t.point(x, y, pix);
+}
+
+void draw_point_2x(GdkImage* img, int x, int y, uint16_t c)
+{
+    if (img->bpp == 2)
+        _draw_point_2x<depth16_t>(img, x, y, c);
+    else
+        _draw_point_2x<depth24_t>(img, x, y, c);
+}
+
+// The lines below step along their major axis one pixel at a time, and along the minor axis by adj/65536 of a pixel
+// per step, so the minor offset at step i is (i*adj)>>16.  A zero adj steps a whole pixel every time.  Narrows the
+// steps [ia, ib] to those whose minor offset lies within [lo, hi].
+static inline void clip_steps(gint64 adj, int lo, int hi, int* ia, int* ib)
+{
+	if (lo > 0)
+	{
+		gint64 first = (gint64(lo)*65536 + adj - 1)/adj;
+		if (first > *ia)
+			*ia = first > *ib ? *ib + 1 : int(first);
+	}
+	if (hi < 0)
+	{
+		*ib = *ia - 1;
+		return;
+	}
+	gint64 last = ((gint64(hi) + 1)*65536 - 1)/adj;
+	if (last < *ib)
+		*ib = int(last);
+}
+
+template <typename pixel_t>
+static void raster_line_2x(GdkImage* img, int x0, int y0, int x1, int y1, int color)
+{
+	target_2x<pixel_t> t(img);
+	pixel_t pix;
+	to_pixel(&pix, color);
+
+	// Make sure the line runs top to bottom.
+	if (y0 > y1) 
+	{
+		int ty = y0; y0 = y1; y1 = ty;
+		int tx = x0; x0 = x1; x1 = tx;
+	}
+
+	// Reject lines that are entirely outside the image.
+	if (y1 < t.ymin || y0 > t.ymax || (x0 < 0 && x1 < 0) || (x0 > t.xmax && x1 > t.xmax))
+		return;
+
+	// Draw the initial pixel, which is always exactly intersected by the line and so needs no weighting.
+	if (t.inside(x0, y0))
+		t.point(x0, y0, pix);
+	
+	int dx = x1 - x0;
+	int xdir;
+	if (dx >= 0)
+		xdir = 1;
+	else 
+	{
+		xdir = -1;
+		dx = -dx; // make dx positive.
+	}
+	
+	int dy = y1 - y0;
+	if (dy == 0) // Horizontal line
+	{
+		if (dx != 0)
+			t.clipped_span(x0 + xdir, x1, y0, pix);
+	}
+	else if (dx == 0) // Vertical line
+	{
+		if (x0 < 0 || x0 > t.xmax)
+			return;
+		int ya = y0 + 1 < t.ymin ? t.ymin : y0 + 1;
+		int yb = y1 > t.ymax ? t.ymax : y1;
+		for (int y = ya; y <= yb; y++)
+			t.point(x0, y, pix);
+	}
+	else if (dx == dy) // Diagonal line
+	{
+		// Steps 1 to dy, clipped in y and then in x.
+		int ia = t.ymin - y0 > 1 ? t.ymin - y0 : 1;
+		int ib = t.ymax - y0 < dy ? t.ymax - y0 : dy;
+		int xa = xdir > 0 ? -x0 : x0 - t.xmax;
+		int xb = xdir > 0 ? t.xmax - x0 : x0;
+		if (xa > ia) ia = xa;
+		if (xb < ib) ib = xb;
+		for (int i = ia; i <= ib; i++)
+			t.point(x0 + xdir*i, y0 + i, pix);
+	}
+	else // Line is not horizontal, diagonal, or vertical.
+	{
+		// The pixels other than the first and last are steps 1 to n-1 along the major axis.  For every step, the 16 bit
+		// error accumulator of the line adds adj and advances the minor axis when it wraps around.
+		if (dy > dx) 
+		{
+			// Y-major line; the fractional part of a pixel that X advances each time Y advances 1 pixel, truncated so that
+			// we won't overrun the endpoint along the X axis.
+			gint64 adj = (guint16)(((unsigned long) dx << 16) / (unsigned long) dy);
+			if (adj == 0)
+				adj = 65536;
+
+			int ia = t.ymin - y0 > 1 ? t.ymin - y0 : 1;
+			int ib = t.ymax - y0 < dy - 1 ? t.ymax - y0 : dy - 1;
+			if (xdir > 0)
+				clip_steps(adj, -x0, t.xmax - x0, &ia, &ib);
+			else
+				clip_steps(adj, x0 - t.xmax, x0, &ia, &ib);
+
+			if (ia <= ib)
+			{
+				gint64 acc = ia*adj;
+				int x = x0 + xdir*int(acc >> 16);
+				int err = int(acc & 0xffff);
+				for (int y = y0 + ia; y <= y0 + ib; y++)
+				{
+					t.point(x, y, pix);
+					err += adj;
+					if (err >= 65536)
+					{
+						err -= 65536;
+						x += xdir;
+					}
+				}
+			}
+		}
+		else
+		{
+			// X-major line; the fractional part of a pixel that Y advances each time X advances 1 pixel.
+			gint64 adj = (guint16)(((unsigned long) dy << 16) / (unsigned long) dx);
+			if (adj == 0)
+				adj = 65536;
+
+			int ia = 1;
+			int ib = dx - 1;
+			if (xdir > 0)
+			{
+				if (-x0 > ia) ia = -x0;
+				if (t.xmax - x0 < ib) ib = t.xmax - x0;
+			}
+			else
+			{
+				if (x0 - t.xmax > ia) ia = x0 - t.xmax;
+				if (x0 < ib) ib = x0;
+			}
+			clip_steps(adj, t.ymin - y0, t.ymax - y0, &ia, &ib);
+
+			if (ia <= ib)
+			{
+				gint64 acc = ia*adj;
+				int y = y0 + int(acc >> 16);
+				int err = int(acc & 0xffff);
+				for (int i = ia; i <= ib; i++)
+				{
+					t.point(x0 + xdir*i, y, pix);
+					err += adj;
+					if (err >= 65536)
+					{
+						err -= 65536;
+						y++;
+					}
+				}
+			}
+		}
+
+		// Draw the final pixel, which is always exactly intersected by the line and so needs no weighting
+		if (t.inside(x1, y1))
+			t.point(x1, y1, pix);
+	}
+}
+
+// Ellipses are traced into a sink, which is given the points of an outline with point(x, y) and the rows of a filled
+// ellipse with span(xa, xb, y).  The sinks below draw them, and the shape cache records them.
+template <typename pixel_t, bool clip>
+struct point_plotter_2x
+{
+	const target_2x<pixel_t>& t;
+	pixel_t pix;
+
+	point_plotter_2x(const target_2x<pixel_t>& t, pixel_t pix) : t(t), pix(pix) {}
+
+	void point(int x, int y) const
+	{
+		if (!clip || t.inside(x, y))
+			t.point(x, y, pix);
+	}
+};
+
+template <typename pixel_t>
+struct span_plotter_2x
+{
+	const target_2x<pixel_t>& t;
+	pixel_t pix;
+
+	span_plotter_2x(const target_2x<pixel_t>& t, pixel_t pix) : t(t), pix(pix) {}
+
+	void span(int xa, int xb, int y) const
+	{
+		t.clipped_span(xa, xb, y, pix);
+	}
+};
+
+template <typename sink_t>
+static void trace_ellipse_2x(sink_t& s, int x, int y, int rx, int ry)
+{
+	int oh = 0xffff;
+	int oi = 0xffff;
+	int oj = 0xffff;
+	int ok = 0xffff;
+
+	if (rx >= ry) 
+	{
+		int ix = 0;
+		int iy = rx * 64;
+		int i, h;
+		do 
+		{
+			h = (ix + 8) >> 6;
+			i = (iy + 8) >> 6;
+			int j = (h * ry) / rx;
 			int k = (i * ry) / rx;
 			if (((ok != k) && (oj != k)) || ((oj != j) && (ok != j)) || (k != j)) 
 			{
@@ -237,11 +1314,11 @@ void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
 					int ymk=y-k;
 					if (h > 0) 
 					{
-						draw_point_2x(img, xmh, ypk, color);
-						draw_point_2x(img, xmh, ymk, color);
+						s.point(xmh, ypk);
+						s.point(xmh, ymk);
 					}
-					draw_point_2x(img, xph, ypk, color);
-					draw_point_2x(img, xph, ymk, color);
+					s.point(xph, ypk);
+					s.point(xph, ymk);
 				}
 				ok = k;
 				int xpi = x+i-1;
@@ -250,11 +1327,94 @@ void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
 				{
 					int ypj = y+j-1;
 					int ymj = y-j;
-					draw_point_2x(img, xmi, ypj, color);
-					draw_point_2x(img, xpi, ypj, color);
-					draw_point_2x(img, xmi, ymj, color);
-					draw_point_2x(img, xpi, ymj, color);
+					s.point(xmi, ypj);
+					s.point(xpi, ypj);
+					s.point(xmi, ymj);
+					s.point(xpi, ymj);
+				}
+				oj = j;
+			}
+			ix = ix + iy / rx;
+			iy = iy - ix / rx;
+		} while (i > h);
+	} 
+	else 
+	{
+		int ix = 0;
+		int iy = ry * 64;
+		int i, h;
+		do 
+		{
+			h = (ix + 8) >> 6;
+			i = (iy + 8) >> 6;
+			int j = (h * rx) / ry;
+			int k = (i * rx) / ry;
+			if (((oi != i) && (oh != i)) || ((oh != h) && (oi != h) && (i != h))) 
+			{
+				int xmj = x-j;
+				int xpj = x+j-1;
+				if (i > 0) 
+				{
+					int ypi = y+i-1;
+					int ymi = y-i;
+					if (j > 0) 
+					{
+						s.point(xmj, ypi);
+						s.point(xmj, ymi);
+					}
+					s.point(xpj, ypi);
+					s.point(xpj, ymi);
+				}
+				oi = i;
+				int xmk = x-k;
+				int xpk = x+k-1;
+				if (h > 0) 
+				{
+					int yph = y+h-1;
+					int ymh = y-h;
+					s.point(xmk, yph);
+					s.point(xpk, yph);
+					s.point(xmk, ymh);
+					s.point(xpk, ymh);
 				}
+				oh = h;
+			}
+			ix = ix + iy / ry;
+			iy = iy - ix / ry;
+		} while (i > h);
+	}
+}
+
+// Traces a filled ellipse, one span per row.  A span may be given with xa == xb + 1, and covers both pixels.
+template <typename sink_t>
+static void trace_fill_ellipse_2x(sink_t& s, int x, int y, int rx, int ry)
+{
+	int oh = 0xffff;
+	int oi = 0xffff;
+	int oj = 0xffff;
+	int ok = 0xffff;
+
+	if (rx >= ry) 
+	{
+		int ix = 0;
+		int iy = rx * 64;
+		int i, h;
+		do 
+		{
+			h = (ix + 8) >> 6;
+			i = (iy + 8) >> 6;
+			int j = (h * ry) / rx;
+			int k = (i * ry) / rx;
+			if ((ok != k) && (oj != k) && (k < ry)) 
+			{
+				s.span(x-h, x+h-1, y-k-1);
+				s.span(x-h, x+h-1, y+k);
+				ok = k;
+			}
+			if ((oj != j) && (ok != j) && (k != j))  
+			{
+				s.span(x-i, x+i-1, y+j);
+				s.span(x-i, x+i-1, y-j-1);
 				oj = j;
 			}
 			ix = ix + iy / rx;
@@ -263,129 +1423,736 @@ void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
 	} 
 	else 
 	{
-		int ix = 0;
-		int iy = ry * 64;
-		int i, h;
-		do 
+		int ix = 0;
+		int iy = ry * 64;
+		int i, h;
+		do 
+		{
+			h = (ix + 8) >> 6;
+			i = (iy + 8) >> 6;
+			int j = (h * rx) / ry;
+			int k = (i * rx) / ry;
+			if ((oi != i) && (oh != i) && (i < ry)) 
+			{
+				s.span(x-j, x+j-1, y+i);
+				s.span(x-j, x+j-1, y-i-1);
+				oi = i;
+			}
+			if ((oh != h) && (oi != h) && (i != h)) 
+			{
+				s.span(x-k, x+k-1, y+h);
+				s.span(x-k, x+k-1, y-h-1);
+				oh = h;
+			}
+			ix = ix + iy / ry;
+			iy = iy - ix / ry;
+		} while (i > h);
+	}
+}
+
+// Ellipse shape cache.  The ball and its shadow are drawn at the same few radii frame after frame, so the points of
+// an outline and the spans of a filled ellipse are traced once for each pair of radii, as offsets from the centre,
+// and kept in a small least recently used cache.  Drawing a cached ellipse just stamps the points or spans, giving
+// the same pixels as tracing it.  Every thread drawing ellipses has a cache of its own, see render_list, and the
+// statistics are shared by all of them.
+struct ellipse_point_t
+{
+	short dx, dy;
+};
+
+struct ellipse_span_t
+{
+	short dxa, dxb, dy; // dxa <= dxb
+};
+
+struct ellipse_shape_t
+{
+	int rx, ry; // 0 for an empty entry
+	guint64 last_used;
+	int point_count;
+	ellipse_point_t* points; // NULL until the outline is first drawn
+	int span_count;
+	ellipse_span_t* spans; // NULL until the filled ellipse is first drawn
+	int dx0, dy0, dx1, dy1; // Bounds of the points and spans traced so far, inclusive.
+};
+
+const int ELLIPSE_CACHE_SIZE = 16;
+
+// Larger ellipses are mostly the growing rings of the score animation, which never repeat and are traced directly.
+const int MAX_CACHED_RADIUS = 64;
+
+static __thread ellipse_shape_t ellipse_cache[ELLIPSE_CACHE_SIZE];
+static __thread guint64 ellipse_clock = 0;
+
+static long ellipse_cache_hits = 0;
+static long ellipse_cache_misses = 0;
+static long ellipse_cache_entries = 0;
+static long ellipse_cache_bytes = 0;
+
+// Counts the points and spans of a trace, so they can be recorded into arrays of the right size.
+struct shape_counter_t
+{
+	int count;
+
+	shape_counter_t() : count(0) {}
+
+	void point(int, int) { count++; }
+	void span(int, int, int) { count++; }
+};
+
+// Records a trace about (0, 0) into a shape.
+struct shape_recorder_t
+{
+	ellipse_shape_t& e;
+
+	shape_recorder_t(ellipse_shape_t& e) : e(e) {}
+
+	void bound(int dx0, int dx1, int dy)
+	{
+		if (dx0 < e.dx0) e.dx0 = dx0;
+		if (dx1 > e.dx1) e.dx1 = dx1;
+		if (dy < e.dy0) e.dy0 = dy;
+		if (dy > e.dy1) e.dy1 = dy;
+	}
+
+	void point(int dx, int dy)
+	{
+		ellipse_point_t& p = e.points[e.point_count++];
+		p.dx = dx;
+		p.dy = dy;
+		bound(dx, dx, dy);
+	}
+
+	void span(int dxa, int dxb, int dy)
+	{
+		if (dxa > dxb)
+		{
+			int t = dxa; dxa = dxb; dxb = t;
+		}
+		ellipse_span_t& p = e.spans[e.span_count++];
+		p.dxa = dxa;
+		p.dxb = dxb;
+		p.dy = dy;
+		bound(dxa, dxb, dy);
+	}
+};
+
+static void free_ellipse_shape(ellipse_shape_t& e)
+{
+	if (e.rx == 0)
+		return;
+	long bytes = e.point_count*sizeof(ellipse_point_t) + e.span_count*sizeof(ellipse_span_t);
+	__sync_fetch_and_sub(&ellipse_cache_bytes, bytes);
+	__sync_fetch_and_sub(&ellipse_cache_entries, 1);
+	free(e.points);
+	free(e.spans);
+	e.rx = e.ry = 0;
+	e.points = NULL;
+	e.spans = NULL;
+	e.point_count = e.span_count = 0;
+}
+
+// Frees the shapes cached by the calling thread.
+static void drop_ellipse_shapes()
+{
+	for (int i = 0; i < ELLIPSE_CACHE_SIZE; i++)
+		free_ellipse_shape(ellipse_cache[i]);
+}
+
+// Returns the cached shape of an ellipse with radii rx and ry, both from 1 to MAX_CACHED_RADIUS, with its outline
+// traced if outline is set and its spans traced otherwise.  Returns NULL if memory runs out.
+static const ellipse_shape_t* get_ellipse_shape(int rx, int ry, bool outline)
+{
+	ellipse_shape_t* e = NULL;
+	ellipse_shape_t* oldest = &ellipse_cache[0];
+	for (int i = 0; i < ELLIPSE_CACHE_SIZE && !e; i++)
+	{
+		ellipse_shape_t& c = ellipse_cache[i];
+		if (c.rx == rx && c.ry == ry)
+			e = &c;
+		else if (c.last_used < oldest->last_used)
+			oldest = &c;
+	}
+	if (!e)
+	{
+		e = oldest;
+		free_ellipse_shape(*e);
+		e->rx = rx;
+		e->ry = ry;
+		e->dx0 = e->dy0 = G_MAXINT;
+		e->dx1 = e->dy1 = G_MININT;
+		__sync_fetch_and_add(&ellipse_cache_entries, 1);
+	}
+	e->last_used = ++ellipse_clock;
+
+	if (outline ? e->points != NULL : e->spans != NULL)
+	{
+		__sync_fetch_and_add(&ellipse_cache_hits, 1);
+		return e;
+	}
+	__sync_fetch_and_add(&ellipse_cache_misses, 1);
+
+	shape_counter_t counter;
+	shape_recorder_t recorder(*e);
+	long bytes;
+	if (outline)
+	{
+		trace_ellipse_2x(counter, 0, 0, rx, ry);
+		e->points = (ellipse_point_t*)malloc(counter.count*sizeof(ellipse_point_t));
+		if (!e->points)
+			return NULL;
+		trace_ellipse_2x(recorder, 0, 0, rx, ry);
+		bytes = e->point_count*sizeof(ellipse_point_t);
+	}
+	else
+	{
+		trace_fill_ellipse_2x(counter, 0, 0, rx, ry);
+		e->spans = (ellipse_span_t*)malloc(counter.count*sizeof(ellipse_span_t));
+		if (!e->spans)
+			return NULL;
+		trace_fill_ellipse_2x(recorder, 0, 0, rx, ry);
+		bytes = e->span_count*sizeof(ellipse_span_t);
+	}
+	__sync_fetch_and_add(&ellipse_cache_bytes, bytes);
+	return e;
+}
+
+// Returns the statistics of the ellipse shape caches as a dict: the hits and misses since the last
+// reset_ellipse_cache_stats, the hit rate, and the shapes held and the bytes of their points and spans.  All of them
+// add up every thread that draws, the calling thread and the render_list workers, whose caches are dropped when they
+// have no band to draw.
+PyObject* get_ellipse_cache_stats()
+{
+	long hits = __sync_fetch_and_add(&ellipse_cache_hits, 0);
+	long misses = __sync_fetch_and_add(&ellipse_cache_misses, 0);
+	return Py_BuildValue("{s:l,s:l,s:d,s:l,s:l}", "hits", hits, "misses", misses,
+		"hit_rate", hits + misses ? double(hits)/(hits + misses) : 0.0,
+		"entries", __sync_fetch_and_add(&ellipse_cache_entries, 0),
+		"bytes", __sync_fetch_and_add(&ellipse_cache_bytes, 0));
+}
+
+void reset_ellipse_cache_stats()
+{
+	__sync_lock_test_and_set(&ellipse_cache_hits, 0);
+	__sync_lock_test_and_set(&ellipse_cache_misses, 0);
+}
+
+// Draws the cached outline or spans of an ellipse centred on (x, y), skipping the clipping if all of it is inside.
+template <typename pixel_t>
+static void stamp_ellipse_2x(const target_2x<pixel_t>& t, const ellipse_shape_t& e, int x, int y, pixel_t pix)
+{
+	bool inside = x+e.dx0 >= 0 && y+e.dy0 >= t.ymin && x+e.dx1 <= t.xmax && y+e.dy1 <= t.ymax;
+	const ellipse_point_t* points_end = e.points + e.point_count;
+	for (const ellipse_point_t* p = e.points; p < points_end; p++)
+		if (inside || t.inside(x+p->dx, y+p->dy))
+			t.point(x+p->dx, y+p->dy, pix);
+}
+
+template <typename pixel_t>
+static void stamp_fill_ellipse_2x(const target_2x<pixel_t>& t, const ellipse_shape_t& e, int x, int y, pixel_t pix)
+{
+	bool inside = x+e.dx0 >= 0 && y+e.dy0 >= t.ymin && x+e.dx1 <= t.xmax && y+e.dy1 <= t.ymax;
+	const ellipse_span_t* spans_end = e.spans + e.span_count;
+	for (const ellipse_span_t* s = e.spans; s < spans_end; s++)
+	{
+		if (inside)
+			t.span(x+s->dxa, x+s->dxb, y+s->dy, pix);
+		else
+			t.clipped_span(x+s->dxa, x+s->dxb, y+s->dy, pix);
+	}
+}
+
+static bool cacheable_ellipse(int rx, int ry)
+{
+	return rx > 0 && ry > 0 && rx <= MAX_CACHED_RADIUS && ry <= MAX_CACHED_RADIUS;
+}
+
+template <typename pixel_t>
+static void raster_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	if (rx==0 && ry==0) // Special case - draw a single pixel 
+	{  
+		_draw_point_2x<pixel_t>(img, x, y, color);
+		return;
+	}
+	if (rx==0)  // Special case for rx=0 - draw a vline
+	{ 
+		raster_line_2x<pixel_t>(img, x, y-ry, x, y+ry, color);
+		return;
+	}
+	if (ry==0) // Special case for ry=0 - draw a hline
+	{ 
+		raster_line_2x<pixel_t>(img, x-rx, y, x+rx, y, color);
+		return;
+	}
+
+	target_2x<pixel_t> t(img);
+	pixel_t pix;
+	to_pixel(&pix, color);
+
+	// Negative radii trace the same extent as positive ones.
+	int ax = abs(rx);
+	int ay = abs(ry);
+	if (x+ax < 0 || y+ay < t.ymin || x-ax-1 > t.xmax || y-ay-1 > t.ymax)
+		return;
+	const ellipse_shape_t* e = cacheable_ellipse(rx, ry) ? get_ellipse_shape(rx, ry, true) : NULL;
+	if (e)
+	{
+		stamp_ellipse_2x(t, *e, x, y, pix);
+		return;
+	}
+
+	// Ellipses that are entirely inside the image are drawn without checking every point.
+	if (x-ax-1 >= 0 && y-ay-1 >= t.ymin && x+ax <= t.xmax && y+ay <= t.ymax)
+	{
+		point_plotter_2x<pixel_t, false> plotter(t, pix);
+		trace_ellipse_2x(plotter, x, y, rx, ry);
+	}
+	else
+	{
+		point_plotter_2x<pixel_t, true> plotter(t, pix);
+		trace_ellipse_2x(plotter, x, y, rx, ry);
+	}
+}
+
+template <typename pixel_t>
+static void raster_fill_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	if (rx==0 && ry==0) // Special case - draw a single pixel 
+	{  
+		_draw_point_2x<pixel_t>(img, x, y, color);
+		return;
+	}
+	if (rx==0)  // Special case for rx=0 - draw a vline
+	{ 
+		raster_line_2x<pixel_t>(img, x, y-ry, x, y+ry, color);
+		return;
+	}
+	if (ry==0) // Special case for ry=0 - draw a hline
+	{ 
+		raster_line_2x<pixel_t>(img, x-rx, y, x+rx, y, color);
+		return;
+	}
+
+	target_2x<pixel_t> t(img);
+	pixel_t pix;
+	to_pixel(&pix, color);
+
+	int ax = abs(rx);
+	int ay = abs(ry);
+	if (x+ax < 0 || y+ay < t.ymin || x-ax-1 > t.xmax || y-ay-1 > t.ymax)
+		return;
+	const ellipse_shape_t* e = cacheable_ellipse(rx, ry) ? get_ellipse_shape(rx, ry, false) : NULL;
+	if (e)
+		stamp_fill_ellipse_2x(t, *e, x, y, pix);
+	else
+	{
+		span_plotter_2x<pixel_t> plotter(t, pix);
+		trace_fill_ellipse_2x(plotter, x, y, rx, ry);
+	}
+}
+
+// 2D primitives.  Each one records its damage and then rasterizes, the public versions just pick the pixel format.
+template <typename pixel_t> inline
+void _draw_line_2x(GdkImage* img, int x0, int y0, int x1, int y1, int color)
+{
+	damage_2x(x0 < x1 ? x0 : x1, y0 < y1 ? y0 : y1, x0 > x1 ? x0 : x1, y0 > y1 ? y0 : y1);
+	raster_line_2x<pixel_t>(img, x0, y0, x1, y1, color);
+}
+
+template <typename pixel_t> inline
+void _draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	damage_2x(x-abs(rx)-1, y-abs(ry)-1, x+abs(rx), y+abs(ry));
+	raster_ellipse_2x<pixel_t>(img, x, y, rx, ry, color);
+}
+
+template <typename pixel_t> inline
+void _fill_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	damage_2x(x-abs(rx)-1, y-abs(ry)-1, x+abs(rx), y+abs(ry));
+	raster_fill_ellipse_2x<pixel_t>(img, x, y, rx, ry, color);
+}
+
+void draw_line_2x(GdkImage* img, int x0, int y0, int x1, int y1, int color)
+{
+	if (img->bpp == 2)
+		_draw_line_2x<depth16_t>(img, x0, y0, x1, y1, color);
+	else
+		_draw_line_2x<depth24_t>(img, x0, y0, x1, y1, color);
+}
+
+void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	if (img->bpp == 2)
+		_draw_ellipse_2x<depth16_t>(img, x, y, rx, ry, color);
+	else
+		_draw_ellipse_2x<depth24_t>(img, x, y, rx, ry, color);
+}
+
+void fill_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+{
+	if (img->bpp == 2)
+		_fill_ellipse_2x<depth16_t>(img, x, y, rx, ry, color);
+	else
+		_fill_ellipse_2x<depth24_t>(img, x, y, rx, ry, color);
+}
+
+// Text.  Glyphs of the bitmap font in font.h are scaled to each text size once, and kept in a small cache of atlases
+// as runs of pixels, row by row, which draw_text_2x fills as spans.  The font is first enlarged four times with two
+// passes of Scale2x, which rounds off its diagonals, and the atlas glyphs are sampled from that.
+const int FONT_MASTER_SCALE = 4;
+const int FONT_MASTER_WIDTH = FONT_WIDTH*FONT_MASTER_SCALE;
+const int FONT_MASTER_HEIGHT = FONT_HEIGHT*FONT_MASTER_SCALE;
+
+static bool font_master[FONT_COUNT][FONT_MASTER_HEIGHT][FONT_MASTER_WIDTH];
+static bool font_master_built = false;
+
+static void scale2x(const bool* src, int w, int h, bool* dst)
+{
+	for (int y = 0; y < h; y++)
+	{
+		for (int x = 0; x < w; x++)
+		{
+			bool p = src[y*w+x];
+			bool a = y > 0 ? src[(y-1)*w+x] : false;
+			bool b = x < w-1 ? src[y*w+x+1] : false;
+			bool c = x > 0 ? src[y*w+x-1] : false;
+			bool d = y < h-1 ? src[(y+1)*w+x] : false;
+			bool* e = dst + y*2*w*2 + x*2;
+			e[0] = (c == a && c != d && a != b) ? a : p;
+			e[1] = (a == b && a != c && b != d) ? b : p;
+			e[w*2] = (d == c && d != b && c != a) ? c : p;
+			e[w*2+1] = (b == d && b != a && d != c) ? d : p;
+		}
+	}
+}
+
+static void build_font_master()
+{
+	bool src[FONT_HEIGHT][FONT_WIDTH];
+	bool mid[FONT_HEIGHT*2][FONT_WIDTH*2];
+	for (int i = 0; i < FONT_COUNT; i++)
+	{
+		for (int y = 0; y < FONT_HEIGHT; y++)
+			for (int x = 0; x < FONT_WIDTH; x++)
+				src[y][x] = (font_glyphs[i][y] >> (FONT_WIDTH-1-x)) & 1;
+		scale2x(&src[0][0], FONT_WIDTH, FONT_HEIGHT, &mid[0][0]);
+		scale2x(&mid[0][0], FONT_WIDTH*2, FONT_HEIGHT*2, &font_master[i][0][0]);
+	}
+	font_master_built = true;
+}
+
+struct glyph_run_t
+{
+	short y, x0, x1; // Inclusive, relative to the top left of the glyph cell.
+};
+
+struct text_atlas_t
+{
+	int size;
+	unsigned int last_used;
+
+	// Glyph size, advance from one glyph to the next, and height of the capitals, in 2x pixels.
+	int width, height, advance, cap_height;
+
+	// Runs of glyph i are runs[first[i]] to runs[first[i+1]-1].
+	int first[FONT_COUNT+1];
+	glyph_run_t* runs;
+};
+
+const int MAX_TEXT_ATLASES = 8;
+
+// Largest text size, in screen pixels.  Five times the game's largest text, and small enough that an atlas takes tens
+// of megabytes at most and its runs fit in shorts.
+const int MAX_TEXT_SIZE = 512;
+
+static text_atlas_t text_atlases[MAX_TEXT_ATLASES];
+static unsigned int text_atlas_clock = 0;
+
+// Set while render_list draws on several threads, which only look up the atlases it prepared for the frame.
+static bool text_atlases_frozen = false;
+
+static void build_text_atlas(text_atlas_t& a, int size)
+{
+	if (!font_master_built)
+		build_font_master();
+
+	// The size is in screen pixels, like a Cairo font size, so capitals are about 0.7*size tall.  Each font pixel is
+	// at least one 2x pixel.
+	float scale = size*0.7f/(FONT_CAP_HEIGHT*pixel_scale);
+	if (scale < 1.0f)
+		scale = 1.0f;
+
+	a.size = size;
+	a.width = int(FONT_WIDTH*scale + 0.5f);
+	a.height = int(FONT_HEIGHT*scale + 0.5f);
+	a.advance = int((FONT_WIDTH+1)*scale + 0.5f);
+	a.cap_height = int(FONT_CAP_HEIGHT*scale + 0.5f);
+
+	// Sample every pixel of every glyph, setting those whose area of the master glyph is at least half covered.
+	delete[] a.runs;
+	a.runs = new glyph_run_t[FONT_COUNT*a.height*((a.width+1)/2)];
+	int n = 0;
+	for (int i = 0; i < FONT_COUNT; i++)
+	{
+		a.first[i] = n;
+		for (int y = 0; y < a.height; y++)
 		{
-			h = (ix + 8) >> 6;
-			i = (iy + 8) >> 6;
-			int j = (h * rx) / ry;
-			int k = (i * rx) / ry;
-			if (((oi != i) && (oh != i)) || ((oh != h) && (oi != h) && (i != h))) 
+			int my0 = y*FONT_MASTER_HEIGHT/a.height;
+			int my1 = (y+1)*FONT_MASTER_HEIGHT/a.height;
+			int run = -1;
+			for (int x = 0; x <= a.width; x++)
 			{
-				int xmj = x-j;
-				int xpj = x+j-1;
-				if (i > 0) 
+				bool set = false;
+				if (x < a.width)
 				{
-					int ypi = y+i-1;
-					int ymi = y-i;
-					if (j > 0) 
-					{
-						draw_point_2x(img, xmj, ypi, color);
-						draw_point_2x(img, xmj, ymi, color);
-					}
-					draw_point_2x(img, xpj, ypi, color);
-					draw_point_2x(img, xpj, ymi, color);
+					int mx0 = x*FONT_MASTER_WIDTH/a.width;
+					int mx1 = (x+1)*FONT_MASTER_WIDTH/a.width;
+					int covered = 0;
+					for (int my = my0; my < my1; my++)
+						for (int mx = mx0; mx < mx1; mx++)
+							covered += font_master[i][my][mx];
+					set = covered*2 >= (my1-my0)*(mx1-mx0) && covered > 0;
 				}
-				oi = i;
-				int xmk = x-k;
-				int xpk = x+k-1;
-				if (h > 0) 
+				if (set && run < 0)
+					run = x;
+				else if (!set && run >= 0)
 				{
-					int yph = y+h-1;
-					int ymh = y-h;
-					draw_point_2x(img, xmk, yph, color);
-					draw_point_2x(img, xpk, yph, color);
-					draw_point_2x(img, xmk, ymh, color);
-					draw_point_2x(img, xpk, ymh, color);
+					a.runs[n].y = y;
+					a.runs[n].x0 = run;
+					a.runs[n].x1 = x-1;
+					n++;
+					run = -1;
 				}
-				oh = h;
 			}
-			ix = ix + iy / ry;
-			iy = iy - ix / ry;
-		} while (i > h);
+		}
 	}
+	a.first[FONT_COUNT] = n;
 }
 
-void fill_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color)
+// Returns the atlas for the given text size, building it if it isn't cached.  Sizes are clamped to 1 to MAX_TEXT_SIZE.
+static text_atlas_t* get_text_atlas(int size)
 {
-	if (rx==0 && ry==0) // Special case - draw a single pixel 
-	{  
-		draw_point_2x(img, x, y, color);
-		return;
+	size = size < 1 ? 1 : size > MAX_TEXT_SIZE ? MAX_TEXT_SIZE : size;
+
+	if (text_atlases_frozen)
+	{
+		for (int i = 0; i < MAX_TEXT_ATLASES; i++)
+			if (text_atlases[i].runs && text_atlases[i].size == size)
+				return &text_atlases[i];
 	}
-	if (rx==0)  // Special case for rx=0 - draw a vline
-	{ 
-		draw_line_2x(img, x, y-ry, x, y+ry, color);
+
+	text_atlas_clock++;
+
+	text_atlas_t* slot = NULL;
+	for (int i = 0; i < MAX_TEXT_ATLASES; i++)
+	{
+		text_atlas_t& a = text_atlases[i];
+		if (a.runs && a.size == size)
+		{
+			a.last_used = text_atlas_clock;
+			return &a;
+		}
+		if (!slot || !a.runs || (slot->runs && a.last_used < slot->last_used))
+			slot = &a;
+	}
+
+	build_text_atlas(*slot, size);
+	slot->last_used = text_atlas_clock;
+	return slot;
+}
+
+// Returns the glyph index of the character starting at text[i], and advances i past it.  Text is UTF-8; anything
+// outside of printable ASCII is drawn as a question mark.
+template <typename char_t> inline
+int next_glyph(const char_t* text, int length, int* i)
+{
+	int c = text[(*i)++] & 0xff;
+	if (c >= 0x80)
+	{
+		while (*i < length && (text[*i] & 0xc0) == 0x80)
+			(*i)++;
+		c = '?';
+	}
+	if (c < FONT_FIRST || c >= FONT_FIRST + FONT_COUNT)
+		c = '?';
+	return c - FONT_FIRST;
+}
+
+// Draws text centered on (x, y), where the capitals are vertically centered.  Text is a byte string of the given
+// length, either chars or one byte per int as stored in draw lists.
+template <typename pixel_t, typename char_t>
+void _draw_text_2x(GdkImage* img, const char_t* text, int length, int x, int y, int size, int color)
+{
+	text_atlas_t* a = get_text_atlas(size);
+
+	int count = 0;
+	for (int i = 0; i < length; count++)
+		next_glyph(text, length, &i);
+	if (count == 0)
 		return;
+
+	int width = (count-1)*a->advance + a->width;
+	int x0 = x - width/2;
+	int y0 = y - a->cap_height/2;
+	damage_2x(x0, y0, x0 + width - 1, y0 + a->height - 1);
+
+	target_2x<pixel_t> t(img);
+	pixel_t pix;
+	to_pixel(&pix, color);
+
+	// Text that is entirely inside the image is drawn without clipping every run.
+	bool inside = x0 >= 0 && y0 >= t.ymin && x0 + width - 1 <= t.xmax && y0 + a->height - 1 <= t.ymax;
+	for (int i = 0, gx = x0; i < length; gx += a->advance)
+	{
+		int g = next_glyph(text, length, &i);
+		for (int r = a->first[g]; r < a->first[g+1]; r++)
+		{
+			const glyph_run_t& run = a->runs[r];
+			if (inside)
+				t.span(gx + run.x0, gx + run.x1, y0 + run.y, pix);
+			else
+				t.clipped_span(gx + run.x0, gx + run.x1, y0 + run.y, pix);
+		}
 	}
-	if (ry==0) // Special case for ry=0 - draw a hline
-	{ 
-		draw_line_2x(img, x-rx, y, x+rx, y, color);
+}
+
+void draw_text_2x(GdkImage* img, const char* text, int x, int y, int size, int color)
+{
+	if (img->bpp == 2)
+		_draw_text_2x<depth16_t>(img, text, strlen(text), x, y, size, color);
+	else
+		_draw_text_2x<depth24_t>(img, text, strlen(text), x, y, size, color);
+}
+
+// Pixel scale.  The 2x primitives draw pixels of scale by scale screen pixels, 2 by default: the 3D primitives
+// divide projected screen pixels by the scale, and text is sized in screen pixels.  Normally every 2x pixel is a block
+// of that many image pixels.  A reduced image instead has one pixel per 2x pixel, 1/scale of the screen size, and is
+// enlarged with upscale_image, which costs less than drawing the blocks.  Cached backgrounds and text are drawn at
+// one scale, so changing it drops them.  It must not be changed while a frame is being drawn.
+void set_pixel_scale(int scale, int reduced)
+{
+	scale = scale < 1 ? 1 : scale > MAX_PIXEL_SCALE ? MAX_PIXEL_SCALE : scale;
+	int block = reduced ? 1 : scale;
+	if (scale == pixel_scale && block == pixel_block)
 		return;
+	pixel_scale = scale;
+	pixel_block = block;
+
+	drop_backgrounds();
+	for (int i = 0; i < MAX_TEXT_ATLASES; i++)
+	{
+		delete[] text_atlases[i].runs;
+		text_atlases[i].runs = NULL;
 	}
+}
 
-	// Draw
-	int oh = 0xffff;
-	int oi = 0xffff;
-	int oj = 0xffff;
-	int ok = 0xffff;
+int get_pixel_scale()
+{
+	return pixel_scale;
+}
 
-	if (rx >= ry) 
+// Enlarges the rectangle r of src, in src pixels and clipped to both images, scale times into dst.  Every source row
+// is widened into the first of its rows in dst, which is then copied to the others.
+template <typename pixel_t>
+void _upscale_rect(GdkImage* src, GdkImage* dst, int scale, const damage_rect_t& r)
+{
+	const pixel_t* in = (const pixel_t*)src->mem;
+	pixel_t* out = (pixel_t*)dst->mem;
+	int src_pitch = src->bpl/sizeof(pixel_t);
+	int dst_pitch = dst->bpl/sizeof(pixel_t);
+	size_t bytes = (r.x1 - r.x0)*scale*sizeof(pixel_t);
+
+	for (int y = r.y0; y < r.y1; y++)
 	{
-		int ix = 0;
-		int iy = rx * 64;
-		int i, h;
-		do 
+		const pixel_t* a = in + src_pitch*y + r.x0;
+		pixel_t* row = out + (dst_pitch*y + r.x0)*scale;
+		pixel_t* b = row;
+		switch (scale)
 		{
-			h = (ix + 8) >> 6;
-			i = (iy + 8) >> 6;
-			int j = (h * ry) / rx;
-			int k = (i * ry) / rx;
-			if ((ok != k) && (oj != k) && (k < ry)) 
-			{
-				draw_line_2x(img, x-h, y-k-1, x+h-1, y-k-1, color);
-				draw_line_2x(img, x-h, y+k, x+h-1, y+k, color);
-				ok = k;
-			}
-			if ((oj != j) && (ok != j) && (k != j))  
-			{
-				draw_line_2x(img, x-i, y+j, x+i-1, y+j, color);
-				draw_line_2x(img, x-i, y-j-1, x+i-1, y-j-1, color);
-				oj = j;
-			}
-			ix = ix + iy / rx;
-			iy = iy - ix / rx;
-		} while (i > h);
-	} 
-	else 
+		case 1:
+			kernels->copy(row, a, bytes);
+			break;
+		case 2:
+			for (int x = r.x0; x < r.x1; x++, b += 2)
+				b[0] = b[1] = *a++;
+			break;
+		default:
+			for (int x = r.x0; x < r.x1; x++, a++, b += scale)
+				for (int i = 0; i < scale; i++)
+					b[i] = *a;
+			break;
+		}
+		for (int i = 1; i < scale; i++)
+			kernels->copy(row + dst_pitch*i, row, bytes);
+	}
+}
+
+// Enlarges the given (x, y, width, height) rectangles of src, such as the damage returned by get_damage, scale times
+// into dst, which must have the same pixel format.  This is how an image drawn at a lower resolution gets to the
+// screen.  Returns the rectangles covered in dst.
+PyObject* upscale_image(GdkImage* src, GdkImage* dst, int scale, PyObject* rects)
+{
+	if (scale < 1 || scale > MAX_PIXEL_SCALE)
 	{
-		int ix = 0;
-		int iy = ry * 64;
-		int i, h;
-		do 
+		PyErr_SetString(PyExc_ValueError, "bad scale");
+		return NULL;
+	}
+	if (src->bpp != dst->bpp || (src->bpp != 2 && src->bpp != 4))
+	{
+		PyErr_SetString(PyExc_ValueError, "unsupported pixel format");
+		return NULL;
+	}
+
+	PyObject* seq = PySequence_Fast(rects, "expected a sequence of rectangles");
+	if (!seq)
+		return NULL;
+
+	// Clip the rectangles first, the copying is done without the GIL.
+	int xlimit = src->width < dst->width/scale ? src->width : dst->width/scale;
+	int ylimit = src->height < dst->height/scale ? src->height : dst->height/scale;
+	Py_ssize_t count = PySequence_Fast_GET_SIZE(seq);
+	damage_rect_t* clipped = new damage_rect_t[count];
+	int n = 0;
+	for (Py_ssize_t i = 0; i < count; i++)
+	{
+		int x, y, w, h;
+		if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(seq, i), "iiii", &x, &y, &w, &h))
 		{
-			h = (ix + 8) >> 6;
-			i = (iy + 8) >> 6;
-			int j = (h * rx) / ry;
-			int k = (i * rx) / ry;
-			if ((oi != i) && (oh != i) && (i < ry)) 
-			{
-				draw_line_2x(img, x-j, y+i, x+j-1, y+i, color);
-				draw_line_2x(img, x-j, y-i-1, x+j-1, y-i-1, color);
-				oi = i;
-			}
-			if ((oh != h) && (oi != h) && (i != h)) 
-			{
-				draw_line_2x(img, x-k, y+h, x+k-1, y+h, color);
-				draw_line_2x(img, x-k, y-h-1, x+k-1, y-h-1, color);
-				oh = h;
-			}
-			ix = ix + iy / ry;
-			iy = iy - ix / ry;
-		} while (i > h);
+			delete[] clipped;
+			Py_DECREF(seq);
+			return NULL;
+		}
+		damage_rect_t r;
+		r.x0 = x < 0 ? 0 : x;
+		r.y0 = y < 0 ? 0 : y;
+		r.x1 = x + w > xlimit ? xlimit : x + w;
+		r.y1 = y + h > ylimit ? ylimit : y + h;
+		if (r.x0 < r.x1 && r.y0 < r.y1)
+			clipped[n++] = r;
+	}
+	Py_DECREF(seq);
+
+	Py_BEGIN_ALLOW_THREADS
+	for (int i = 0; i < n; i++)
+	{
+		if (src->bpp == 2)
+			_upscale_rect<depth16_t>(src, dst, scale, clipped[i]);
+		else
+			_upscale_rect<depth24_t>(src, dst, scale, clipped[i]);
+	}
+	Py_END_ALLOW_THREADS
+
+	PyObject* list = PyList_New(n);
+	for (int i = 0; i < n; i++)
+	{
+		const damage_rect_t& r = clipped[i];
+		PyList_SET_ITEM(list, i, Py_BuildValue("(iiii)", r.x0*scale, r.y0*scale, (r.x1 - r.x0)*scale,
+		                                       (r.y1 - r.y0)*scale));
 	}
+	delete[] clipped;
+	return list;
 }
 
 int actual_screen_width = 1200;
@@ -405,70 +2172,465 @@ int to_fixed(int x)
 	return x<<8;
 }
 
+// Perspective.  A point at depth z is pulled towards the middle of the screen by viewport_scale/(z + viewport_scale),
+// and the division is most of the cost of a projection.  The points of a frame share few depths, the stage grid
+// having five and the paddles and ball one each, so the divisor of each depth is turned into a multiply and a shift
+// once and kept in a small cache.  The results are exactly those of dividing.
+struct depth_divisor_t
+{
+    int d;              // z + viewport_scale, 0 for an empty entry
+    guint64 magic;      // ceil(2^shift / d)
+    int shift;
+};
+
+const int DEPTH_CACHE_SIZE = 64;
+
+static __thread depth_divisor_t depth_cache[DEPTH_CACHE_SIZE];
+
+// Returns the cached divisor for d, which must be positive.
+static inline const depth_divisor_t& depth_divisor(int d)
+{
+    depth_divisor_t& e = depth_cache[(d ^ (d >> 6) ^ (d >> 12)) & (DEPTH_CACHE_SIZE-1)];
+    if (__builtin_expect(e.d != d, 0))
+    {
+        // With 2^(l-1) < d <= 2^l and a shift of 31+l, the quotient is exact for any numerator up to 2^31.
+        int l = 0;
+        while ((guint64(1) << l) < guint64(d))
+            l++;
+        e.d = d;
+        e.shift = 31 + l;
+        e.magic = ((guint64(1) << e.shift) + d - 1) / d;
+    }
+    return e;
+}
+
+// Divides n by d, rounding towards zero like the / operator.
+static inline int divide(int n, int d)
+{
+    if (d <= 0)
+        return n / d;
+    const depth_divisor_t& e = depth_divisor(d);
+    guint32 sign = guint32(n >> 31);
+    guint32 a = (guint32(n) ^ sign) - sign;
+    guint32 q = guint32((a * e.magic) >> e.shift);
+    return int((q ^ sign) - sign);
+}
+
+// Projects a point to screen pixels, sharing the divisor between both coordinates.
+static inline void project(int x, int y, int z, int* px, int* py)
+{
+    int d = z + viewport_scale;
+    *px = (to_fixed(50) + divide(( x - to_fixed(50) ) * viewport_scale, d)) * actual_screen_width/100 / 256;
+    *py = (to_fixed(50) + divide(( y - to_fixed(50) ) * viewport_scale, d)) * actual_screen_height/100 / 256;
+}
+
 int project_x(int x, int y, int z)
 {
-    return (to_fixed(50) + ( x - to_fixed(50) ) * viewport_scale / ( z + viewport_scale )) * actual_screen_width/100 / 256;
+    return (to_fixed(50) + divide(( x - to_fixed(50) ) * viewport_scale, z + viewport_scale)) * actual_screen_width/100 / 256;
 }
 
 int project_y(int x, int y, int z)
 {
-    return (to_fixed(50) + ( y - to_fixed(50) ) * viewport_scale / ( z + viewport_scale )) * actual_screen_height/100 / 256;
+    return (to_fixed(50) + divide(( y - to_fixed(50) ) * viewport_scale, z + viewport_scale)) * actual_screen_height/100 / 256;
 }
 
-void draw_line_3d(GdkImage* img, int x0, int y0, int z0, int x1, int y1, int z1, float c)
+// Projects a buffer of native int (x, y, z) points to screen pixels, writing (x, y) pairs to another buffer, which
+// must have room for one pair per point.
+PyObject* project_points(PyObject* points, PyObject* screen)
 {
-    x0 = project_x(x0, y0, z0)/2;
-    y0 = project_y(x0, y0, z0)/2;
-    x1 = project_x(x1, y1, z1)/2;
-    y1 = project_y(x1, y1, z1)/2;
+    const void* src;
+    void* dst;
+    Py_ssize_t src_size, dst_size;
+    if (PyObject_AsReadBuffer(points, &src, &src_size) < 0 || PyObject_AsWriteBuffer(screen, &dst, &dst_size) < 0)
+        return NULL;
+
+    Py_ssize_t count = src_size/(3*sizeof(int));
+    if (src_size % (3*sizeof(int)) != 0 || dst_size < Py_ssize_t(count*2*sizeof(int)))
+    {
+        PyErr_SetString(PyExc_ValueError, "bad point buffer sizes");
+        return NULL;
+    }
 
-    draw_line_2x(img, x0, y0, x1, y1, int(c*255.0));
+    const int* p = (const int*)src;
+    int* q = (int*)dst;
+    for (Py_ssize_t i = 0; i < count; i++, p += 3, q += 2)
+        project(p[0], p[1], p[2], &q[0], &q[1]);
+
+    Py_RETURN_NONE;
 }
 
-void draw_rect_3d(GdkImage* img, int x0, int y0, int x1, int y1, int depth, float c)
+// 3D primitives.  Like the 2D ones, the templated versions do the work and take a 0-255 color.
+template <typename pixel_t> inline
+void _draw_line_3d(GdkImage* img, int x0, int y0, int z0, int x1, int y1, int z1, int color)
 {
-    x0 = (project_x(x0, y0, depth) + 1)/2;
-    y0 = (project_y(x0, y0, depth) + 1)/2;
-    x1 = (project_x(x1, y1, depth) - 1)/2;
-    y1 = (project_y(x1, y1, depth) - 1)/2;
+    project(x0, y0, z0, &x0, &y0);
+    project(x1, y1, z1, &x1, &y1);
 
-    draw_line_2x(img, x0, y0, x1, y0, int(c*255.0));
-    draw_line_2x(img, x1, y0, x1, y1, int(c*255.0));
-    draw_line_2x(img, x1, y1, x0, y1, int(c*255.0));
-    draw_line_2x(img, x0, y1, x0, y0, int(c*255.0));
+    int s = pixel_scale;
+    _draw_line_2x<pixel_t>(img, x0/s, y0/s, x1/s, y1/s, color);
 }
 
-void draw_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c)
+template <typename pixel_t> inline
+void _draw_rect_3d(GdkImage* img, int x0, int y0, int x1, int y1, int depth, int color)
+{
+    project(x0, y0, depth, &x0, &y0);
+    project(x1, y1, depth, &x1, &y1);
+    int s = pixel_scale;
+    x0 = (x0 + s - 1)/s;
+    y0 = (y0 + s - 1)/s;
+    x1 = (x1 - s + 1)/s;
+    y1 = (y1 - s + 1)/s;
+
+    _draw_line_2x<pixel_t>(img, x0, y0, x1, y0, color);
+    _draw_line_2x<pixel_t>(img, x1, y0, x1, y1, color);
+    _draw_line_2x<pixel_t>(img, x1, y1, x0, y1, color);
+    _draw_line_2x<pixel_t>(img, x0, y1, x0, y0, color);
+}
+
+template <typename pixel_t> inline
+void _draw_circle_3d(GdkImage* img, int x, int y, int z, int radius, int color)
+{
+    int px, py;
+    project(x, y, z, &px, &py);
+    int r = (project_x(x+radius, y, z)-px)/pixel_scale;
+    if (r < 1) return;
+
+    _draw_ellipse_2x<pixel_t>(img, px/pixel_scale, py/pixel_scale, r, r, color);
+}
+
+template <typename pixel_t> inline
+void _fill_circle_3d(GdkImage* img, int x, int y, int z, int radius, int color)
 {
-    int r = (project_x(x+radius, y, z)-project_x(x, y, z))/2;
+    int px, py;
+    project(x, y, z, &px, &py);
+    int r = (project_x(x+radius, y, z)-px)/pixel_scale;
     if (r < 1) return;
 
-    x = project_x(x, y, z)/2;
-    y = project_y(x, y, z)/2;
+    _fill_ellipse_2x<pixel_t>(img, px/pixel_scale, py/pixel_scale, r, r, color);
+}
+
+template <typename pixel_t> inline
+void _draw_ellipse_3d(GdkImage* img, int x, int y, int z, int rx, int ry, int color)
+{
+    int px, py;
+    project(x, y, z, &px, &py);
+    rx = (project_x(x+rx, y, z)-px)/pixel_scale;
+    ry = (project_y(x, y+ry, z)-py)/pixel_scale;
+    if (rx < 1 || ry < 1) return;
+
+    _draw_ellipse_2x<pixel_t>(img, px/pixel_scale, py/pixel_scale, rx, ry, color);
+}
 
-    draw_ellipse_2x(img, x, y, r, r, int(c*255.0));
+void draw_line_3d(GdkImage* img, int x0, int y0, int z0, int x1, int y1, int z1, float c)
+{
+    if (img->bpp == 2)
+        _draw_line_3d<depth16_t>(img, x0, y0, z0, x1, y1, z1, int(c*255.0));
+    else
+        _draw_line_3d<depth24_t>(img, x0, y0, z0, x1, y1, z1, int(c*255.0));
 }
 
-void fill_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c)
+void draw_rect_3d(GdkImage* img, int x0, int y0, int x1, int y1, int depth, float c)
 {
-    int r = (project_x(x+radius, y, z)-project_x(x, y, z))/2;
-	if (r < 1) return;
+    if (img->bpp == 2)
+        _draw_rect_3d<depth16_t>(img, x0, y0, x1, y1, depth, int(c*255.0));
+    else
+        _draw_rect_3d<depth24_t>(img, x0, y0, x1, y1, depth, int(c*255.0));
+}
 
-    x = project_x(x, y, z)/2;
-    y = project_y(x, y, z)/2;
+void draw_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c)
+{
+    if (img->bpp == 2)
+        _draw_circle_3d<depth16_t>(img, x, y, z, radius, int(c*255.0));
+    else
+        _draw_circle_3d<depth24_t>(img, x, y, z, radius, int(c*255.0));
+}
 
-    fill_ellipse_2x(img, x, y, r, r, int(c*255.0));
+void fill_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c)
+{
+    if (img->bpp == 2)
+        _fill_circle_3d<depth16_t>(img, x, y, z, radius, int(c*255.0));
+    else
+        _fill_circle_3d<depth24_t>(img, x, y, z, radius, int(c*255.0));
 }
 
 void draw_ellipse_3d(GdkImage* img, int x, int y, int z, int rx, int ry, float c)
 {
-    rx = (project_x(x+rx, y, z)-project_x(x, y, z))/2;
-    ry = (project_y(x, y+ry, z)-project_y(x, y, z))/2;
-    if (rx < 1 || ry < 1) return;
+    if (img->bpp == 2)
+        _draw_ellipse_3d<depth16_t>(img, x, y, z, rx, ry, int(c*255.0));
+    else
+        _draw_ellipse_3d<depth24_t>(img, x, y, z, rx, ry, int(c*255.0));
+}
+
+// Draw lists.  A draw list is a buffer of native ints holding a sequence of records, each made of a DRAW_* command
+// followed by its arguments, in the same order as the matching function.  Colors are 0-255.  render_list draws a
+// whole frame's worth of primitives with a single call from Python.
+static const int draw_list_args[DRAW_COMMAND_COUNT] = {
+    0, // DRAW_END
+    5, // DRAW_LINE_2X
+    5, // DRAW_ELLIPSE_2X
+    5, // DRAW_FILL_ELLIPSE_2X
+    7, // DRAW_LINE_3D
+    6, // DRAW_RECT_3D
+    5, // DRAW_CIRCLE_3D
+    5, // DRAW_FILL_CIRCLE_3D
+    6, // DRAW_ELLIPSE_3D
+    5, // DRAW_TEXT_2X, followed by as many ints as its length argument says, one for each byte of the text.
+};
+
+// Length of the arguments of the record at p.
+static inline Py_ssize_t record_args(const int* p)
+{
+    return draw_list_args[*p] + (*p == DRAW_TEXT_2X ? Py_ssize_t(p[5]) : 0);
+}
+
+template <typename pixel_t>
+void _render_list(GdkImage* img, const int* p, const int* end)
+{
+    while (p < end)
+    {
+        const int* a = p + 1;
+        switch (*p)
+        {
+        case DRAW_LINE_2X: _draw_line_2x<pixel_t>(img, a[0], a[1], a[2], a[3], a[4]); break;
+        case DRAW_ELLIPSE_2X: _draw_ellipse_2x<pixel_t>(img, a[0], a[1], a[2], a[3], a[4]); break;
+        case DRAW_FILL_ELLIPSE_2X: _fill_ellipse_2x<pixel_t>(img, a[0], a[1], a[2], a[3], a[4]); break;
+        case DRAW_LINE_3D: _draw_line_3d<pixel_t>(img, a[0], a[1], a[2], a[3], a[4], a[5], a[6]); break;
+        case DRAW_RECT_3D: _draw_rect_3d<pixel_t>(img, a[0], a[1], a[2], a[3], a[4], a[5]); break;
+        case DRAW_CIRCLE_3D: _draw_circle_3d<pixel_t>(img, a[0], a[1], a[2], a[3], a[4]); break;
+        case DRAW_FILL_CIRCLE_3D: _fill_circle_3d<pixel_t>(img, a[0], a[1], a[2], a[3], a[4]); break;
+        case DRAW_ELLIPSE_3D: _draw_ellipse_3d<pixel_t>(img, a[0], a[1], a[2], a[3], a[4], a[5]); break;
+        case DRAW_TEXT_2X: _draw_text_2x<pixel_t>(img, a + 5, a[4], a[0], a[1], a[2], a[3]); break;
+        }
+        p = a + record_args(p);
+    }
+}
+
+// Banded rendering.  render_list splits the image into horizontal bands and draws the whole list into each band on
+// its own thread, with every primitive clipped to the band, so the threads never write the same pixels and the image
+// comes out the same as when drawn on a single thread.  The calling thread draws the first band and records the
+// damage, and a pool of worker threads, started the first time they're needed, draws the others.
+const int MAX_RENDER_THREADS = 16;
+
+// Bands are at least this many 2x rows, below which a thread costs more than it saves.
+const int MIN_BAND_ROWS = 32;
+
+struct render_job_t
+{
+    GdkImage* img;
+    const int* begin;
+    const int* end;
+    int bands;
+};
+
+static int render_threads = 0;  // Requested with set_render_threads, 0 for one per processor.
+
+static pthread_mutex_t render_lock = PTHREAD_MUTEX_INITIALIZER;  // Held while a frame is drawn.
+static pthread_mutex_t pool_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t pool_start = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t pool_done = PTHREAD_COND_INITIALIZER;
+static pthread_t pool_threads[MAX_RENDER_THREADS];
+static int pool_size = 0;
+static unsigned int pool_frame = 0;
+static int pool_pending = 0;
+static render_job_t pool_job;
+
+static void render_band(const render_job_t& job, int band)
+{
+    int rows = job.img->height/pixel_block - 1;
+    band_ymin = rows*band/job.bands;
+    band_ymax = rows*(band + 1)/job.bands - 1;
+
+    if (job.img->bpp == 2)
+        _render_list<depth16_t>(job.img, job.begin, job.end);
+    else
+        _render_list<depth24_t>(job.img, job.begin, job.end);
+
+    band_ymin = 0;
+    band_ymax = G_MAXINT;
+}
+
+// Worker thread n draws band n of every frame that has one.
+static void* render_worker_main(void* arg)
+{
+    int n = int((intptr_t)arg);
+    render_worker = true;
+
+    unsigned int frame = 0;
+    pthread_mutex_lock(&pool_lock);
+    for (;;)
+    {
+        while (pool_frame == frame)
+            pthread_cond_wait(&pool_start, &pool_lock);
+        frame = pool_frame;
+        render_job_t job = pool_job;
+        if (n >= job.bands)
+        {
+            // Idle while frames have fewer bands, so don't hold on to shapes meanwhile.
+            drop_ellipse_shapes();
+            continue;
+        }
+        pthread_mutex_unlock(&pool_lock);
+
+        render_band(job, n);
+
+        pthread_mutex_lock(&pool_lock);
+        if (--pool_pending == 0)
+            pthread_cond_signal(&pool_done);
+    }
+    return NULL;
+}
+
+// Sets the number of threads render_list draws with, 0 for one per processor and 1 to draw on the calling thread only.
+void set_render_threads(int n)
+{
+    render_threads = n < 0 ? 0 : n > MAX_RENDER_THREADS ? MAX_RENDER_THREADS : n;
+
+    // Wake the workers with a job of no bands, so that those left idle drop their ellipse shapes.
+    pthread_mutex_lock(&render_lock);
+    pthread_mutex_lock(&pool_lock);
+    if (pool_size > 0)
+    {
+        pool_job.bands = 0;
+        pool_frame++;
+        pthread_cond_broadcast(&pool_start);
+    }
+    pthread_mutex_unlock(&pool_lock);
+    pthread_mutex_unlock(&render_lock);
+}
+
+// Returns the number of threads render_list draws with, at most, counting the calling thread.
+int get_render_threads()
+{
+    if (render_threads > 0)
+        return render_threads;
+    long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    return cpus < 1 ? 1 : cpus > MAX_RENDER_THREADS ? MAX_RENDER_THREADS : int(cpus);
+}
+
+// Returns the number of bands to draw a list with.  Text atlases can't be built or evicted while several threads draw,
+// so every atlas the list needs is made ready first, and lists with more text sizes than there are atlases are drawn
+// in a single band.
+static int prepare_bands(GdkImage* img, const int* begin, const int* end)
+{
+    int bands = get_render_threads();
+    int rows = img->height/pixel_block - 1;
+    if (bands > rows/MIN_BAND_ROWS)
+        bands = rows/MIN_BAND_ROWS;
+    if (bands <= 1)
+        return 1;
+
+    int sizes[MAX_TEXT_ATLASES];
+    int count = 0;
+    for (const int* p = begin; p < end; p += 1 + record_args(p))
+    {
+        if (*p != DRAW_TEXT_2X)
+            continue;
+        int i = 0;
+        while (i < count && sizes[i] != p[3])
+            i++;
+        if (i == count)
+        {
+            if (count == MAX_TEXT_ATLASES)
+                return 1;
+            sizes[count++] = p[3];
+        }
+    }
+    for (int i = 0; i < count; i++)
+        get_text_atlas(sizes[i]);
+
+    // Start any workers that aren't running yet, settling for fewer bands if that fails.
+    while (pool_size < bands - 1)
+    {
+        if (pthread_create(&pool_threads[pool_size], NULL, render_worker_main, (void*)(intptr_t)(pool_size + 1)) != 0)
+        {
+            bands = pool_size + 1;
+            break;
+        }
+        pthread_detach(pool_threads[pool_size]);
+        pool_size++;
+    }
+    return bands;
+}
+
+static void render_frame(GdkImage* img, const int* begin, const int* end)
+{
+    pthread_mutex_lock(&render_lock);
+
+    render_job_t job;
+    job.img = img;
+    job.begin = begin;
+    job.end = end;
+    job.bands = prepare_bands(img, begin, end);
+
+    if (job.bands == 1)
+        render_band(job, 0);
+    else
+    {
+        text_atlases_frozen = true;
+
+        pthread_mutex_lock(&pool_lock);
+        pool_job = job;
+        pool_pending = job.bands - 1;
+        pool_frame++;
+        pthread_cond_broadcast(&pool_start);
+        pthread_mutex_unlock(&pool_lock);
+
+        render_band(job, 0);
 
-    x = project_x(x, y, z)/2;
-    y = project_y(x, y, z)/2;
+        pthread_mutex_lock(&pool_lock);
+        while (pool_pending > 0)
+            pthread_cond_wait(&pool_done, &pool_lock);
+        pthread_mutex_unlock(&pool_lock);
 
-    draw_ellipse_2x(img, x, y, rx, ry, int(c*255.0));
+        text_atlases_frozen = false;
+    }
+
+    pthread_mutex_unlock(&render_lock);
 }
 
+PyObject* render_list(GdkImage* img, PyObject* list)
+{
+    const void* data;
+    Py_ssize_t size;
+    if (PyObject_AsReadBuffer(list, &data, &size) < 0)
+        return NULL;
+
+    // Check the whole list first, so that the renderer doesn't need to.  DRAW_END ends the list early.
+    const int* begin = (const int*)data;
+    const int* end = begin + size/sizeof(int);
+    for (const int* p = begin; p < end; p += 1 + record_args(p))
+    {
+        if (*p == DRAW_END)
+        {
+            end = p;
+            break;
+        }
+        // Ints following the command.  The text length is checked against it before it's added to anything.
+        Py_ssize_t left = end - p - 1;
+        bool bad = *p < 0 || *p >= DRAW_COMMAND_COUNT || left < draw_list_args[*p];
+        if (!bad && *p == DRAW_TEXT_2X)
+            bad = p[5] < 0 || p[5] > left - draw_list_args[DRAW_TEXT_2X];
+        if (bad)
+        {
+            PyErr_Format(PyExc_ValueError, "bad draw list command at offset %zd", p - begin);
+            return NULL;
+        }
+    }
+
+    if (img->bpp != 2 && img->bpp != 4)
+    {
+        PyErr_SetString(PyExc_ValueError, "unsupported pixel format");
+        return NULL;
+    }
+
+    // The frame is drawn without the GIL, from a copy of the list, since Python code could change the list meanwhile.
+    int* copy = new int[end - begin];
+    memcpy(copy, begin, (end - begin)*sizeof(int));
+
+    Py_BEGIN_ALLOW_THREADS
+    render_frame(img, copy, copy + (end - begin));
+    Py_END_ALLOW_THREADS
+
+    delete[] copy;
+    Py_RETURN_NONE;
+}
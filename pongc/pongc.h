@@ -23,13 +23,49 @@
 #include <gdk/gdkimage.h>
 #include <gst/gstbuffer.h>
 
+// Pixel formats and kernels
+int set_pixel_format(GdkImage* img);
+int set_pixel_kernels(const char* name);
+const char* get_pixel_kernels();
+
+// Buffer protocol view of the pixels of an image, see pongc.cpp.  Takes the image from Python.
+PyObject* image_view(GdkImage* image, PyObject* owner);
+
+// Render targets, images in memory that work without a display.  Every function taking a GdkImage* also takes a
+// render target.
+PyObject* create_render_target(int width, int height, int depth);
+PyObject* write_image(GdkImage* img, const char* filename);
+
+#ifndef SWIG
+// Returns the image of a render target, or NULL if obj isn't one.
+GdkImage* render_target_image(PyObject* obj);
+#endif
+
 // 2D primitives
 void clear_image(GdkImage* img);
 
+// Damage tracking and background layer cache
+int use_background(GdkImage* img, int stage_depth, int brightness);
+void store_background(GdkImage* img);
+void drop_backgrounds();
+int begin_frame(GdkImage* img, int full);
+void set_damage_tracking(int enabled);
+PyObject* get_damage();
+
+// Scale of the 2x primitives, 1 to 4 screen pixels per 2x pixel
+void set_pixel_scale(int scale, int reduced);
+int get_pixel_scale();
+PyObject* upscale_image(GdkImage* src, GdkImage* dst, int scale, PyObject* rects);
+
 void draw_line_2x(GdkImage* img, int x0, int y0, int x1, int y1, int color);
 
 void draw_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color);
 void fill_ellipse_2x(GdkImage* img, int x, int y, int rx, int ry, int color);
+void draw_text_2x(GdkImage* img, const char* text, int x, int y, int size, int color);
+
+// Ellipse shape cache statistics
+PyObject* get_ellipse_cache_stats();
+void reset_ellipse_cache_stats();
 
 // 3D primitives
 void set_3d_params(int actual_screen_width, int actual_screen_height, int viewport_scale);
@@ -37,11 +73,32 @@ void set_3d_params(int actual_screen_width, int actual_screen_height, int viewpo
 int to_fixed(int x);
 int project_x(int x, int y, int z);
 int project_y(int x, int y, int z);
+PyObject* project_points(PyObject* points, PyObject* screen);
 void draw_line_3d(GdkImage* img, int x0, int y0, int z0, int x1, int y1, int z1, float c);
 void draw_rect_3d(GdkImage* img, int x0, int y0, int x1, int y1, int depth, float c);
 void draw_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c);
 void fill_circle_3d(GdkImage* img, int x, int y, int z, int radius, float c);
 void draw_ellipse_3d(GdkImage* img, int x, int y, int z, int rx, int ry, float c);
 
+// Draw lists, see render_list in pongc.cpp
+enum
+{
+    DRAW_END,
+    DRAW_LINE_2X,
+    DRAW_ELLIPSE_2X,
+    DRAW_FILL_ELLIPSE_2X,
+    DRAW_LINE_3D,
+    DRAW_RECT_3D,
+    DRAW_CIRCLE_3D,
+    DRAW_FILL_CIRCLE_3D,
+    DRAW_ELLIPSE_3D,
+    DRAW_TEXT_2X,
+    DRAW_COMMAND_COUNT
+};
+
+PyObject* render_list(GdkImage* img, PyObject* list);
+void set_render_threads(int n);
+int get_render_threads();
+
 #endif
 
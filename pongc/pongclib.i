@@ -20,6 +20,23 @@
 %{
 #include <pygobject.h>
 #include "pongc.h"
+
+// Returns the GdkImage of a gtk.gdk.Image or of a render target, or NULL with a TypeError set for anything else.
+static GdkImage* get_gdk_image(PyObject* obj)
+{
+        GdkImage* img = render_target_image(obj);
+        if (img)
+                return img;
+        if (!PyObject_TypeCheck(obj, &PyGObject_Type) || !GDK_IS_IMAGE(((PyGObject*)obj)->obj)) {
+                PyErr_SetString(PyExc_TypeError, "expected a gtk.gdk.Image or a render target");
+                return NULL;
+        }
+        return GDK_IMAGE(((PyGObject*)obj)->obj);
+}
+%}
+
+%init %{
+        init_pygobject();
 %}
 
 // Testing facility.
@@ -35,12 +52,19 @@
         $1 = buf;
 }
 
-// Pass a gtk.gdk.Image as a GdkImage*.
+// Pass a gtk.gdk.Image or a render target as a GdkImage*.
 %typemap(in) GdkImage* {
-        // todo- Error checking would be nice.
-        PyGObject* pygo = (PyGObject*)$input;
-        GdkImage* img = (GdkImage*)pygo->obj;
-        $1 = img;
+        $1 = get_gdk_image($input);
+        if (!$1)
+                SWIG_fail;
+}
+
+// Pass a gtk.gdk.Image or a render target as a GdkImage*, along with the Python object for the C code to keep a reference to.
+%typemap(in) (GdkImage* image, PyObject* owner) {
+        $1 = get_gdk_image($input);
+        if (!$1)
+                SWIG_fail;
+        $2 = $input;
 }
 
 %include "pongc.h"
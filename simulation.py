@@ -0,0 +1,522 @@
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Headless Bounce simulation core.
+
+This module holds the game physics (ball, paddles, stage and AI) with no dependency on GTK, PyGame or Sugar, so
+that matches can be simulated, tested and profiled without a display.  All the state of a match lives in a World
+object, which is advanced one animation frame at a time by step().  Instead of playing sounds, step() returns the
+list of collision events that happened during the frame.
+"""
+
+import math, heapq
+
+def clamp(a, b, c):
+    if (a<b): return b
+    elif (a>c): return c
+    else: return a
+
+def to_fixed(a):
+    return int(a * 256)
+
+def from_fixed(a):
+    return a >> 8
+
+def fixed_mul(a, b):
+    return (a * b) >> 8
+
+# Three dimensional vector class.
+class Vector:
+    def __init__(self, x=0, y=0, z=0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+zerovec = Vector(0, 0, 0)
+
+# Two dimensional rectangle class.
+class Rect:
+    def __init__(self):
+        self.top = 0
+        self.left = 0
+        self.right = 0
+        self.bottom = 0
+
+# Game constants
+time_res = 32
+
+# Collision events returned by Ball.update and step().
+EVENT_NONE    = 0
+EVENT_SCORE1  = 1 # Ball hit the back wall, Paddle1 scored.
+EVENT_SCORE2  = 2 # Ball hit the front wall, Paddle2 scored.
+EVENT_PADDLE1 = 3
+EVENT_PADDLE2 = 4
+EVENT_WALL    = 5
+
+# Tie break order for impacts that happen at the same time.  Paddles win over walls, and walls win over each other
+# in the order they are listed in Stage.planes.
+PRIORITY_PADDLE1 = -2
+PRIORITY_PADDLE2 = -1
+
+def first_impact(impacts):
+    """Returns the first of a list of (time, priority, event, newvel) impacts, or None if there is none.
+
+    Normally this is the earliest impact, with ties broken by priority.  A time of exactly -1 is a special case: it
+    was once used as the "no collision" marker, so it is not an impact in itself and discards the impacts listed
+    before it.  That case is replayed in list order to keep the ball paths identical to earlier versions."""
+    if not impacts:
+        return None
+
+    for impact in impacts:
+        if impact[0] == -1:
+            break
+    else:
+        queue = []
+        for impact in impacts:
+            heapq.heappush(queue, impact)
+        return heapq.heappop(queue)
+
+    first = None
+    for impact in impacts:
+        t = impact[0]
+        if first is None or first[0] == -1 or t < first[0] or (impact[1] < 0 and t == first[0]):
+            first = impact
+    if first[0] == -1:
+        return None
+    return first
+
+class Ball:
+    def __init__(self):
+        self.lastpos = Vector()
+        self.lastvel = Vector()
+        self.pos = Vector()
+        self.vel = Vector()
+        self.size = 1
+        self.speed = 1
+
+    def setup (self, desc):
+        self.size = to_fixed(desc['BallSize'])
+        self.speed = to_fixed(desc['BallSpeed'])
+
+        self.pos = Vector(to_fixed(50), to_fixed(25), to_fixed(desc['StageDepth'])/2)
+        self.vel = Vector(to_fixed(2), to_fixed(2), self.speed)
+
+        # Nothing has been simulated yet, so the ball was last where it starts.
+        self.lastpos = Vector(self.pos.x, self.pos.y, self.pos.z)
+        self.lastvel = Vector(self.vel.x, self.vel.y, self.vel.z)
+
+    def update (self, paddle1, paddle2, stage, events=None):
+        """Advances the ball by one animation frame.  Returns the type of the last collision (one of the EVENT_*
+        constants), and appends every collision in the frame to events, if given."""
+        # Ball collisions are handled very accurately, as this is the basis of the game.
+        # All times are in 1sec/time_res units.
+        # 1. Find every surface the ball would cross in the rest of this animation frame (the stage planes
+        # precomputed by Stage.setup, plus the two paddles), calculate its time of impact and queue it.
+        # 2. Take the first impact off the queue, advance the ball to it and update the Ball velocity.
+        # 3. Goto step 1, until no impacts remain in the current animation frame.
+        pos = self.pos
+        vel = self.vel
+
+        self.lastpos.x = pos.x
+        self.lastpos.y = pos.y
+        self.lastpos.z = pos.z
+        self.lastvel.x = vel.x
+        self.lastvel.y = vel.y
+        self.lastvel.z = vel.z
+
+        time_left = time_res                  # Time remaining in this animation frame.
+        collision_type = EVENT_NONE           # Stored return value.
+
+        # Surfaces hit since the frame time last moved forward.  Hitting one of them again without any time
+        # passing means the ball is wedged, and resolving more impacts would never finish.
+        wedged = []
+
+        # Stage walls are only checked when the ball leaves the box they enclose.
+        xmin, xmax, ymin, ymax, zmin, zmax = stage.bounds
+
+        while time_left > 0:
+            px, py, pz = pos.x, pos.y, pos.z
+            vx, vy, vz = vel.x, vel.y, vel.z
+
+            # Hypothetical ball position assuming no collision.
+            nx = px + (vx * time_left) / time_res
+            ny = py + (vy * time_left) / time_res
+            nz = pz + (vz * time_left) / time_res
+
+            # Queue the impacts, in the same order the surfaces are listed in (see first_impact).
+            impacts = []
+
+            # Stage walls.  First checks to see if the boundary was crossed, if so then calculates the time.
+            if not (xmin < nx < xmax and ymin < ny < ymax and zmin < nz < zmax):
+                p = (px, py, pz)
+                v = (vx, vy, vz)
+                n = (nx, ny, nz)
+                for axis, bound, low, event, serve, priority in stage.planes:
+                    if v[axis] == 0:
+                        continue
+                    if low:
+                        if n[axis] > bound:
+                            continue
+                    elif n[axis] < bound:
+                        continue
+                    newvel = list(v)
+                    if serve:
+                        newvel[2] = serve * self.speed
+                    else:
+                        newvel[axis] = -v[axis]
+                    impacts.append(((bound - p[axis]) * time_res / v[axis], priority, event, newvel))
+
+            # Paddle collision.  The paddles are swept across the frame along with the ball, so that neither a fast
+            # ball nor a paddle snapping forward can pass through each other.
+            if vz < 0:
+                hit = paddle1.sweep(1, time_res - time_left, time_left, px, py, pz, vx, vy, vz, self.size)
+                if hit:
+                    t, hitx, hity = hit
+                    newvel = [vx, vy, -vz]
+
+                    # If paddle is moving forward, bounce the ball off.
+                    if ( paddle1.delta.z > 0 ):
+                        newvel[2] += 4*246
+
+                        # Apply some pong like angling based on where it hits the paddle.
+                        if ( hitx > 20 ):
+                            newvel[0] += 2*256
+                        if ( hitx < -20 ):
+                            newvel[0] -= 2*256
+
+                        if ( hity > 15 ):
+                            newvel[1] += 2*256
+                        if ( hity < -15 ):
+                            newvel[1] -= 2*256
+
+                    impacts.append((t, PRIORITY_PADDLE1, EVENT_PADDLE1, newvel))
+            # Computer paddle.
+            elif vz > 0:
+                hit = paddle2.sweep(-1, time_res - time_left, time_left, px, py, pz, vx, vy, vz, self.size)
+                if hit:
+                    newvel = [vx, vy, -vz + ( paddle1.delta.z != 0 ) * 2*256]
+                    impacts.append((hit[0], PRIORITY_PADDLE2, EVENT_PADDLE2, newvel))
+
+            if not impacts:
+                break
+            first = first_impact(impacts)
+            if first is None:
+                break
+            t, priority, event, newvel = first
+            if priority in wedged:
+                break
+
+            # Advance the ball to the point of the first impact.
+            pos.x += vx * t / time_res
+            pos.y += vy * t / time_res
+            pos.z += vz * t / time_res
+            vel.x, vel.y, vel.z = newvel
+
+            time_left -= t
+            if t > 0:
+                wedged = []
+            wedged.append(priority)
+
+            collision_type = event
+            if events is not None:
+                events.append(event)
+
+        # If there's time left in the frame w/o collision, finish it up.
+        if time_left > 0:
+            pos.x += vel.x * time_left / time_res
+            pos.y += vel.y * time_left / time_res
+            pos.z += vel.z * time_left / time_res
+
+        # Apply gravity.
+        vel.y += stage.gravity
+        if ( pos.y + self.size + 20 > stage.window.bottom and vel.y == 0 ):
+            vel.y -= 6
+        vel.x += stage.crossgravity
+
+        return collision_type
+
+class Paddle:
+    def __init__(self):
+        # Center of the paddle
+        self.pos = Vector()
+
+        # Physics stuff
+        self.delta = Vector() # Amount moved since last update for spin calc.
+        self.halfwidth = 0
+        self.halfheight = 0
+
+        # Stuff for moving the paddle forward.
+        self.targetz = 0
+        self.defaultz = 0
+        self.forwardz = 0
+
+        # AI stuff
+        self.vel = Vector()
+        self.speed = 0
+
+        # Game stuff
+        self.score = 0
+
+    def clip_position (self, stage):
+        self.pos.x = max(self.pos.x, self.halfwidth)
+        self.pos.y = max(self.pos.y, self.halfheight)
+        self.pos.x = min(self.pos.x, stage.window.right - self.halfwidth)
+        self.pos.y = min(self.pos.y, stage.window.bottom - self.halfheight)
+
+    def sweep (self, facing, elapsed, time_left, px, py, pz, vx, vy, vz, size):
+        """Continuous collision test between the ball and the paddle for the rest of the frame.
+
+        The paddle moved by delta over the frame.  The ball, a sphere of the given size, is at (px, py, pz) at time
+        elapsed and moves by (vx, vy, vz) per frame.  facing is 1 if the paddle is hit from the far side, -1 if it is
+        hit from the near side.  Returns (time, x, y), the time of impact counted from elapsed and the point hit
+        relative to the paddle center, or None if the ball misses the paddle."""
+        delta = self.delta
+
+        # Distance from the ball to the paddle face, and how much it changes per frame.
+        gap = facing * (pz - (self.pos.z - delta.z + delta.z * elapsed / time_res))
+        rate = facing * (vz - delta.z)
+        if gap < 0 or rate >= 0 or gap + rate * time_left / time_res > 0:
+            return None
+
+        t = min(gap * time_res / -rate, time_left)
+
+        # Check the ball against the paddle rectangle, both where they are at the time of impact.
+        when = elapsed + t
+        x = px + vx * t / time_res - (self.pos.x - delta.x + delta.x * when / time_res)
+        if x > self.halfwidth + size or x < -self.halfwidth - size:
+            return None
+        y = py + vy * t / time_res - (self.pos.y - delta.y + delta.y * when / time_res)
+        if y > self.halfheight + size or y < -self.halfheight - size:
+            return None
+
+        return t, x, y
+
+    def setup_player(self, desc, stage):
+        w = to_fixed(desc['PaddleWidth'])
+        h = to_fixed(desc['PaddleHeight'])
+
+        self.halfwidth = w
+        self.halfheight = h
+
+        self.delta = Vector()
+        self.pos = Vector(to_fixed(25), to_fixed(50), to_fixed(10))
+        self.clip_position(stage)
+
+        self.defaultz = self.pos.z
+        self.targetz = self.pos.z
+        self.forwardz = to_fixed(40)
+
+        self.score = 0
+
+    def update_player (self, inputs, stage):
+        """Apply the player inputs to the paddle."""
+        lastpos = Vector()
+        lastpos.x = self.pos.x
+        lastpos.y = self.pos.y
+        lastpos.z = self.pos.z
+
+        if ( inputs.forward ):
+            self.targetz = self.forwardz
+        else:
+            self.targetz = self.defaultz
+
+        # Snaps forward, eases back.
+        if ( self.pos.z < self.targetz ):
+            if ( self.delta.z < to_fixed(4) ):
+                self.delta.z = to_fixed(6)
+            self.pos.z += self.delta.z + to_fixed(2)
+            if ( self.pos.z > self.targetz ):
+                self.pos.z = self.targetz
+
+        if ( self.pos.z > self.targetz ):
+            self.pos.z += ( self.targetz - self.pos.z ) / 4
+
+        # Get the 2d position from the pen.
+        self.pos.x = to_fixed(inputs.penx)
+        self.pos.y = to_fixed(inputs.peny)
+        self.clip_position(stage)
+
+        self.delta.x = self.pos.x - lastpos.x
+        self.delta.y = self.pos.y - lastpos.y
+        self.delta.z = self.pos.z - lastpos.z
+
+    def setup_ai(self, desc, stage):
+        w = to_fixed(desc['PaddleWidth'])
+        h = to_fixed(desc['PaddleHeight'])
+
+        self.score = 0
+
+        self.halfwidth = w
+        self.halfheight = h
+
+        self.pos = Vector(to_fixed(75), to_fixed(50), stage.depth - to_fixed(10))
+
+        self.defaultz = self.pos.z
+        self.targetz = self.pos.z
+        self.forwardz = stage.depth - 40*256
+
+        self.delta = Vector()
+        self.vel = Vector()
+
+        self.clip_position(stage)
+
+    def update_ai (self, ball, stage, ai):
+        """Compute AI and move paddle."""
+        lastx = self.pos.x
+        lasty = self.pos.y
+
+        # Only move when the ball is coming back, that way it appears to react to the players hit.
+        # Actually, start moving just before the player hits it.
+        if ( ball.vel.z > 0 or ball.vel.z < 0 and ball.pos.z < to_fixed(30)) :
+            # Acceleration towards the ball.
+            if ( math.fabs( ( self.pos.x - ball.pos.x ) ) > to_fixed(5) ):
+                if ( self.pos.x < ball.pos.x ):
+                    self.vel.x += to_fixed(4)
+                if ( self.pos.x > ball.pos.x ):
+                    self.vel.x -= to_fixed(4)
+
+            if ( math.fabs( ( self.pos.y - ball.pos.y ) ) > to_fixed(5) ):
+                if ( self.pos.y < ball.pos.y ):
+                    self.vel.y += to_fixed(4)
+                if ( self.pos.y > ball.pos.y ):
+                    self.vel.y -= to_fixed(4)
+
+            # Speed clamping
+            self.vel.x = clamp( self.vel.x, -ai.speed, ai.speed )
+            self.vel.y = clamp( self.vel.y, -ai.speed, ai.speed )
+        elif ( ball.pos.z < stage.depth/2 ):
+            self.vel.x = 0
+            self.vel.y = 0
+            # Drift towards the center.
+            if ( ai.recenter ):
+                self.pos.x += ( to_fixed(50) - self.pos.x ) / 4
+                self.pos.y += ( to_fixed(50) - self.pos.y ) / 4
+
+        # Friction
+        if ( self.vel.x > 0 ):
+            self.vel.x -= 1
+        if ( self.vel.x < 0 ):
+            self.vel.x += 1
+
+        if ( self.vel.y > 0 ):
+            self.vel.y -= 1
+        if ( self.vel.y < 0 ):
+            self.vel.y += 1
+
+        self.pos.x += self.vel.x
+        self.pos.y += self.vel.y
+        self.clip_position(stage)
+
+        self.delta.x = self.pos.x - lastx
+        self.delta.y = self.pos.y - lasty
+
+class Stage:
+    def __init__(self):
+        self.name = ''
+        self.depth = 0
+        self.gravity = 0
+        self.crossgravity = 0
+        self.window = Rect()
+        self.planes = []
+        self.bounds = (0, 0, 0, 0, 0, 0)
+
+    def setup(self, desc):
+        self.name = desc['Name']
+        self.depth = to_fixed(desc['StageDepth'])
+        self.gravity = to_fixed(desc['StageYGravity'])
+        self.crossgravity = to_fixed(desc['StageXGravity'])
+
+        self.window.left = 0
+        self.window.right = to_fixed(99)
+        self.window.top = 0
+        self.window.bottom = to_fixed(99)
+
+        # Boundary planes used by Ball.update.  Each is (axis, bound, low, event, serve, priority): the ball touches
+        # the plane when its position along axis (0-2 for x-z) equals bound, and crosses it when moving below bound
+        # for low planes or above it otherwise.  serve is 0 to reflect the ball, or the direction to serve it in.
+        size = to_fixed(desc['BallSize'])
+        self.planes = [
+            (0, self.window.left + size, True, EVENT_WALL, 0, 0),                  # Left wall
+            (0, self.window.right - size, False, EVENT_WALL, 0, 1),                # Right wall
+            (1, self.window.top + size, True, EVENT_WALL, 0, 2),                   # Top wall
+            (1, self.window.bottom - size, False, EVENT_WALL, 0, 3),               # Bottom wall
+            (2, 0, True, EVENT_SCORE2, 1, 4),                                      # Front wall
+            (2, self.depth, False, EVENT_SCORE1, -1, 5),                           # Back wall
+        ]
+
+        # The box enclosed by the planes, as (xmin, xmax, ymin, ymax, zmin, zmax).
+        self.bounds = tuple([plane[1] for plane in self.planes])
+
+class AI:
+    def __init__(self):
+        self.speed = 0
+        self.recenter = False
+
+    def setup (self, desc):
+        self.speed = to_fixed(desc['AISpeed'])
+        self.recenter = desc['AIRecenter']
+
+# Player input for a single animation frame.  The pen position is given in stage units (0-100 on each axis), and
+# forward is set while the paddle is being pushed forward (mouse button held down).
+class Inputs:
+    def __init__(self, penx=50, peny=50, forward=0):
+        self.penx = penx
+        self.peny = peny
+        self.forward = forward
+
+# Complete state of a match.  The objects can be replaced with subclasses (e.g. ones that know how to draw
+# themselves) by passing them to the constructor.
+class World:
+    def __init__(self, stage=None, ball=None, paddle1=None, paddle2=None, ai=None):
+        self.stage = stage or Stage()
+        self.ball = ball or Ball()
+        self.paddle1 = paddle1 or Paddle()
+        self.paddle2 = paddle2 or Paddle()
+        self.ai = ai or AI()
+
+        # Number of frames simulated since the last setup.
+        self.frame = 0
+
+    def setup(self, desc):
+        self.stage.setup(desc)
+        self.ball.setup(desc)
+        self.ai.setup(desc)
+
+        self.paddle1.setup_player(desc, self.stage)
+        self.paddle2.setup_ai(desc, self.stage)
+
+        self.frame = 0
+
+def step(world, inputs):
+    """Advances world by one animation frame using the given player inputs.  Returns the list of collision events
+    (EVENT_* constants) that happened during the frame, in order."""
+    events = []
+
+    # Process player input and AI.
+    world.paddle1.update_player(inputs, world.stage)
+    world.paddle2.update_ai(world.ball, world.stage, world.ai)
+
+    # Run the ball simulation.
+    world.ball.update(world.paddle1, world.paddle2, world.stage, events)
+
+    # Calculate scores if any collisions with the back walls happened.
+    if EVENT_SCORE1 in events:
+        world.paddle1.score += 1
+    if EVENT_SCORE2 in events:
+        world.paddle2.score += 1
+
+    world.frame += 1
+
+    return events
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Copyright 2009 by Wade Brainerd.
+# This file is part of Bounce.
+#
+# Bounce is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bounce is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bounce.  If not, see <http://www.gnu.org/licenses/>.
+"""Paddle collision stress test.
+
+Fires randomized shots at both paddles and checks that simulation.Ball.update reports a paddle collision exactly
+when the ball meets the paddle.  Each shot sets up a single frame in which a fast ball, moving up to a large
+fraction of the stage depth per frame, crosses the plane of a paddle that may itself be snapping forward or sliding
+sideways.  The point where the ball crosses is chosen to be either well inside the paddle, which must be reported
+as a hit, or well outside of it, which must not.  The tolerance around the paddle edge covers the rounding of the
+fixed point math.
+
+Usage: stress_paddles.py [options]
+"""
+
+import sys, time, random, optparse, multiprocessing
+
+from simulation import *
+
+# Stage used for every shot.  Deep enough that the fastest shots can't reach the far wall within the frame.
+STAGE_DESC = { 'Name': 'stress', 'StageDepth': 400, 'StageXGravity': 0, 'StageYGravity': 0, 'BallSize': 1,
+               'BallSpeed': 2, 'PaddleWidth': 20, 'PaddleHeight': 20, 'AISpeed': 1, 'AIRecenter': 1, }
+
+# Fastest ball speed along z, in stage units per frame.
+MAX_SPEED = 150
+
+# Fastest sideways ball and paddle movement, in stage units per frame.
+MAX_DRIFT = 30
+
+def make_shot(rnd, world, paddle, facing, hit):
+    """Places the ball and the paddle for a shot, returns False if the shot doesn't fit in the stage."""
+    stage = world.stage
+    ball = world.ball
+    size = ball.size
+
+    paddle.halfwidth = to_fixed(rnd.uniform(5, 30))
+    paddle.halfheight = to_fixed(rnd.uniform(5, 30))
+    paddle.pos = Vector(to_fixed(rnd.uniform(0, 99)), to_fixed(rnd.uniform(0, 99)), paddle.pos.z)
+    paddle.clip_position(stage)
+    paddle.delta = Vector(to_fixed(rnd.uniform(-MAX_DRIFT, MAX_DRIFT)), to_fixed(rnd.uniform(-MAX_DRIFT, MAX_DRIFT)),
+                          0)
+    if facing > 0:
+        # The player paddle snaps forward by up to its full stroke in a single frame.
+        paddle.pos.z = to_fixed(rnd.uniform(10, 40))
+        if rnd.random() < 0.5:
+            paddle.delta.z = min(to_fixed(rnd.uniform(0, 30)), paddle.pos.z - to_fixed(10))
+
+    ball.vel = Vector(to_fixed(rnd.uniform(-MAX_DRIFT, MAX_DRIFT)), to_fixed(rnd.uniform(-MAX_DRIFT, MAX_DRIFT)),
+                      -facing * to_fixed(rnd.uniform(1, MAX_SPEED)))
+
+    # Time of contact within the frame, and the distance from the ball to the paddle face at the start of the frame.
+    contact = rnd.randint(0, time_res - 1)
+    rate = facing * (ball.vel.z - paddle.delta.z)
+    gap = -rate * contact / time_res
+
+    # Paddle and ball position at the time of contact, the ball being offset from the paddle center by a margin
+    # that keeps it clear of the edge once rounding is taken into account.
+    padx = paddle.pos.x - paddle.delta.x + paddle.delta.x * contact / time_res
+    pady = paddle.pos.y - paddle.delta.y + paddle.delta.y * contact / time_res
+    marginx = (abs(ball.vel.x) + abs(paddle.delta.x)) / time_res + 4
+    marginy = (abs(ball.vel.y) + abs(paddle.delta.y)) / time_res + 4
+    reachx = paddle.halfwidth + size
+    reachy = paddle.halfheight + size
+    if hit:
+        if reachx <= marginx or reachy <= marginy:
+            return False
+        offx = rnd.randint(-reachx + marginx, reachx - marginx)
+        offy = rnd.randint(-reachy + marginy, reachy - marginy)
+    else:
+        # Miss on one axis at least.
+        offx = rnd.randint(-reachx + marginx, reachx - marginx) if reachx > marginx else 0
+        offy = rnd.randint(-reachy + marginy, reachy - marginy) if reachy > marginy else 0
+        if rnd.random() < 0.5:
+            offx = rnd.randint(reachx + marginx, reachx + marginx + to_fixed(20)) * rnd.choice((-1, 1))
+        else:
+            offy = rnd.randint(reachy + marginy, reachy + marginy + to_fixed(20)) * rnd.choice((-1, 1))
+
+    hitx = padx + offx
+    hity = pady + offy
+    ball.pos = Vector(hitx - ball.vel.x * contact / time_res, hity - ball.vel.y * contact / time_res,
+                      paddle.pos.z - paddle.delta.z + facing * gap)
+
+    # The ball must travel inside the stage up to the paddle, so that no wall gets in the way.
+    for x, y in ((ball.pos.x, ball.pos.y), (hitx, hity)):
+        if x - size <= stage.window.left or x + size >= stage.window.right:
+            return False
+        if y - size <= stage.window.top or y + size >= stage.window.bottom:
+            return False
+    return size < ball.pos.z < stage.depth - size
+
+def fire(task):
+    """Fires a chunk of shots.  Returns the number of shots fired and a list of the failed ones."""
+    seed, shots = task
+    rnd = random.Random(seed)
+    world = World()
+    world.setup(STAGE_DESC)
+
+    fired = 0
+    failures = []
+    while fired < shots:
+        facing = rnd.choice((1, -1))
+        hit = rnd.random() < 0.5
+        if facing > 0:
+            paddle, event = world.paddle1, EVENT_PADDLE1
+        else:
+            paddle, event = world.paddle2, EVENT_PADDLE2
+        world.paddle2.pos.z = world.stage.depth - to_fixed(10)
+        if not make_shot(rnd, world, paddle, facing, hit):
+            continue
+
+        shot = (facing, hit, world.ball.pos.__dict__.copy(), world.ball.vel.__dict__.copy(),
+                paddle.pos.__dict__.copy(), paddle.delta.__dict__.copy(), paddle.halfwidth, paddle.halfheight)
+        events = []
+        world.ball.update(world.paddle1, world.paddle2, world.stage, events)
+        fired += 1
+        if (event in events) != hit:
+            failures.append(shot)
+    return fired, failures
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--shots', type='int', default=1000000,
+                      help='shots to fire [default: %default]')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+                      help='worker processes [default: %default]')
+    parser.add_option('-c', '--chunk', type='int', default=20000,
+                      help='shots fired together by a worker [default: %default]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='random seed [default: %default]')
+    options, args = parser.parse_args(argv[1:])
+
+    tasks = []
+    left = options.shots
+    while left > 0:
+        n = min(left, options.chunk)
+        tasks.append((options.seed + len(tasks), n))
+        left -= n
+
+    start = time.time()
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        chunks = pool.map(fire, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    fired = sum(c[0] for c in chunks)
+    failures = [f for c in chunks for f in c[1]]
+    for facing, hit, pos, vel, padpos, paddelta, halfwidth, halfheight in failures[:10]:
+        print('%s paddle %d: ball %r vel %r, paddle %r delta %r size %dx%d' % (
+            hit and 'missed' or 'false hit on', facing > 0 and 1 or 2, pos, vel, padpos, paddelta,
+            halfwidth, halfheight))
+    print('%d shots in %.2fs, %d failed' % (fired, elapsed, len(failures)))
+
+    return len(failures) != 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))